@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+from aiohttp import web
+from moderator import Moderator, ModerationResult
+from metrics import MetricsRegistry
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+@dataclass
+class Job:
+    """Handle of one submitted video"""
+    id: str
+    video_path: str
+    status: str = "queued"  # queued/running/done/failed/timed_out
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[ModerationResult] = None
+    error: Optional[str] = None
+    _done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    async def wait(self) -> "Job":
+        """Wait until the job has finished, successfully or not"""
+        await self._done.wait()
+        return self
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "video_path": self.video_path,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result.to_dict() if self.result is not None else None,
+            "error": self.error
+        }
+
+class AsyncModerationService:
+    """
+    Asyncio front end that feeds videos to a Moderator through a bounded queue.
+
+    submit() admits a job only while the queue has room, so ingest bursts
+    queue up to max_queue and are then rejected instead of growing work
+    without bound. A fixed number of workers take jobs off the queue and
+    run them on a dedicated thread pool of the same size, each under a
+    per-job timeout. Finished jobs are streamed to every results()
+    subscriber.
+    """
+
+    def __init__(self, moderator: Optional[Moderator] = None, max_queue: int = 100,
+                 concurrency: int = 4, timeout: Optional[float] = 300.0, retain_jobs: int = 10000):
+        """
+        Initialize service; call start() from the event loop before submitting.
+
+        Args:
+            moderator: Moderator to run jobs on (default: a new one)
+            max_queue: Maximum number of jobs waiting to run
+            concurrency: Maximum number of videos moderated at once
+            timeout: Seconds after which a running job is reported as timed out
+            retain_jobs: Number of finished jobs kept for lookup by ID
+        """
+        self.moderator = moderator or Moderator()
+        self.max_queue = max_queue
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retain_jobs = retain_jobs
+        self.jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._subscribers: List[asyncio.Queue] = []
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="moderate")
+        self._running = 0
+
+    async def start(self):
+        """Start the worker tasks"""
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, drain: bool = True):
+        """
+        Stop the workers.
+
+        Args:
+            drain: Finish every queued job first
+        """
+        if drain:
+            await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._executor.shutdown(wait=drain)
+
+    async def submit(self, video_path: str, wait: bool = False) -> Job:
+        """
+        Queue a video for moderation.
+
+        Args:
+            video_path: Path to video file
+            wait: Wait for room in the queue instead of failing when it is full
+
+        Returns:
+            Job handle; await job.wait() for the result
+
+        Raises:
+            FileNotFoundError: If the video does not exist
+            QueueFullError: If the queue is full and wait is False
+        """
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"Video file not found: {video_path}")
+        job = Job(id=uuid.uuid4().hex, video_path=video_path)
+        if wait:
+            await self._queue.put(job)
+        else:
+            try:
+                self._queue.put_nowait(job)
+            except asyncio.QueueFull:
+                raise QueueFullError(f"Moderation queue is full ({self.max_queue} jobs)")
+        self.jobs[job.id] = job
+        self._forget_old_jobs()
+        return job
+
+    def job(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def results(self) -> AsyncIterator[Job]:
+        """Yield every job finishing from now on, as it finishes"""
+        subscriber = asyncio.Queue()
+        self._subscribers.append(subscriber)
+        try:
+            while True:
+                yield await subscriber.get()
+        finally:
+            self._subscribers.remove(subscriber)
+
+    def stats(self) -> Dict:
+        """Queue depth, running jobs and per-stage scheduler load"""
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "concurrency": self.concurrency,
+            "stages": self.moderator.scheduler.stats()
+        }
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(len(self.jobs) - self.retain_jobs, 0)]:
+            del self.jobs[job_id]
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            MetricsRegistry.default().observe("moderation_job_queue_seconds", job.started_at - job.submitted_at)
+            self._running += 1
+            try:
+                job.result = await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, self.moderator.process_video, job.video_path),
+                    self.timeout
+                )
+                job.status = "done"
+            except asyncio.TimeoutError:
+                # The moderation thread cannot be interrupted; it finishes in the
+                # background while still occupying one of the executor's threads
+                job.status = "timed_out"
+                job.error = f"Moderation exceeded {self.timeout} s"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                self._running -= 1
+                job.finished_at = time.time()
+                job._done.set()
+                for subscriber in self._subscribers:
+                    subscriber.put_nowait(job)
+                self._queue.task_done()
+
+def create_app(service: AsyncModerationService) -> web.Application:
+    """
+    HTTP API over the service.
+
+    POST /jobs {"video_path": ...} -> 202 job (429 when the queue is full)
+    GET /jobs/{id}[?wait=1]        -> job, optionally after it finishes
+    GET /results                   -> finished jobs as newline-delimited JSON
+    GET /stats                     -> queue and stage load
+    GET /metrics                   -> counters and latency histograms in the Prometheus text format
+    """
+    routes = web.RouteTableDef()
+
+    @routes.post("/jobs")
+    async def submit(request: web.Request) -> web.Response:
+        body = await request.json()
+        try:
+            job = await service.submit(body["video_path"])
+        except KeyError:
+            return web.json_response({"error": "video_path is required"}, status=400)
+        except FileNotFoundError as e:
+            return web.json_response({"error": str(e)}, status=404)
+        except QueueFullError as e:
+            return web.json_response({"error": str(e)}, status=429, headers={"Retry-After": "5"})
+        return web.json_response(job.to_dict(), status=202)
+
+    @routes.get("/jobs/{job_id}")
+    async def get_job(request: web.Request) -> web.Response:
+        job = service.job(request.match_info["job_id"])
+        if job is None:
+            return web.json_response({"error": "Unknown job"}, status=404)
+        if request.query.get("wait"):
+            await job.wait()
+        return web.json_response(job.to_dict())
+
+    @routes.get("/results")
+    async def stream_results(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        async for job in service.results():
+            await response.write((json.dumps(job.to_dict()) + "\n").encode())
+        return response
+
+    @routes.get("/stats")
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(service.stats())
+
+    @routes.get("/metrics")
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            text=service.moderator.prometheus_metrics(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    async def on_startup(app: web.Application):
+        await service.start()
+
+    async def on_cleanup(app: web.Application):
+        await service.stop(drain=False)
+
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+def serve(service: AsyncModerationService, host: str = "127.0.0.1", port: int = 8080):
+    """Run the HTTP API until interrupted"""
+    web.run_app(create_app(service), host=host, port=port)
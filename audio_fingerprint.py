@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from audio_source import SAMPLE_RATE, read_pcm
+from faiss_index import IdMap
+from metrics import span
+
+# Spectrogram: 128 ms windows every 32 ms, up to 4 kHz (where music peaks
+# survive speech, compression and resampling)
+FFT_SIZE = 2048
+HOP = 512
+MIN_BIN = 4
+MAX_BIN = 512
+FRAME_SECONDS = HOP / SAMPLE_RATE
+
+# Peaks are local maxima over about 0.3 s and 160 Hz, at most this many per second
+PEAK_FRAMES = 9
+PEAK_BINS = 21
+PEAKS_PER_SECOND = 30
+
+# Each anchor peak is paired with up to FAN_OUT later peaks less than 2 s
+# and MAX_DF bins away; a landmark hash packs (anchor bin, target bin, dt)
+FAN_OUT = 10
+MAX_DT = 63
+MAX_DF = 127
+
+_WINDOW = np.hanning(FFT_SIZE).astype(np.float32)
+
+# Delta file records and base index postings
+RECORD = np.dtype([("hash", "<u4"), ("track", "<i4"), ("time", "<i4")])
+POSTING = np.dtype([("track", "<i4"), ("time", "<i4")])
+
+@dataclass
+class Landmarks:
+    """Hashed peak pairs of a recording"""
+    hashes: np.ndarray  # uint32
+    times: np.ndarray  # int32, spectrogram frame of the anchor peak
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+def spectrogram(pcm: np.ndarray, chunk_frames: int = 1024) -> np.ndarray:
+    """Log-magnitude spectrogram of 16 kHz mono PCM, of shape (frames, MAX_BIN)"""
+    pcm = np.ascontiguousarray(pcm, dtype=np.float32)
+    if len(pcm) < FFT_SIZE:
+        return np.zeros((0, MAX_BIN), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(pcm, FFT_SIZE)[::HOP]
+    # Chunked so the complex spectrum of a long track is never held at once
+    return np.concatenate([
+        np.log(np.abs(np.fft.rfft(frames[start:start + chunk_frames] * _WINDOW, axis=1))[:, :MAX_BIN] + 1e-6)
+        for start in range(0, len(frames), chunk_frames)
+    ]).astype(np.float32)
+
+def _max_filter(values: np.ndarray, size: int, axis: int) -> np.ndarray:
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (size // 2, size // 2)
+    padded = np.pad(values, pad, constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, size, axis=axis).max(axis=-1)
+
+def find_peaks(spec: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Spectral peaks: points that are the maximum of their neighbourhood and
+    above the mean level, the strongest PEAKS_PER_SECOND per second kept.
+
+    Returns:
+        (frames, bins) of the peaks, sorted by frame then bin
+    """
+    if not len(spec):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # A rectangular maximum filter is separable
+    local = _max_filter(_max_filter(spec, PEAK_FRAMES, axis=0), PEAK_BINS, axis=1)
+    is_peak = (spec == local) & (spec > spec.mean())
+    is_peak[:, :MIN_BIN] = False
+    frames, bins = np.nonzero(is_peak)
+    limit = max(int(PEAKS_PER_SECOND * len(spec) * FRAME_SECONDS), 1)
+    if len(frames) > limit:
+        strongest = np.argpartition(-spec[frames, bins], limit)[:limit]
+        frames, bins = frames[strongest], bins[strongest]
+    order = np.lexsort((bins, frames))
+    return frames[order], bins[order]
+
+def landmarks(pcm: np.ndarray) -> Landmarks:
+    """
+    Fingerprint 16 kHz mono PCM as hashed spectral peak pairs.
+
+    Every peak anchors pairs with the next peaks in its target zone (1 to
+    MAX_DT frames later, within MAX_DF bins); pairs are formed for all
+    anchors at once over a (peaks, candidates) grid. A pair's hash only
+    depends on the two frequencies and their time difference, so it
+    survives mixing with speech, level changes and lossy re-encoding.
+    """
+    with span("audio_fingerprint.landmarks", "cpu"):
+        frames, bins = find_peaks(spectrogram(pcm))
+        n = len(frames)
+        anchors = np.arange(n)[:, np.newaxis]
+        targets = anchors + np.arange(1, 3 * FAN_OUT + 1)[np.newaxis, :]
+        valid = targets < n
+        targets = np.minimum(targets, max(n - 1, 0))
+        dt = frames[targets] - frames[anchors]
+        valid &= (dt >= 1) & (dt <= MAX_DT) & (np.abs(bins[targets] - bins[anchors]) <= MAX_DF)
+        valid &= np.cumsum(valid, axis=1) <= FAN_OUT
+        anchor, column = np.nonzero(valid)
+        target = targets[anchor, column]
+        hashes = (bins[anchor] << 15) | (bins[target] << 6) | dt[anchor, column]
+    return Landmarks(hashes.astype(np.uint32), frames[anchor].astype(np.int32))
+
+@dataclass
+class AudioMatch:
+    """Part of an upload's audio aligned with part of a reference track"""
+    track_id: str
+    matched_landmarks: int
+    score: float  # fraction of the upload's landmarks in the matched span that matched
+    query_start: float  # seconds into the upload
+    query_end: float
+    source_start: float  # seconds into the reference track
+    source_end: float
+
+    @property
+    def offset(self) -> float:
+        """Seconds to add to an upload time to get the track time"""
+        return self.source_start - self.query_start
+
+    def to_dict(self) -> Dict:
+        return {
+            "track_id": self.track_id,
+            "matched_landmarks": self.matched_landmarks,
+            "score": self.score,
+            "query_start": self.query_start,
+            "query_end": self.query_end,
+            "source_start": self.source_start,
+            "source_end": self.source_end,
+            "offset": self.offset
+        }
+
+def _expand(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, start + length) for every range, without a Python loop"""
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - ends + lengths, lengths) + np.arange(int(ends[-1]) if len(ends) else 0)
+
+class AudioFingerprintIndex:
+    """
+    On-disk inverted index from landmark hash to (track, time) postings.
+
+    The base index is three .npy files that readers memory-map: the
+    sorted distinct hashes, the offset of each hash's postings and the
+    postings, so a lookup is a vectorized binary search of every query
+    hash plus one gather of the matching posting ranges, and every worker
+    on a host shares the pages. New tracks are appended to a small delta
+    file of raw records; merge() folds it into a new base generation
+    without loading the old base into memory. Hashes with more than
+    max_postings postings are too common to discriminate and are skipped.
+
+    Files: <path>/manifest.json (current generation), base-<n>/ (keys,
+    offsets, postings), delta-<n>.bin, tracks.sqlite (track ID map).
+    """
+
+    def __init__(self, path: str, max_postings: int = 20000, refresh_interval: float = 30.0):
+        """
+        Open (or create) an index.
+
+        Args:
+            path: Index directory
+            max_postings: Longest posting list a lookup reads
+            refresh_interval: Minimum seconds between checks for index updates
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_postings = max_postings
+        self.refresh_interval = refresh_interval
+        self.id_map = IdMap(os.path.join(path, "tracks.sqlite"))
+        self._generation: Optional[int] = None
+        self._delta_size = -1
+        self._keys = np.zeros(0, dtype=np.uint32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings = np.zeros(0, dtype=POSTING)
+        self._delta = np.zeros(0, dtype=RECORD)
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across processes"""
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_generation(self) -> int:
+        try:
+            with open(os.path.join(self.path, "manifest.json")) as f:
+                return json.load(f)["generation"]
+        except FileNotFoundError:
+            return 0
+
+    def _base_dir(self, generation: int) -> str:
+        return os.path.join(self.path, f"base-{generation}")
+
+    def _delta_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"delta-{generation}.bin")
+
+    def refresh(self, force: bool = False):
+        """Map a newly merged base or grown delta (at most every refresh_interval seconds unless forced)"""
+        now = time.monotonic()
+        if not force and now - self._checked < self.refresh_interval:
+            return
+        self._checked = now
+        generation = self._read_generation()
+        delta_path = self._delta_path(generation)
+        delta_size = os.path.getsize(delta_path) if os.path.exists(delta_path) else 0
+        with self._lock:
+            if generation != self._generation:
+                base = self._base_dir(generation)
+                if os.path.isdir(base):
+                    self._keys = np.load(os.path.join(base, "keys.npy"), mmap_mode="r")
+                    self._offsets = np.load(os.path.join(base, "offsets.npy"), mmap_mode="r")
+                    self._postings = np.load(os.path.join(base, "postings.npy"), mmap_mode="r")
+                self._generation = generation
+                self._delta_size = -1
+            if delta_size != self._delta_size:
+                # A partial record left by an interrupted writer is ignored
+                rows = delta_size // RECORD.itemsize
+                self._delta = (np.memmap(delta_path, dtype=RECORD, mode="r", shape=(rows,))
+                               if rows else np.zeros(0, dtype=RECORD))
+                self._delta_size = delta_size
+
+    def add(self, track_id: str, prints: Landmarks):
+        """Append a reference track's landmarks to the delta"""
+        track = int(self.id_map.assign([track_id])[0])
+        records = np.empty(len(prints), dtype=RECORD)
+        records["hash"] = prints.hashes
+        records["track"] = track
+        records["time"] = prints.times
+        with self._write_lock():
+            path = self._delta_path(self._read_generation())
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            row = size // RECORD.itemsize
+            with open(path, "r+b" if size else "wb") as f:
+                # Drop a partial record left behind by an interrupted writer
+                f.truncate(row * RECORD.itemsize)
+                f.seek(row * RECORD.itemsize)
+                f.write(records.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self.refresh(force=True)
+
+    def add_file(self, track_id: str, path: str):
+        """Fingerprint and add a reference recording (any file ffmpeg can decode)"""
+        self.add(track_id, landmarks(read_pcm(path)))
+
+    def merge(self, chunk_keys: int = 1 << 20):
+        """
+        Fold the delta into a new base generation.
+
+        Postings are written straight into the new memory-mapped file, the
+        old base being copied chunk_keys hashes at a time, so memory grows
+        with the number of distinct hashes and the delta only.
+        """
+        with self._write_lock():
+            self.refresh(force=True)
+            generation = self._generation
+            keys, offsets, postings = self._keys, np.asarray(self._offsets), self._postings
+            delta = np.array(self._delta)
+            if not len(delta):
+                return
+            delta = delta[np.argsort(delta["hash"], kind="stable")]
+            delta_keys, delta_starts, delta_counts = np.unique(delta["hash"], return_index=True, return_counts=True)
+
+            new_keys = np.union1d(keys, delta_keys).astype(np.uint32)
+            base_pos = np.searchsorted(new_keys, keys)
+            delta_pos = np.searchsorted(new_keys, delta_keys)
+            base_counts = np.zeros(len(new_keys), dtype=np.int64)
+            base_counts[base_pos] = np.diff(offsets)
+            counts = base_counts.copy()
+            counts[delta_pos] += delta_counts
+            new_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+            directory = self._base_dir(generation + 1)
+            os.makedirs(directory, exist_ok=True)
+            np.save(os.path.join(directory, "keys.npy"), new_keys)
+            np.save(os.path.join(directory, "offsets.npy"), new_offsets)
+            merged = np.lib.format.open_memmap(
+                os.path.join(directory, "postings.npy"), mode="w+", dtype=POSTING, shape=(int(new_offsets[-1]),)
+            )
+            # Old postings of a hash come first, in their old order, then the new ones
+            for start in range(0, len(keys), chunk_keys):
+                stop = min(start + chunk_keys, len(keys))
+                group = np.repeat(np.arange(start, stop), np.diff(offsets[start:stop + 1]))
+                rows = np.arange(offsets[start], offsets[stop])
+                merged[new_offsets[base_pos[group]] + rows - offsets[group]] = postings[offsets[start]:offsets[stop]]
+            group = np.repeat(np.arange(len(delta_keys)), delta_counts)
+            slot = delta_pos[group]
+            added = np.empty(len(delta), dtype=POSTING)
+            added["track"] = delta["track"]
+            added["time"] = delta["time"]
+            merged[new_offsets[slot] + base_counts[slot] + np.arange(len(delta)) - delta_starts[group]] = added
+            merged.flush()
+            del merged
+
+            temp_path = os.path.join(self.path, "manifest.json.tmp")
+            with open(temp_path, "w") as f:
+                json.dump({"generation": generation + 1}, f)
+            os.replace(temp_path, os.path.join(self.path, "manifest.json"))
+            # Readers still mapping the old generation keep their (unlinked) files
+            shutil.rmtree(self._base_dir(generation), ignore_errors=True)
+            try:
+                os.remove(self._delta_path(generation))
+            except OSError:
+                pass
+        self.refresh(force=True)
+
+    def _lookup(self, prints: Landmarks) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Join the query landmarks with the postings of their hashes.
+
+        Returns:
+            (track, track time, query time) of every hash hit
+        """
+        with self._lock:
+            keys, offsets, postings, delta = self._keys, self._offsets, self._postings, self._delta
+        tracks, track_times, query_times = [], [], []
+        if len(keys):
+            position = np.minimum(np.searchsorted(keys, prints.hashes), len(keys) - 1)
+            hit = keys[position] == prints.hashes
+            starts = offsets[position[hit]]
+            lengths = offsets[position[hit] + 1] - starts
+            common = lengths <= self.max_postings
+            starts, lengths = starts[common], lengths[common]
+            hits = postings[_expand(starts, lengths)]
+            tracks.append(hits["track"])
+            track_times.append(hits["time"])
+            query_times.append(np.repeat(prints.times[hit][common], lengths))
+        if len(delta):
+            # The delta is small and unsorted: search it against the sorted query instead
+            order = np.argsort(prints.hashes, kind="stable")
+            sorted_hashes = prints.hashes[order]
+            first = np.searchsorted(sorted_hashes, delta["hash"], side="left")
+            lengths = np.searchsorted(sorted_hashes, delta["hash"], side="right") - first
+            records = np.repeat(np.arange(len(delta)), lengths)
+            tracks.append(delta["track"][records])
+            track_times.append(delta["time"][records])
+            query_times.append(prints.times[order[_expand(first, lengths)]])
+        if not tracks:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64)
+        return tuple(np.concatenate(values).astype(np.int64) for values in (tracks, track_times, query_times))
+
+    def search(self, prints: Landmarks, min_matches: int = 20, max_results: int = 10,
+               max_skew: int = 1) -> List[AudioMatch]:
+        """
+        Reference tracks playing in a recording, by offset-histogram voting.
+
+        Every hash hit votes for its (track, track time - query time); a
+        track that really plays in the recording collects many votes at one
+        offset, while chance hits spread over all offsets. Votes up to
+        max_skew frames away count towards an offset, absorbing frame
+        quantization. Votes are counted for all tracks at once with one
+        sort of the packed (track, offset) keys.
+
+        Args:
+            prints: Landmarks of the recording
+            min_matches: Votes a track needs at its best offset
+            max_results: Tracks reported at most
+            max_skew: Offset tolerance in frames
+
+        Returns:
+            Matches, most votes first, with their time spans in both recordings
+        """
+        self.refresh()
+        if not len(prints):
+            return []
+        with span("audio_fingerprint.search", "cpu"):
+            tracks, track_times, query_times = self._lookup(prints)
+            if not len(tracks):
+                return []
+            offsets = track_times - query_times
+            votes = (tracks << 32) | (offsets + (1 << 31))
+            keys, counts = np.unique(votes, return_counts=True)
+            cumulative = np.concatenate([[0], np.cumsum(counts)])
+            smoothed = (cumulative[np.searchsorted(keys, keys + max_skew, side="right")]
+                        - cumulative[np.searchsorted(keys, keys - max_skew, side="left")])
+            # Skew windows never cross tracks: offsets stay far from the 32-bit boundary
+            key_tracks = keys >> 32
+            order = np.lexsort((-smoothed, key_tracks))
+            _, first = np.unique(key_tracks[order], return_index=True)
+            best = order[first]
+            best = best[smoothed[best] >= min_matches]
+            best = best[np.argsort(-smoothed[best], kind="stable")][:max_results]
+
+            names = self.id_map.video_ids_for(key_tracks[best].tolist())
+            matches = []
+            for index in best:
+                track = int(key_tracks[index])
+                offset = int(keys[index] & 0xFFFFFFFF) - (1 << 31)
+                aligned = (tracks == track) & (np.abs(offsets - offset) <= max_skew)
+                start, end = int(query_times[aligned].min()), int(query_times[aligned].max()) + 1
+                in_span = int(np.count_nonzero((prints.times >= start) & (prints.times < end)))
+                matches.append(AudioMatch(
+                    track_id=names.get(track, str(track)),
+                    matched_landmarks=int(np.count_nonzero(aligned)),
+                    score=float(np.count_nonzero(aligned) / max(in_span, 1)),
+                    query_start=start * FRAME_SECONDS,
+                    query_end=end * FRAME_SECONDS,
+                    source_start=(start + offset) * FRAME_SECONDS,
+                    source_end=(end + offset) * FRAME_SECONDS
+                ))
+        return matches
@@ -0,0 +1,35 @@
+import subprocess
+from typing import Optional
+import numpy as np
+from metrics import span
+
+# Sample rate every audio consumer works at (VGGish expects 16 kHz mono)
+SAMPLE_RATE = 16000
+
+def read_pcm(video_path: str, sample_rate: int = SAMPLE_RATE, duration: Optional[float] = None) -> np.ndarray:
+    """
+    Decode the audio track of a video into memory.
+
+    ffmpeg resamples to mono float32 PCM and writes it to a pipe that is
+    read straight into a NumPy buffer, so no temporary files are involved.
+
+    Args:
+        video_path: Path to video file
+        sample_rate: Output sample rate
+        duration: Only decode the first duration seconds (default: all)
+
+    Returns:
+        Samples in [-1, 1]; empty if the video has no audio track
+    """
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-i', video_path]
+    if duration is not None:
+        cmd += ['-t', str(duration)]
+    cmd += ['-map', '0:a:0?', '-vn', '-ac', '1', '-ar', str(sample_rate), '-f', 'f32le', 'pipe:1']
+    with span("decode.pcm", "decode"):
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        # Without an audio stream the optional map leaves ffmpeg nothing to write
+        if b"does not contain any stream" in process.stderr:
+            return np.zeros(0, dtype=np.float32)
+        raise RuntimeError(f"ffmpeg failed to decode audio of {video_path}: {process.stderr.decode(errors='replace')}")
+    return np.frombuffer(process.stdout, dtype=np.float32)
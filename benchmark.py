@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+import numpy as np
+from model_registry import ModelRegistry
+from moderator import Moderator
+
+@dataclass
+class Scenario:
+    """Synthetic test video"""
+    name: str
+    duration: float
+    width: int
+    height: int
+    codec: str = "libx264"  # libx264, libvpx-vp9 or mpeg4
+    audio: bool = True
+    text: bool = False
+
+    @property
+    def extension(self) -> str:
+        return ".webm" if self.codec == "libvpx-vp9" else ".mp4"
+
+SCENARIOS = [
+    Scenario("short-720p-h264", 10, 1280, 720),
+    Scenario("short-1080p-h264-text", 15, 1920, 1080, text=True),
+    Scenario("long-720p-h264", 60, 1280, 720),
+    Scenario("vertical-vp9-silent", 20, 720, 1280, codec="libvpx-vp9", audio=False),
+    Scenario("short-480p-mpeg4-text", 10, 854, 480, codec="mpeg4", text=True)
+]
+
+STAGES = ["decode", "audio", "nsfw", "ocr", "objects", "copyright", "quality", "content", "thumbnail"]
+
+def generate_video(scenario: Scenario, path: str):
+    """Render a synthetic video with ffmpeg's test sources (no network or assets needed)"""
+    video = f"testsrc2=size={scenario.width}x{scenario.height}:rate=30:duration={scenario.duration}"
+    if scenario.text:
+        # Caption that changes every 3 seconds, like short-form subtitles
+        video += (",drawtext=text='Caption %{eif\\:floor(t/3)\\:d}':fontsize=h/12:fontcolor=white"
+                  ":box=1:boxcolor=black@0.6:x=(w-tw)/2:y=h*0.8")
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', video]
+    if scenario.audio:
+        cmd += ['-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=44100:duration={scenario.duration}"]
+    cmd += ['-c:v', scenario.codec, '-pix_fmt', 'yuv420p']
+    if scenario.audio:
+        cmd += ['-c:a', 'libopus' if scenario.codec == "libvpx-vp9" else 'aac']
+    subprocess.run(cmd + [path], check=True)
+
+class _Tensor:
+    """Minimal stand-in for an eager tensor returned by a TensorFlow Hub signature"""
+    def __init__(self, value: np.ndarray):
+        self.value = value
+
+    def numpy(self) -> np.ndarray:
+        return self.value
+
+def _stub_i3d(inputs) -> Dict[str, _Tensor]:
+    clips = np.asarray(inputs, dtype=np.float32)
+    summary = clips.mean(axis=(2, 3)).reshape(len(clips), -1)
+    return {"default": _Tensor(np.resize(summary, (len(clips), 600)))}
+
+def _stub_vggish(inputs) -> Dict[str, _Tensor]:
+    audio = np.asarray(inputs, dtype=np.float32).reshape(-1)
+    patches = len(audio) // 15360
+    energy = np.square(audio[:patches * 15360]).reshape(patches, -1).mean(axis=1, keepdims=True)
+    return {"default": _Tensor(np.repeat(energy, 128, axis=1))}
+
+def _stub_nsfw(features: np.ndarray) -> np.ndarray:
+    score = 1 / (1 + np.exp(-np.asarray(features).mean(axis=1) / 100))
+    return np.stack([1 - score * 0.5, score * 0.5], axis=1)
+
+class _StubDetector:
+    """Deterministic object detector (no detections) for either backend interface"""
+    def detect(self, images):
+        return [[] for _ in images]
+
+class _StubFaces:
+    def detectMultiScale(self, gray):
+        return []
+
+def stub_registry() -> ModelRegistry:
+    """
+    Registry whose models are deterministic stubs.
+
+    Stubs are registered under the names the detectors use before the
+    detectors register their real loaders, and the first registration wins.
+    """
+    registry = ModelRegistry()
+    registry.register("i3d", lambda: _stub_i3d)
+    registry.register("vggish", lambda: _stub_vggish)
+    registry.register("nsfw:default", lambda: _stub_nsfw)
+    registry.register("yolo:yolo11n.pt:onnx:fp32:640", lambda: _StubDetector())
+    registry.register("face:default", lambda: _StubFaces())
+    registry.register("emotion:default", lambda: None)
+    return registry
+
+@contextmanager
+def _working_directory(path: str):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run_scenario(moderator: Moderator, path: str, duration: float, repeat: int = 1) -> Dict:
+    """
+    Moderate one video repeat times and report per-stage time, throughput and memory.
+
+    Stage times are the busy time of each scheduler stage averaged over the
+    repeats; thumbnail time adds the speculative choice on its stage and
+    writing (or, without a shared decode, choosing) it after the decision.
+    """
+    generate = moderator.thumbnail_generator.generate_thumbnail
+    thumbnail_seconds = []
+
+    def timed_thumbnail(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return generate(*args, **kwargs)
+        finally:
+            thumbnail_seconds.append(time.perf_counter() - start)
+
+    moderator.thumbnail_generator.generate_thumbnail = timed_thumbnail
+    before = moderator.scheduler.stats()
+    start = time.perf_counter()
+    try:
+        for _ in range(repeat):
+            moderator.process_video(path)
+    finally:
+        moderator.thumbnail_generator.generate_thumbnail = generate
+    elapsed = time.perf_counter() - start
+    after = moderator.scheduler.stats()
+
+    stages = {
+        stage: (after[stage]["busy_seconds"] - before.get(stage, {}).get("busy_seconds", 0.0)) / repeat
+        for stage in after
+    }
+    stages["thumbnail"] = stages.get("thumbnail", 0.0) + sum(thumbnail_seconds) / repeat
+    return {
+        "seconds_per_video": elapsed / repeat,
+        "videos_per_second": repeat / elapsed,
+        "video_seconds_per_second": repeat * duration / elapsed,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "stages": {stage: stages.get(stage, 0.0) for stage in STAGES}
+    }
+
+def run(scenarios: List[Scenario] = SCENARIOS, stub: bool = True, repeat: int = 3,
+        work_dir: Optional[str] = None) -> Dict[str, Dict]:
+    """
+    Generate the synthetic videos and benchmark Moderator.process_video on each.
+
+    Args:
+        scenarios: Videos to generate and moderate
+        stub: Replace heavy models with deterministic stubs
+        repeat: Runs per scenario (after one warm-up run)
+        work_dir: Directory for videos and detector output (default: a temporary one)
+
+    Returns:
+        Report per scenario name
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="moderation-bench-")
+    report = {}
+    with _working_directory(work_dir):
+        # Every check is reported, so every stage is measured whatever the decision rules read
+        moderator = Moderator(cache_results=False, registry=stub_registry() if stub else None,
+                              report_checks=list(Moderator.CHECK_VERSIONS))
+        if stub:
+            # Text recognition is the OCR model; region finding and change gating still run
+            moderator.ocr_processor._recognize = lambda gray, boxes: ["text"] * len(boxes)
+        try:
+            for scenario in scenarios:
+                path = os.path.join(work_dir, scenario.name + scenario.extension)
+                if not os.path.exists(path):
+                    generate_video(scenario, path)
+                moderator.process_video(path)  # warm-up: model loading and first-call costs
+                report[scenario.name] = dict(
+                    run_scenario(moderator, path, scenario.duration, repeat),
+                    scenario=asdict(scenario)
+                )
+        finally:
+            moderator.close()
+    return report
+
+def compare(report: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float = 0.2,
+            min_seconds: float = 0.01) -> List[str]:
+    """
+    List regressions of report against baseline.
+
+    A stage regresses when it takes more than (1 + tolerance) times its
+    baseline time (stages under min_seconds in both are ignored as noise);
+    a scenario regresses when its throughput drops by more than tolerance
+    or its peak RSS grows by more than tolerance.
+    """
+    regressions = []
+    for name, current in report.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current["videos_per_second"] < previous["videos_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {current['videos_per_second']:.3f} < {previous['videos_per_second']:.3f} videos/s"
+            )
+        if current["peak_rss_bytes"] > previous["peak_rss_bytes"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: peak RSS {current['peak_rss_bytes'] >> 20} MiB > {previous['peak_rss_bytes'] >> 20} MiB"
+            )
+        for stage, seconds in current["stages"].items():
+            before = previous["stages"].get(stage, 0.0)
+            if max(seconds, before) >= min_seconds and seconds > before * (1 + tolerance):
+                regressions.append(f"{name}: stage {stage} {seconds:.3f}s > {before:.3f}s")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the moderation pipeline on synthetic videos")
+    parser.add_argument("--real-models", action="store_true", help="Use the real models instead of stubs")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario")
+    parser.add_argument("--scenario", action="append", help="Only run these scenarios")
+    parser.add_argument("--work-dir", help="Keep generated videos here between runs")
+    parser.add_argument("--output", default="benchmark_report.json", help="Where to write the report")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="Baseline to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    keep = args.work_dir is not None
+    if keep:
+        os.makedirs(args.work_dir, exist_ok=True)
+    work_dir = os.path.abspath(args.work_dir) if keep else tempfile.mkdtemp(prefix="moderation-bench-")
+    try:
+        report = run(scenarios, stub=not args.real_models, repeat=args.repeat, work_dir=work_dir)
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for name, result in report.items():
+        stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in result["stages"].items())
+        print(f"{name}: {result['seconds_per_video']:.2f}s/video, "
+              f"{result['peak_rss_bytes'] >> 20} MiB peak RSS ({stages})")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
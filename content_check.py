@@ -1,22 +1,73 @@
-from typing import Dict
+from typing import Dict, List, Optional
+from media_probe import probe_video
+from rules import RuleSet
 
 class ContentChecker:
     """
     Business rule-based content checking for videos.
+    
+    The checker measures the video from its container header (duration,
+    size, aspect ratio, codec, frame rate, audio) without decoding it; the
+    business rules are declarative rules over those measurements (see
+    rules.py) and join the moderator's decision rules. Uploads breaking a
+    HIGH business rule are rejected before any other check runs.
     """
     
-    def __init__(self, rules_config: Dict = None):
+    def __init__(self, rules_config: Optional[List[Dict]] = None):
         """
         Initialize content checker with business rules.
         
         Args:
-            rules_config: Dictionary of business rules
+            rules_config: Business rules in the rules.Rule configuration format
         """
         self.rules = rules_config or self._load_default_rules()
+        self.rule_set = RuleSet.from_config(self.rules)
         
-    def _load_default_rules(self) -> Dict:
+    def _load_default_rules(self) -> List[Dict]:
         """Load default business rules for content checking"""
-        pass
+        return [
+            {"name": "too_short", "level": "HIGH", "when": [
+                {"signal": "content.duration", "op": "<", "value": 1.0}
+            ]},
+            {"name": "too_long", "level": "HIGH", "when": [
+                {"signal": "content.duration", "op": ">", "value": 180.0}
+            ]},
+            {"name": "extreme_aspect_ratio", "level": "HIGH", "match": "any", "when": [
+                {"signal": "content.aspect_ratio", "op": "<", "value": 0.5},
+                {"signal": "content.aspect_ratio", "op": ">", "value": 2.0}
+            ]}
+        ]
+        
+    def measure(self, video_path: str) -> Dict:
+        """
+        Read the stream properties the business rules are written against.
+        
+        Args:
+            video_path: Path to video file
+            
+        Returns:
+            Dictionary with duration (seconds), displayed width and height,
+            aspect_ratio (width / height), rotation, codec, fps and has_audio
+        """
+        info = probe_video(video_path)
+        return {
+            "duration": info.duration,
+            "width": info.width,
+            "height": info.height,
+            "aspect_ratio": info.aspect_ratio,
+            "rotation": info.rotation,
+            "codec": info.codec,
+            "fps": info.fps,
+            "has_audio": info.has_audio
+        }
+        
+    def _violations(self, measurements: Dict, signals: Optional[List[str]] = None) -> List[str]:
+        """Names of the business rules (reading any of signals, if given) that fire"""
+        results = {"content": measurements}
+        return [
+            rule.name for rule in self.rule_set.rules
+            if (signals is None or any(c.signal in signals for c in rule.conditions)) and rule.fires(results)
+        ]
         
     def check_video_length(self, video_path: str) -> bool:
         """
@@ -28,7 +79,7 @@ class ContentChecker:
         Returns:
             True if length is acceptable
         """
-        pass
+        return not self._violations(self.measure(video_path), ["content.duration"])
         
     def check_aspect_ratio(self, video_path: str) -> bool:
         """
@@ -40,7 +91,8 @@ class ContentChecker:
         Returns:
             True if aspect ratio is acceptable
         """
-        pass
+        signals = ["content.aspect_ratio", "content.width", "content.height"]
+        return not self._violations(self.measure(video_path), signals)
         
     def run_content_checks(self, video_path: str) -> Dict:
         """
@@ -50,6 +102,7 @@ class ContentChecker:
             video_path: Path to video file
             
         Returns:
-            Dictionary of check results
+            Dictionary of measurements plus the names of the violated rules
         """
-        pass
+        measurements = self.measure(video_path)
+        return dict(measurements, violations=self._violations(measurements))
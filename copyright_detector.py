@@ -1,56 +1,179 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from functools import partial
+from frame_source import Frame
+from audio_source import read_pcm
+from audio_fingerprint import AudioFingerprintIndex, landmarks
+from feature_context import FeatureContext
 from video_similarity import VideoSimilarity
+from segment_index import ClipMatch
 from object_detection import ObjectDetector
 
 class CopyrightDetector:
     """
-    Detects copyrighted content by matching against known content database
-    and checking for copyrighted logos detected by object detection.
+    Detects copyrighted content by matching against known content database,
+    matching the audio against reference tracks (so a song under a
+    voice-over is still found) and checking for copyrighted logos detected
+    by object detection.
     """
     
-    def __init__(self, similarity_threshold: float = 0.9):
+    def __init__(self, similarity_threshold: float = 0.9,
+                 similarity_checker: Optional[VideoSimilarity] = None,
+                 object_detector: Optional[ObjectDetector] = None,
+                 audio_index: Optional[AudioFingerprintIndex] = None, min_audio_matches: int = 20):
         """
         Initialize copyright detector with similarity threshold.
         
         Args:
             similarity_threshold: Threshold for considering content a match (0-1)
+            similarity_checker: Shared similarity checker (default: a new one)
+            object_detector: Shared object detector (default: a new one)
+            audio_index: Landmark index of reference tracks (default: no audio matching)
+            min_audio_matches: Aligned landmarks a reference track needs to match
         """
-        self.similarity_checker = VideoSimilarity()
-        self.object_detector = ObjectDetector()
+        self.similarity_checker = similarity_checker or VideoSimilarity()
+        self.object_detector = object_detector or ObjectDetector()
         self.threshold = similarity_threshold
+        self.audio_index = audio_index
+        self.min_audio_matches = min_audio_matches
         
-    def check_video_similarity(self, video_path: str) -> List[Dict]:
+    def check_video_similarity(self, video_path: str, frames: Optional[List[Frame]] = None,
+                               context: Optional[FeatureContext] = None) -> List[Dict]:
         """
         Check video against known copyrighted content.
         
         Args:
             video_path: Path to video file
+            frames: Already decoded frames to reuse instead of decoding again
+            context: Per-video feature context sharing I3D/VGGish embeddings
             
         Returns:
-            List of potential matches with similarity scores
+            List of potential matches with similarity scores; matches of a
+            part of the video also carry the aligned time spans
+            (query_start/query_end in this video, source_start/source_end
+            in the catalog video, and their offset)
         """
-        pass
+        matches = self.similarity_checker.find_similar_videos(
+            video_path, self.threshold, frames=frames, context=context
+        )
+        clips = self.similarity_checker.find_similar_segments(video_path, self.threshold, context=context)
+        return self._merge_matches(matches, clips)
         
-    def check_copyright_logos(self, video_path: str) -> List[Dict]:
+    def _merge_matches(self, matches: List[Tuple[str, float]], clips: List[ClipMatch]) -> List[Dict]:
+        """Whole-video and partial-clip matches, one entry per catalog video, most similar first"""
+        merged = {video_id: {"video_id": video_id, "similarity": score} for video_id, score in matches}
+        for clip in clips:
+            entry = clip.to_dict()
+            if clip.video_id in merged:
+                entry["similarity"] = max(entry["similarity"], merged[clip.video_id]["similarity"])
+            merged[clip.video_id] = entry
+        return sorted(merged.values(), key=lambda match: -match["similarity"])
+        
+    def check_audio_fingerprints(self, video_path: str, context: Optional[FeatureContext] = None) -> List[Dict]:
+        """
+        Match the audio track against the reference track index.
+        
+        Args:
+            video_path: Path to video file
+            context: Per-video feature context sharing the decoded PCM
+            
+        Returns:
+            Reference tracks found, with track_id, the number of aligned
+            landmarks, and the time spans in this video (query_start,
+            query_end) and in the track (source_start, source_end)
+        """
+        if self.audio_index is None:
+            return []
+        if context is not None:
+            pcm = context.get("pcm", partial(read_pcm, video_path))
+        else:
+            pcm = read_pcm(video_path)
+        matches = self.audio_index.search(landmarks(pcm), self.min_audio_matches)
+        return [match.to_dict() for match in matches]
+        
+    def check_copyright_logos(self, video_path: str, frames: Optional[List[Frame]] = None) -> List[Dict]:
         """
         Check for copyrighted logos in video.
         
         Args:
             video_path: Path to video file
+            frames: Already decoded frames to reuse instead of decoding again
             
         Returns:
             List of detected copyrighted logos
         """
-        pass
+        if frames is not None:
+            detections = self.object_detector.process_frames(frames)
+        else:
+            detections = self.object_detector.process_video(video_path)
+        return self._filter_logos(detections)
         
-    def detect_copyright(self, video_path: str) -> Dict:
+    def _filter_logos(self, detections: Dict[int, List[Dict]]) -> List[Dict]:
+        logo_classes = set(self.object_detector.logo_classes or [])
+        return [
+            dict(obj, second=second)
+            for second, objects in detections.items()
+            for obj in objects
+            if obj["class_name"] in logo_classes
+        ]
+        
+    def detect_copyright(self, video_path: str, frames: Optional[List[Frame]] = None,
+                         context: Optional[FeatureContext] = None,
+                         detections: Optional[Dict[int, List[Dict]]] = None) -> Dict:
         """
         Run full copyright detection pipeline.
         
         Args:
             video_path: Path to video file
+            frames: Already decoded frames (sampled at 1 fps) to reuse
+            context: Per-video feature context sharing I3D/VGGish embeddings
+            detections: Object detections of the video (e.g. the moderator's
+                objects check) to take the logos from instead of running
+                the detector again
             
         Returns:
             Dictionary of copyright detection results
         """
-        pass
+        if frames is not None:
+            frames = list(frames)
+        if detections is not None:
+            logos = self._filter_logos(detections)
+        else:
+            logos = self.check_copyright_logos(video_path, frames)
+        return {
+            "similar_videos": self.check_video_similarity(video_path, frames, context),
+            "audio_matches": self.check_audio_fingerprints(video_path, context),
+            "detected_logos": logos
+        }
+        
+    def detect_copyright_batch(self, video_paths: List[str], frame_lists: List[List[Frame]],
+                               contexts: Optional[List[FeatureContext]] = None,
+                               detections: Optional[List[Dict[int, List[Dict]]]] = None) -> List[Dict]:
+        """
+        Run copyright detection for many videos with batched model inference.
+        
+        Args:
+            video_paths: Paths to video files
+            frame_lists: Already decoded frames of each video
+            contexts: Per-video feature contexts sharing I3D/VGGish embeddings
+            detections: Object detections of each video to take the logos
+                from (default: detected on frame_lists in one batched call)
+            
+        Returns:
+            Copyright detection results for each video, in input order
+        """
+        matches = self.similarity_checker.find_similar_videos_batch(
+            video_paths, frame_lists, self.threshold, contexts
+        )
+        clips = self.similarity_checker.find_similar_segments_batch(video_paths, self.threshold, contexts)
+        if detections is None:
+            detections = self.object_detector.process_frames_batch(frame_lists)
+        contexts = contexts or [None] * len(video_paths)
+        return [
+            {
+                "similar_videos": self._merge_matches(video_matches, video_clips),
+                "audio_matches": self.check_audio_fingerprints(video_path, context),
+                "detected_logos": self._filter_logos(video_detections)
+            }
+            for video_path, context, video_matches, video_clips, video_detections
+            in zip(video_paths, contexts, matches, clips, detections)
+        ]
@@ -0,0 +1,246 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+from frame_source import read_keyframes
+from media_probe import probe_video
+from metrics import count, span
+
+# Frames are hashed from this size; pHash needs 32x32 for its DCT
+HASH_INPUT_SIZE = (32, 32)
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 thumbnail"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def phash(gray: np.ndarray) -> int:
+    """64-bit perceptual hash: lowest 8x8 DCT coefficients of a 32x32 thumbnail against their median"""
+    small = cv2.resize(gray, HASH_INPUT_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # the DC term would dominate the median
+    return int(np.packbits(bits).view('>u8')[0])
+
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Element-wise Hamming distance of two uint64 hash arrays"""
+    diff = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def chunk_layout(max_distance: int) -> List[Tuple[int, int]]:
+    """
+    (shift, mask) of the chunks a 64-bit hash is indexed by.
+
+    Hashes within max_distance bits differ in at most max_distance chunks,
+    so with max_distance + 1 chunks they agree exactly on at least one
+    (pigeonhole) and every match is retrieved as a candidate.
+    """
+    if not 0 <= max_distance < 64:
+        raise ValueError(f"max_distance must be between 0 and 63, got {max_distance}")
+    bounds = np.linspace(0, 64, max_distance + 2).round().astype(int).tolist()
+    return [(low, (1 << (high - low)) - 1) for low, high in zip(bounds[:-1], bounds[1:])]
+
+@dataclass
+class VideoSignature:
+    """Perceptual hashes of frames at fixed fractions of a video's duration"""
+    duration: float
+    phashes: np.ndarray  # uint64, one per sampled frame
+    dhashes: np.ndarray
+
+@dataclass
+class DuplicateMatch:
+    video_id: str
+    matched_frames: int
+    distance: float  # mean pHash distance over the matched frames
+    verdict: Dict
+
+class DuplicateIndex:
+    """
+    Perceptual-hash index of already moderated videos and their verdicts.
+
+    A video's signature is the pHash and dHash of a few frames decoded at
+    fixed fractions of its duration, so a re-encoded, rescaled or
+    re-containered re-upload yields nearly the same hashes. Signatures are
+    kept in memory in a multi-index: every frame pHash is split into
+    max_distance + 1 chunks and each chunk value maps to the signatures
+    containing it, so a lookup only verifies the signatures sharing a
+    chunk with the query instead of scanning all of them, and still finds
+    every frame within max_distance.
+
+    max_distance trades reuse against lookup cost. The default of 3 keeps
+    16-bit chunks, which unrelated videos rarely share, so lookups verify
+    a handful of candidates; re-encodes that move more frames further than
+    that are not recognized and simply run the full pipeline. Each step up
+    narrows the chunks, and at around 8 bits (max_distance 7) almost every
+    stored video becomes a candidate and lookups approach a full scan.
+
+    Verdicts are persisted in SQLite together with the version of the
+    checks that produced them; verdicts of other versions never match.
+    Rows added by other processes are picked up every refresh_interval
+    seconds.
+    """
+
+    def __init__(self, path: str, num_frames: int = 5, max_distance: int = 3,
+                 min_matching: float = 0.8, duration_tolerance: float = 0.02,
+                 refresh_interval: float = 5.0):
+        """
+        Open (or create) the index and load every stored signature.
+
+        Args:
+            path: SQLite file holding signatures and verdicts
+            num_frames: Frames hashed per video
+            max_distance: Maximum pHash and dHash distance (of 64 bits) of a matching frame;
+                sets the chunking of the multi-index (see chunk_layout)
+            min_matching: Fraction of frames that must match for a confident match
+            duration_tolerance: Allowed relative duration difference (at least 0.5 s)
+            refresh_interval: Seconds between checks for rows added by other processes
+        """
+        self.path = path
+        self.num_frames = num_frames
+        self.max_distance = max_distance
+        self.min_matching = min_matching
+        self.duration_tolerance = duration_tolerance
+        self.refresh_interval = refresh_interval
+        self._chunks = chunk_layout(max_distance)
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._tables: List[Dict[int, List[int]]] = [defaultdict(list) for _ in self._chunks]
+        self._ids: List[str] = []
+        self._durations: List[float] = []
+        self._phashes: List[np.ndarray] = []
+        self._dhashes: List[np.ndarray] = []
+        self._versions: List[str] = []
+        self._verdicts: List[str] = []
+        self._latest: Dict[str, int] = {}  # video ID -> row of its newest verdict
+        self._last_rowid = 0
+        self._refreshed = 0.0
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts (video_id TEXT PRIMARY KEY, duration REAL, "
+                "phashes BLOB, dhashes BLOB, version TEXT, verdict TEXT)"
+            )
+        self.refresh()
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared across threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    def signature(self, video_path: str) -> Optional[VideoSignature]:
+        """
+        Hash num_frames frames spread over the video.
+
+        Returns:
+            Signature, or None if the video has no known duration
+        """
+        duration = probe_video(video_path).duration
+        if duration <= 0:
+            return None
+        timestamps = (np.arange(self.num_frames) + 0.5) * duration / self.num_frames
+        gray = read_keyframes(video_path, timestamps, HASH_INPUT_SIZE, exact=True)
+        with span("duplicate.hash", "cpu"):
+            return VideoSignature(
+                duration=duration,
+                phashes=np.array([phash(image) for image in gray], dtype=np.uint64),
+                dhashes=np.array([dhash(image) for image in gray], dtype=np.uint64)
+            )
+
+    def refresh(self):
+        """Load rows added since the last refresh, including by other processes"""
+        rows = self._connection().execute(
+            "SELECT rowid, video_id, duration, phashes, dhashes, version, verdict FROM verdicts "
+            "WHERE rowid > ? ORDER BY rowid", (self._last_rowid,)
+        ).fetchall()
+        with self._lock:
+            for rowid, video_id, duration, phashes, dhashes, version, verdict in rows:
+                if rowid <= self._last_rowid:
+                    continue  # loaded by a concurrent refresh
+                self._index_row(video_id, duration, np.frombuffer(phashes, dtype=np.uint64),
+                                np.frombuffer(dhashes, dtype=np.uint64), version, verdict)
+                self._last_rowid = rowid
+            self._refreshed = time.monotonic()
+
+    def _index_row(self, video_id: str, duration: float, phashes: np.ndarray, dhashes: np.ndarray,
+                   version: str, verdict: str):
+        row = len(self._ids)
+        self._ids.append(video_id)
+        self._durations.append(duration)
+        self._phashes.append(phashes)
+        self._dhashes.append(dhashes)
+        self._versions.append(version)
+        self._verdicts.append(verdict)
+        self._latest[video_id] = row  # superseded rows stay in the tables but are skipped
+        for value in set(int(h) for h in phashes):
+            for (shift, mask), table in zip(self._chunks, self._tables):
+                table[(value >> shift) & mask].append(row)
+
+    def lookup(self, signature: VideoSignature, version: str) -> Optional[DuplicateMatch]:
+        """
+        Find an earlier video with a near-identical signature.
+
+        Args:
+            signature: Signature of the new video
+            version: Version of the checks whose verdicts may be reused
+
+        Returns:
+            Best confident match, or None
+        """
+        if time.monotonic() - self._refreshed > self.refresh_interval:
+            self.refresh()
+        needed = int(np.ceil(self.min_matching * len(signature.phashes)))
+        tolerance = max(self.duration_tolerance * signature.duration, 0.5)
+        best = None
+        with self._lock:
+            candidates = set()
+            for value in set(int(h) for h in signature.phashes):
+                for (shift, mask), table in zip(self._chunks, self._tables):
+                    candidates.update(table.get((value >> shift) & mask, ()))
+            for row in candidates:
+                if (self._latest.get(self._ids[row]) != row or self._versions[row] != version
+                        or len(self._phashes[row]) != len(signature.phashes)
+                        or abs(self._durations[row] - signature.duration) > tolerance):
+                    continue
+                distances = hamming(self._phashes[row], signature.phashes)
+                matched = (distances <= self.max_distance) & (
+                    hamming(self._dhashes[row], signature.dhashes) <= self.max_distance
+                )
+                matched_frames = int(matched.sum())
+                if matched_frames < needed:
+                    continue
+                distance = float(distances[matched].mean())
+                if best is None or (matched_frames, -distance) > (best[1], -best[2]):
+                    best = (row, matched_frames, distance)
+        count("duplicate_lookups", hit=best is not None)
+        if best is None:
+            return None
+        row, matched_frames, distance = best
+        return DuplicateMatch(self._ids[row], matched_frames, distance, json.loads(self._verdicts[row]))
+
+    def add(self, video_id: str, signature: VideoSignature, verdict: Dict, version: str):
+        """
+        Remember the verdict of a moderated video.
+
+        Args:
+            video_id: ID reported when a later upload matches this one
+            signature: Signature of the video
+            verdict: JSON-serializable verdict to reuse
+            version: Version of the checks that produced it
+        """
+        with self._connection() as db:
+            # REPLACE deletes the previous row, so the new one gets a higher rowid
+            db.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, signature.duration, signature.phashes.astype(np.uint64).tobytes(),
+                 signature.dhashes.astype(np.uint64).tobytes(), version, json.dumps(verdict))
+            )
+        self.refresh()
@@ -0,0 +1,344 @@
+import os
+import time
+import fcntl
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import faiss
+import numpy as np
+
+def pq_subquantizers(dim: int, pq_m: Optional[int] = None, max_m: int = 64) -> int:
+    """
+    Number of PQ sub-quantizers for vectors of dimension dim.
+
+    Each sub-quantizer encodes dim / pq_m consecutive components, so pq_m
+    must divide dim. The default is the largest divisor up to max_m (56 for
+    the 728-d video and segment vectors: 600 I3D logits and 128 VGGish).
+
+    Raises:
+        ValueError: If pq_m is given and does not divide dim
+    """
+    if pq_m is None:
+        return max(m for m in range(1, min(dim, max_m) + 1) if dim % m == 0)
+    if pq_m <= 0 or dim % pq_m:
+        raise ValueError(f"pq_m={pq_m} does not divide the vector dimension {dim}")
+    return pq_m
+
+class IdMap:
+    """Persistent mapping between external video IDs and int64 FAISS IDs"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS ids (id INTEGER PRIMARY KEY AUTOINCREMENT, video_id TEXT UNIQUE)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared across threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def assign(self, video_ids: Sequence[str]) -> np.ndarray:
+        """Return int64 IDs for video_ids, allocating new ones as needed"""
+        with self._connection() as db:
+            db.executemany("INSERT OR IGNORE INTO ids (video_id) VALUES (?)", [(v,) for v in video_ids])
+        return self.ids_for(video_ids)
+
+    def ids_for(self, video_ids: Sequence[str]) -> np.ndarray:
+        """int64 IDs of known video_ids (-1 for unknown ones)"""
+        found = {}
+        db = self._connection()
+        for start in range(0, len(video_ids), 500):
+            chunk = list(video_ids[start:start + 500])
+            rows = db.execute(
+                f"SELECT video_id, id FROM ids WHERE video_id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update(rows)
+        return np.array([found.get(v, -1) for v in video_ids], dtype=np.int64)
+
+    def video_ids_for(self, ids: Sequence[int]) -> Dict[int, str]:
+        """External video IDs of int64 IDs"""
+        wanted = sorted({int(i) for i in ids if i >= 0})
+        found = {}
+        db = self._connection()
+        for start in range(0, len(wanted), 500):
+            chunk = wanted[start:start + 500]
+            rows = db.execute(
+                f"SELECT id, video_id FROM ids WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update(rows)
+        return found
+
+class FaissIndexManager:
+    """
+    Builds, grows and serves the FAISS similarity index with stable video IDs.
+
+    The catalog lives in a compressed IVF-PQ base index that readers memory-map
+    read-only, so every worker on a host shares one copy through the page
+    cache. Newly moderated videos are appended to a small delta index built
+    from the same trained quantizer; searches query both and merge results.
+    merge() folds the delta into the base. Scores are inner products of
+    L2-normalized vectors (cosine similarity).
+
+    Files: <path> (base), <path>.trained (empty trained template),
+    <path>.delta (recent additions), <path>.ids.sqlite (ID map).
+    """
+
+    def __init__(self, index_path: str, mmap: bool = True, refresh_interval: float = 30.0):
+        """
+        Initialize manager and load the index if it exists.
+
+        Args:
+            index_path: Path to the base index file
+            mmap: Memory-map the base index read-only instead of loading it
+            refresh_interval: Minimum seconds between checks for index updates
+        """
+        self.index_path = index_path
+        self.mmap = mmap
+        self.refresh_interval = refresh_interval
+        self.id_map = IdMap(f"{index_path}.ids.sqlite")
+        self.nprobe = 16
+        self.base: Optional[faiss.Index] = None
+        self.delta: Optional[faiss.Index] = None
+        self._versions: Tuple[float, float] = (0.0, 0.0)
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    @property
+    def trained_path(self) -> str:
+        return f"{self.index_path}.trained"
+
+    @property
+    def delta_path(self) -> str:
+        return f"{self.index_path}.delta"
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across processes"""
+        with open(f"{self.index_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[np.newaxis, :]
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    @staticmethod
+    def _write_atomic(index: faiss.Index, path: str):
+        temp_path = f"{path}.tmp.{os.getpid()}"
+        faiss.write_index(index, temp_path)
+        os.replace(temp_path, path)
+
+    def _mtime(self, path: str) -> float:
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0.0
+
+    def _assign(self, keys: Sequence) -> np.ndarray:
+        """int64 FAISS IDs of external keys (video IDs here), allocating new ones as needed"""
+        return self.id_map.assign(list(keys))
+
+    def _ids(self, keys: Sequence) -> np.ndarray:
+        """int64 FAISS IDs of known external keys (-1 for unknown ones)"""
+        return self.id_map.ids_for(list(keys))
+
+    def _keys(self, ids: Sequence[int]) -> Dict[int, object]:
+        """External keys of int64 FAISS IDs"""
+        return self.id_map.video_ids_for(ids)
+
+    def refresh(self, force: bool = False):
+        """Reload base and delta indexes if another process updated them"""
+        now = time.monotonic()
+        if not force and now - self._checked < self.refresh_interval:
+            return
+        self._checked = now
+        versions = (self._mtime(self.index_path), self._mtime(self.delta_path))
+        if versions == self._versions:
+            return
+        with self._lock:
+            if versions[0] and versions[0] != self._versions[0]:
+                flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if self.mmap else 0
+                self.base = faiss.read_index(self.index_path, flags)
+            if versions[1] and versions[1] != self._versions[1]:
+                self.delta = faiss.read_index(self.delta_path)
+            elif not versions[1]:
+                self.delta = None
+            self._versions = versions
+
+    def build(self, vectors: np.ndarray, video_ids: Sequence[str], nlist: Optional[int] = None,
+              pq_m: Optional[int] = None, nbits: int = 8, train_size: int = 1_000_000, add_batch: int = 100_000):
+        """
+        Train and build a compressed IVF-PQ base index from scratch.
+
+        Args:
+            vectors: Array of shape (num_videos, dim); may be a memory-mapped array
+            video_ids: External ID of each vector
+            nlist: Number of IVF cells (default: about 4 * sqrt(num_videos))
+            pq_m: Number of PQ sub-quantizers (default: see pq_subquantizers)
+            nbits: Bits per PQ code
+            train_size: Maximum number of vectors sampled for training
+            add_batch: Number of vectors added per chunk
+        """
+        count = len(vectors)
+        sample = np.random.default_rng(0).choice(count, size=min(count, train_size), replace=False)
+        batches = (
+            (video_ids[start:start + add_batch], vectors[start:start + add_batch])
+            for start in range(0, count, add_batch)
+        )
+        self.build_from(batches, vectors[np.sort(sample)], count, nlist, pq_m, nbits)
+
+    def build_from(self, batches: Iterable[Tuple[Sequence[str], np.ndarray]], train_vectors: np.ndarray,
+                   count: int, nlist: Optional[int] = None, pq_m: Optional[int] = None, nbits: int = 8):
+        """
+        Train and build the base index from a stream of batches (e.g. FeatureStore.scan()).
+
+        Args:
+            batches: (video_ids, vectors) batches covering the catalog
+            train_vectors: Representative sample used to train the quantizers
+            count: Total number of vectors, used for the default nlist
+            nlist: Number of IVF cells (default: about 4 * sqrt(count))
+            pq_m: Number of PQ sub-quantizers (default: see pq_subquantizers)
+            nbits: Bits per PQ code
+
+        Raises:
+            ValueError: If pq_m does not divide the vector dimension
+        """
+        dim = train_vectors.shape[1]
+        pq_m = pq_subquantizers(dim, pq_m)
+        nlist = nlist or max(1, int(4 * np.sqrt(count)))
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{pq_m}x{nbits}", faiss.METRIC_INNER_PRODUCT)
+        index.train(self._normalize(train_vectors))
+
+        with self._write_lock():
+            self._write_atomic(index, self.trained_path)
+            for video_ids, vectors in batches:
+                index.add_with_ids(self._normalize(vectors), self._assign(video_ids))
+            self._write_atomic(index, self.index_path)
+            if os.path.exists(self.delta_path):
+                os.remove(self.delta_path)
+        self.refresh(force=True)
+
+    def add(self, vectors: np.ndarray, video_ids: Sequence[str]):
+        """
+        Append newly moderated videos to the delta index.
+
+        Args:
+            vectors: Array of shape (num_videos, dim)
+            video_ids: External ID of each vector
+        """
+        if not os.path.exists(self.trained_path):
+            raise RuntimeError(f"Index {self.index_path} has not been built yet")
+        with self._write_lock():
+            path = self.delta_path if os.path.exists(self.delta_path) else self.trained_path
+            delta = faiss.read_index(path)
+            ids = self._assign(video_ids)
+            # Re-adding a pending video replaces its vector
+            delta.remove_ids(ids)
+            delta.add_with_ids(self._normalize(vectors), ids)
+            self._write_atomic(delta, self.delta_path)
+        self.refresh(force=True)
+
+    def merge(self):
+        """Fold the delta index into the base index and start a new delta"""
+        with self._write_lock():
+            if not os.path.exists(self.delta_path):
+                return
+            base = faiss.read_index(self.index_path)
+            delta = faiss.read_index(self.delta_path)
+            faiss.extract_index_ivf(base).merge_from(faiss.extract_index_ivf(delta), 0)
+            self._write_atomic(base, self.index_path)
+            os.remove(self.delta_path)
+        self.refresh(force=True)
+
+    def _search_raw(self, queries: np.ndarray, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Per-call parameters keep concurrent searches with different nprobe apart
+        params = faiss.SearchParametersIVF(nprobe=nprobe)
+        results = []
+        for index in (self.base, self.delta):
+            if index is not None and index.ntotal > 0:
+                results.append(index.search(queries, k, params=params))
+        if not results:
+            return np.full((len(queries), k), -np.inf, dtype=np.float32), np.full((len(queries), k), -1)
+        D = np.concatenate([d for d, _ in results], axis=1)
+        I = np.concatenate([i for _, i in results], axis=1)
+        order = np.argsort(-D, axis=1)[:, :k]
+        return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+    def search(self, queries: np.ndarray, k: int = 5, nprobe: Optional[int] = None) -> List[List[Tuple[str, float]]]:
+        """
+        Find the k most similar catalog videos for each query.
+
+        Args:
+            queries: Array of shape (num_queries, dim)
+            k: Number of neighbours per query
+            nprobe: IVF cells visited per query (default: self.nprobe)
+
+        Returns:
+            (video_id, cosine similarity) pairs for each query, best first
+        """
+        self.refresh()
+        D, I = self._search_raw(self._normalize(queries), k, nprobe or self.nprobe)
+        names = self._keys(I.ravel())
+        results = []
+        for ids, scores in zip(I, D):
+            # A video re-added after the last merge is in both indexes; keep its best score
+            matches = {}
+            for i, d in zip(ids.tolist(), scores.tolist()):
+                if i in names and names[i] not in matches:
+                    matches[names[i]] = d
+            results.append(list(matches.items()))
+        return results
+
+    def evaluate_nprobe(self, queries: np.ndarray, reference_vectors: np.ndarray,
+                        reference_ids: Sequence[str], nprobes: Sequence[int] = (1, 4, 16, 64, 256),
+                        k: int = 10) -> List[Dict[str, float]]:
+        """
+        Measure the recall/latency trade-off of nprobe against exact search.
+
+        Ground truth is an exact inner-product search over reference_vectors,
+        which should be a sample of the catalog already in the index.
+
+        Args:
+            queries: Array of shape (num_queries, dim)
+            reference_vectors: Catalog sample used for exact ground truth
+            reference_ids: External IDs of reference_vectors
+            nprobes: nprobe values to evaluate
+            k: Number of neighbours
+
+        Returns:
+            One {"nprobe", "recall_at_k", "ms_per_query"} row per nprobe value
+        """
+        queries = self._normalize(queries)
+        exact = faiss.IndexIDMap(faiss.IndexFlatIP(queries.shape[1]))
+        exact.add_with_ids(self._normalize(reference_vectors), self._ids(reference_ids))
+        _, truth = exact.search(queries, k)
+        reference = set(int(i) for i in truth.ravel())
+
+        report = []
+        for nprobe in nprobes:
+            start = time.perf_counter()
+            _, found = self._search_raw(queries, k, nprobe)
+            elapsed = time.perf_counter() - start
+            # Only neighbours from the reference sample can be judged
+            hits = [
+                len(set(t) & {int(i) for i in f if i in reference}) / len(t)
+                for t, f in zip(truth.tolist(), found.tolist())
+            ]
+            report.append({
+                "nprobe": nprobe,
+                "recall_at_k": float(np.mean(hits)),
+                "ms_per_query": 1000 * elapsed / len(queries)
+            })
+        return report
@@ -0,0 +1,117 @@
+import time
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+from frame_source import Frame
+
+class FeatureContext:
+    """
+    Per-video store of expensive embeddings shared by every consumer.
+
+    The first consumer asking for an embedding (e.g. "i3d" or "vggish")
+    computes it; concurrent and later consumers wait for and reuse that
+    result, so each embedding is inferred at most once per video. The
+    context also carries the canonical input frames so every consumer
+    would compute the embedding from identical inputs.
+    """
+
+    def __init__(self, video_path: str, frames: Optional[Dict[str, Future]] = None):
+        """
+        Initialize context.
+
+        Args:
+            video_path: Path to video file
+            frames: Futures of the decoded input frames per embedding name
+        """
+        self.video_path = video_path
+        self._frames = dict(frames or {})
+        self._values: Dict[str, Future] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def frames(self, name: str) -> Optional[List[Frame]]:
+        """Canonical input frames for an embedding, waiting for decode if needed"""
+        future = self._frames.get(name)
+        return future.result() if future is not None else None
+
+    def has(self, name: str) -> bool:
+        """True if the embedding is available or being computed"""
+        with self._lock:
+            return name in self._values
+
+    def get(self, name: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """
+        Return the embedding called name, computing it on first use.
+
+        Args:
+            name: Embedding name
+            compute: Function computing the embedding if nobody has yet
+
+        Returns:
+            The shared embedding
+        """
+        with self._lock:
+            future = self._values.get(name)
+            owner = future is None
+            if owner:
+                future = self._values[name] = Future()
+        if owner:
+            start = time.perf_counter()
+            try:
+                value = compute()
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            self._record(name, time.perf_counter() - start)
+            future.set_result(value)
+        return future.result()
+
+    def set(self, name: str, value: np.ndarray, seconds: float = 0.0):
+        """Provide an embedding computed elsewhere (e.g. in a cross-video batch)"""
+        future = Future()
+        future.set_result(value)
+        with self._lock:
+            self._values[name] = future
+        self._record(name, seconds)
+
+    def _record(self, name: str, seconds: float):
+        with self._lock:
+            timing = self._timings.setdefault(name, {"inferences": 0, "seconds": 0.0})
+            timing["inferences"] += 1
+            timing["seconds"] += seconds
+
+    def timings(self) -> Dict[str, Dict[str, float]]:
+        """Number of inferences and time spent per embedding"""
+        with self._lock:
+            return {name: dict(timing) for name, timing in self._timings.items()}
+
+def batch_embeddings(contexts: Sequence[Optional[FeatureContext]], name: str,
+                     compute: Callable[[List[int]], Sequence[np.ndarray]]) -> List[np.ndarray]:
+    """
+    Embeddings of many videos, computing only the missing ones in a single batch.
+
+    Args:
+        contexts: Feature context of each video (None entries are always computed)
+        name: Embedding name
+        compute: Function computing embeddings for the given positions, in order
+
+    Returns:
+        One embedding per video; newly computed ones are stored in their context
+    """
+    values = [None] * len(contexts)
+    missing = []
+    for i, context in enumerate(contexts):
+        if context is not None and context.has(name):
+            values[i] = context.get(name, lambda: None)
+        else:
+            missing.append(i)
+    if missing:
+        start = time.perf_counter()
+        computed = compute(missing)
+        seconds = (time.perf_counter() - start) / len(missing)
+        for i, value in zip(missing, computed):
+            values[i] = value
+            if contexts[i] is not None:
+                contexts[i].set(name, value, seconds)
+    return values
@@ -0,0 +1,252 @@
+import os
+import json
+import glob
+import fcntl
+import sqlite3
+import threading
+from itertools import groupby
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+class FeatureStore:
+    """
+    Append-only store of fixed-size float32 feature vectors.
+
+    Vectors are appended as raw rows to segment files that readers
+    memory-map, so lookups return zero-copy views and index rebuilds scan
+    segments sequentially. An SQLite file maps each video ID to its segment
+    and row and holds the video's metadata. Re-storing a video appends a
+    new row; compact() rewrites the segments without superseded rows.
+
+    Writers in any number of threads or processes serialize appends through
+    a file lock; readers never take it.
+    """
+
+    DTYPE = np.dtype(np.float32)
+
+    def __init__(self, path: str, segment_rows: int = 1 << 16):
+        """
+        Open (or create) a store.
+
+        Args:
+            path: Store directory
+            segment_rows: Rows per segment file before a new one is started
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_rows = segment_rows
+        self.dim: Optional[int] = None
+        self._local = threading.local()
+        self._maps: Dict[int, np.memmap] = {}
+        self._maps_lock = threading.Lock()
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(video_id TEXT PRIMARY KEY, segment INTEGER, row INTEGER, metadata TEXT)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_position ON entries (segment, row)")
+        self._load_manifest()
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared across threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=30)
+        return db
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across processes"""
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_manifest(self):
+        path = os.path.join(self.path, "manifest.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                self.dim = json.load(f)["dim"]
+
+    def _write_manifest(self, dim: int):
+        with open(os.path.join(self.path, "manifest.json.tmp"), "w") as f:
+            json.dump({"dim": dim, "dtype": self.DTYPE.str}, f)
+        os.replace(os.path.join(self.path, "manifest.json.tmp"), os.path.join(self.path, "manifest.json"))
+        self.dim = dim
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"segment-{segment:06d}.f32")
+
+    def _segments(self) -> List[int]:
+        return sorted(int(os.path.basename(p)[8:14]) for p in glob.glob(os.path.join(self.path, "segment-*.f32")))
+
+    @property
+    def _row_bytes(self) -> int:
+        return self.dim * self.DTYPE.itemsize
+
+    def _segment(self, segment: int, min_rows: int = 0) -> np.memmap:
+        """Read-only map of a segment, remapped if it has grown past the cached map"""
+        if self.dim is None:
+            self._load_manifest()
+        with self._maps_lock:
+            mapped = self._maps.get(segment)
+            if mapped is None or len(mapped) < min_rows:
+                rows = os.path.getsize(self._segment_path(segment)) // self._row_bytes
+                mapped = np.memmap(self._segment_path(segment), dtype=self.DTYPE, mode="r", shape=(rows, self.dim))
+                self._maps[segment] = mapped
+            return mapped
+
+    def put(self, video_id: str, vector: np.ndarray, metadata: Optional[dict] = None):
+        """Store one video's feature vector"""
+        self.put_many([video_id], np.asarray(vector)[np.newaxis, :], [metadata])
+
+    def put_many(self, video_ids: Sequence[str], vectors: np.ndarray,
+                 metadata: Optional[Sequence[Optional[dict]]] = None):
+        """
+        Append feature vectors for many videos.
+
+        Args:
+            video_ids: ID of each video
+            vectors: Array of shape (len(video_ids), dim)
+            metadata: Optional JSON-serializable metadata per video
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=self.DTYPE)
+        metadata = metadata or [None] * len(video_ids)
+        with self._write_lock():
+            self._load_manifest()
+            if self.dim is None:
+                self._write_manifest(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+
+            entries = []
+            segments = self._segments()
+            segment = segments[-1] if segments else 1
+            written = 0
+            while written < len(vectors):
+                path = self._segment_path(segment)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                row = size // self._row_bytes
+                if row >= self.segment_rows:
+                    segment += 1
+                    continue
+                chunk = vectors[written:written + self.segment_rows - row]
+                with open(path, "r+b" if size else "wb") as f:
+                    # Drop a partial row left behind by an interrupted writer
+                    f.truncate(row * self._row_bytes)
+                    f.seek(row * self._row_bytes)
+                    f.write(chunk.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                for i in range(len(chunk)):
+                    entries.append((
+                        video_ids[written + i], segment, row + i,
+                        json.dumps(metadata[written + i]) if metadata[written + i] is not None else None
+                    ))
+                written += len(chunk)
+
+            # Rows become visible only once the index points at them
+            with self._connection() as db:
+                db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", entries)
+
+    def _position(self, video_id: str) -> Optional[Tuple[int, int, Optional[str]]]:
+        return self._connection().execute(
+            "SELECT segment, row, metadata FROM entries WHERE video_id = ?", (video_id,)
+        ).fetchone()
+
+    def get(self, video_id: str) -> Optional[np.ndarray]:
+        """Read-only, zero-copy view of a video's feature vector"""
+        for _ in range(2):
+            position = self._position(video_id)
+            if position is None:
+                return None
+            segment, row, _ = position
+            try:
+                return self._segment(segment, row + 1)[row]
+            except FileNotFoundError:
+                continue  # segment was compacted away; look up the new position
+        return None
+
+    def metadata(self, video_id: str) -> Optional[dict]:
+        """Metadata stored with a video"""
+        position = self._position(video_id)
+        return json.loads(position[2]) if position is not None and position[2] else None
+
+    def __contains__(self, video_id: str) -> bool:
+        return self._position(video_id) is not None
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def scan(self, batch_rows: int = 1 << 16) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        Sequentially read every stored vector, segment by segment.
+
+        Yields:
+            (video_ids, vectors) batches of at most batch_rows live rows
+        """
+        db = self._connection()
+        segments = [s for (s,) in db.execute("SELECT DISTINCT segment FROM entries ORDER BY segment")]
+        for segment in segments:
+            live = db.execute(
+                "SELECT video_id, row FROM entries WHERE segment = ? ORDER BY row", (segment,)
+            ).fetchall()
+            rows = np.array([row for _, row in live], dtype=np.int64)
+            mapped = self._segment(segment, int(rows[-1]) + 1)
+            for start in range(0, len(live), batch_rows):
+                batch = rows[start:start + batch_rows]
+                # Contiguous runs are sliced without copying
+                if batch[-1] - batch[0] + 1 == len(batch):
+                    vectors = mapped[batch[0]:batch[-1] + 1]
+                else:
+                    vectors = mapped[batch]
+                yield [video_id for video_id, _ in live[start:start + batch_rows]], vectors
+
+    def sample(self, count: int) -> np.ndarray:
+        """Random live vectors (e.g. for training an index)"""
+        rows = self._connection().execute(
+            "SELECT segment, row FROM entries ORDER BY RANDOM() LIMIT ?", (count,)
+        ).fetchall()
+        rows.sort()
+        return np.stack([self._segment(segment, row + 1)[row] for segment, row in rows]) if rows else \
+            np.zeros((0, self.dim or 0), dtype=self.DTYPE)
+
+    def compact(self) -> int:
+        """
+        Rewrite the segments without superseded or orphaned rows.
+
+        Returns:
+            Number of rows reclaimed
+        """
+        with self._write_lock():
+            old_segments = self._segments()
+            if not old_segments:
+                return 0
+            total = sum(os.path.getsize(self._segment_path(s)) // self._row_bytes for s in old_segments)
+            db = self._connection()
+            live = db.execute("SELECT video_id, segment, row FROM entries ORDER BY segment, row").fetchall()
+
+            # New segments are numbered after the old ones so readers never see a half-written file
+            segment = old_segments[-1] + 1
+            moves = []
+            for start in range(0, len(live), self.segment_rows):
+                chunk = live[start:start + self.segment_rows]
+                with open(self._segment_path(segment), "wb") as f:
+                    for old_segment, group in groupby(chunk, key=lambda entry: entry[1]):
+                        rows = np.array([row for _, _, row in group], dtype=np.int64)
+                        f.write(self._segment(old_segment, int(rows[-1]) + 1)[rows].tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                moves.extend((segment, i, video_id) for i, (video_id, _, _) in enumerate(chunk))
+                segment += 1
+
+            with db:
+                db.executemany("UPDATE entries SET segment = ?, row = ? WHERE video_id = ?", moves)
+            with self._maps_lock:
+                self._maps.clear()
+            for old in old_segments:
+                os.remove(self._segment_path(old))
+            return total - len(live)
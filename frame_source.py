@@ -0,0 +1,377 @@
+import os
+import queue
+import subprocess
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import cv2
+import numpy as np
+from metrics import count, span
+
+Size = Tuple[int, int]
+
+_END = object()
+
+@dataclass
+class Frame:
+    """Decoded RGB frame shared by every stage that subscribed to it"""
+    index: int
+    timestamp: float
+    image: np.ndarray
+    resized: Dict[Size, np.ndarray] = field(default_factory=dict)
+
+    def at_size(self, size: Size) -> np.ndarray:
+        """Return the frame at (width, height), reusing a precomputed copy if present"""
+        size = tuple(size)
+        image = self.resized.get(size)
+        if image is None:
+            image = cv2.resize(self.image, size)
+        return image
+
+class FrameSubscription:
+    """
+    Bounded stream of frames delivered to a single consuming stage.
+
+    Frames are selected either on a fixed rate grid (fps), at explicit
+    timestamps, or both. Iterating the subscription blocks until the
+    decoder publishes the next frame and re-raises any decode error.
+    
+    A collecting subscription is not iterated; the decoder appends frames
+    to it without ever blocking and resolves the frames future once the
+    stream is complete, so the consuming stage can be scheduled only when
+    its input is ready. A subscription that is not full only keeps its
+    requested sizes, and a collection never holds more than max_frames
+    frames: past that, every other collected frame is dropped and a fixed
+    rate grid is halved, so long videos get sparser frames instead of
+    growing memory.
+    """
+
+    def __init__(self, name: str, fps: Optional[float], indices: Sequence[int],
+                 sizes: Sequence[Size], buffer_size: int, collect: bool = False, full: bool = True,
+                 max_frames: Optional[int] = None):
+        self.name = name
+        self.fps = fps
+        self.indices = set(indices)
+        self.sizes = [tuple(size) for size in sizes]
+        self.full = full or not self.sizes
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._closed = threading.Event()
+        self._next_time = 0.0
+        self._last_index = max(self.indices) if self.indices else -1
+        self._error = None
+        self._ended = False
+        self.frames: Optional[Future] = Future() if collect else None
+        self.max_frames = max_frames
+        self._collected: List[Frame] = []
+
+    @property
+    def finished(self) -> bool:
+        """True once the consumer has closed the stream or read its end"""
+        return self._closed.is_set()
+
+    def wants(self, index: int, timestamp: float) -> bool:
+        """Decide whether the frame at index/timestamp belongs to this stream"""
+        wanted = index in self.indices
+        if self.fps and timestamp + 1e-6 >= self._next_time:
+            while self._next_time <= timestamp + 1e-6:
+                self._next_time += 1.0 / self.fps
+            wanted = True
+        return wanted
+
+    def exhausted_after(self, index: int) -> bool:
+        """True if no frame after index can be selected by this stream"""
+        return not self.fps and index >= self._last_index
+
+    def _put(self, item):
+        if item is not _END and not self.full:
+            item = Frame(item.index, item.timestamp, item.resized[self.sizes[0]],
+                         {size: item.resized[size] for size in self.sizes})
+        if self.frames is not None:
+            if item is not _END:
+                self._collected.append(item)
+                if self.max_frames and len(self._collected) > self.max_frames:
+                    self._thin()
+            return
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _thin(self):
+        """Halve a collection that outgrew max_frames, and the rate of its fixed grid"""
+        self._collected = self._collected[::2]
+        if self.fps:
+            self.fps /= 2
+            self._next_time = self._collected[-1].timestamp + 1.0 / self.fps
+
+    def _finish(self, error: Optional[Exception] = None):
+        if self._ended:
+            return
+        self._ended = True
+        self._error = error
+        if self.frames is not None:
+            if not self.frames.set_running_or_notify_cancel():
+                return
+            if error is not None:
+                self.frames.set_exception(error)
+            else:
+                self.frames.set_result(self._collected)
+            return
+        self._put(_END)
+
+    def close(self):
+        """Stop receiving frames and release the decoder if it is blocked on us"""
+        self._closed.set()
+        if self.frames is not None:
+            self.frames.cancel()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def __iter__(self) -> Iterator[Frame]:
+        while not self._closed.is_set():
+            item = self._queue.get()
+            if item is _END:
+                self._closed.set()
+                if self._error is not None:
+                    raise self._error
+                return
+            yield item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FrameSource:
+    """
+    Decodes a video exactly once and fans the frames out to every subscribed stage.
+
+    Stages subscribe before decoding starts, each describing the frames and
+    resolutions it needs. A single decode thread then walks the video, only
+    converting frames that at least one subscriber wants, and publishes each
+    frame object (with all requested resolutions precomputed) to the bounded
+    buffer of every interested subscriber. A slow consumer applies backpressure
+    to the decoder instead of growing memory.
+    """
+
+    def __init__(self, video_path: str, buffer_size: int = 32):
+        """
+        Open video and read stream metadata.
+
+        Args:
+            video_path: Path to video file
+            buffer_size: Maximum number of frames buffered per subscriber
+        """
+        self.video_path = video_path
+        self.buffer_size = buffer_size
+        self._capture = cv2.VideoCapture(video_path)
+        if not self._capture.isOpened():
+            raise IOError(f"Could not open video: {video_path}")
+        self.fps = self._capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self.frame_count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.duration = self.frame_count / self.fps if self.frame_count > 0 else 0.0
+        self.frames_read = 0
+        self.frames_decoded = 0
+        self._subscriptions: List[FrameSubscription] = []
+        self._thread: Optional[threading.Thread] = None
+        self._started = False
+
+    def evenly_spaced(self, num_frames: int) -> List[float]:
+        """Timestamps of num_frames frames spread over the whole video"""
+        return [float(t) for t in np.linspace(0, self.duration, num_frames)]
+
+    def subscribe(self, name: str, fps: Optional[float] = None,
+                  timestamps: Optional[Sequence[float]] = None,
+                  num_frames: Optional[int] = None,
+                  sizes: Sequence[Size] = (),
+                  collect: bool = False, full: bool = True,
+                  max_frames: Optional[int] = None) -> FrameSubscription:
+        """
+        Register a consuming stage.
+
+        Args:
+            name: Stage name (for diagnostics)
+            fps: Deliver frames on a fixed rate grid
+            timestamps: Deliver the frames closest to these timestamps
+            num_frames: Deliver this many frames spread evenly over the video
+            sizes: (width, height) resolutions to precompute for this stage
+            collect: Gather frames into subscription.frames instead of streaming them
+            full: Keep the full-resolution image (if False, the first of sizes stands in for it)
+            max_frames: Most frames a collecting subscription holds (default: unbounded)
+
+        Returns:
+            Subscription to iterate from the consuming thread
+        """
+        if self._thread is not None:
+            raise RuntimeError("Cannot subscribe after decoding has started")
+        targets = list(timestamps or [])
+        if num_frames:
+            targets.extend(self.evenly_spaced(num_frames))
+        subscription = FrameSubscription(
+            name, fps, self._indices(targets), sizes, self.buffer_size, collect, full, max_frames
+        )
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def _indices(self, timestamps: Sequence[float]) -> List[int]:
+        last = max(self.frame_count - 1, 0)
+        return [min(int(round(t * self.fps)), last) for t in timestamps]
+
+    def resample(self, subscription: FrameSubscription, timestamps: Sequence[float]):
+        """
+        Replace the frames a subscription asked for with the frames closest to timestamps.
+
+        Lets a stage subscribe (and be scheduled on its frames) before its
+        sampling is planned; must be called before decoding starts.
+        """
+        if self._started or self._thread is not None:
+            raise RuntimeError("Cannot resample after decoding has started")
+        subscription.fps = None
+        subscription.indices = set(self._indices(timestamps))
+        subscription._last_index = max(subscription.indices) if subscription.indices else -1
+
+    def start(self) -> "FrameSource":
+        """Start decoding on a dedicated thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self.run,
+                name=f"decode-{os.path.basename(self.video_path)}",
+                daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Close every subscription and wait for the decoder to stop"""
+        for subscription in self._subscriptions:
+            subscription.close()
+        if self._thread is not None:
+            self._thread.join()
+        elif not self._started:
+            self._capture.release()
+
+    def run(self):
+        """Decode the video on the calling thread, publishing to every subscriber"""
+        self._started = True
+        error = None
+        pending = [s for s in self._subscriptions if not s.exhausted_after(-1)]
+        try:
+            with span("decode.frames", "decode"):
+                self._decode(pending)
+        except Exception as e:
+            error = e
+        finally:
+            self._capture.release()
+            count("frames_decoded", self.frames_decoded)
+            for subscription in self._subscriptions:
+                subscription._finish(error)
+
+    def _decode(self, pending: List[FrameSubscription]):
+        """Walk the video until every subscriber has what it asked for"""
+        index = 0
+        while pending and self._capture.grab():
+            self.frames_read += 1
+            timestamp = index / self.fps
+            wanting = [s for s in pending if s.wants(index, timestamp)]
+            if wanting:
+                ok, bgr = self._capture.retrieve()
+                if ok:
+                    image = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+                    sizes = {size for s in wanting for size in s.sizes}
+                    frame = Frame(
+                        index=index,
+                        timestamp=timestamp,
+                        image=image,
+                        resized={size: cv2.resize(image, size) for size in sizes}
+                    )
+                    self.frames_decoded += 1
+                    for subscription in wanting:
+                        subscription._put(frame)
+            # Release stages as soon as they have everything they asked for
+            remaining = []
+            for subscription in pending:
+                if subscription.exhausted_after(index):
+                    subscription._finish()
+                elif not subscription.finished:
+                    remaining.append(subscription)
+            pending = remaining
+            index += 1
+
+    @classmethod
+    def read(cls, video_path: str, **sampling) -> List[Frame]:
+        """
+        Decode the frames a single stage needs when it runs standalone.
+
+        Args:
+            video_path: Path to video file
+            **sampling: Arguments accepted by subscribe()
+
+        Returns:
+            List of decoded frames
+        """
+        source = cls(video_path)
+        subscription = source.subscribe("read", **sampling)
+        source.start()
+        return list(subscription)
+
+def select_evenly(frames: Sequence[Frame], num_frames: int) -> List[Frame]:
+    """Pick num_frames frames spread evenly over frames, repeating if there are fewer"""
+    if not frames:
+        return []
+    positions = np.linspace(0, len(frames) - 1, num_frames).round().astype(int)
+    return [frames[i] for i in positions]
+
+def read_keyframes(video_path: str, timestamps: Sequence[float], size: Size, exact: bool = False) -> np.ndarray:
+    """
+    Decode the keyframe at or before each timestamp as a grayscale image.
+
+    Each timestamp is one ffmpeg process that seeks in the container and
+    decodes a single keyframe, scaled to size; the processes run
+    concurrently. Nothing else in the video is decoded.
+
+    Args:
+        video_path: Path to video file
+        timestamps: Seek targets in seconds
+        size: (width, height) of the returned images
+        exact: Decode the frame at each timestamp instead of the preceding
+            keyframe (decodes from that keyframe up to the target), so the
+            same instants are sampled whatever the encoder's GOP layout
+
+    Returns:
+        uint8 array of shape (len(timestamps), height, width); targets past
+        the last keyframe repeat the previous image
+    """
+    width, height = size
+    seek = [] if exact else ['-skip_frame', 'nokey', '-noaccurate_seek']
+    processes = [
+        subprocess.Popen(
+            ['ffmpeg', '-nostdin', '-v', 'error'] + seek +
+            ['-ss', f"{t:.3f}", '-i', video_path, '-frames:v', '1',
+             '-vf', f"scale={width}:{height}:flags=area", '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        for t in timestamps
+    ]
+    images = []
+    with span("decode.keyframes", "decode"):
+        for process in processes:
+            data, _ = process.communicate()
+            if len(data) >= width * height:
+                images.append(np.frombuffer(data[:width * height], dtype=np.uint8).reshape(height, width))
+            elif images:
+                images.append(images[-1])
+    count("frames_decoded", len(images))
+    if not images:
+        raise IOError(f"Could not decode keyframes of {video_path}")
+    # Leading failures take the first decoded image
+    images = [images[0]] * (len(timestamps) - len(images)) + images
+    return np.stack(images)
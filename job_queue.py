@@ -0,0 +1,443 @@
+import os
+import json
+import time
+import uuid
+import pickle
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# Job states; queued and leased jobs are both kept in visibility order, a
+# leased job becoming visible again when its lease expires
+STATES = ("queued", "leased", "done", "dead")
+
+@dataclass
+class Lease:
+    """A job handed to one worker until expires_at"""
+    job_id: str
+    payload: Dict
+    token: str  # identifies this delivery; stale deliveries cannot ack, nack or extend
+    attempt: int  # 1 for the first delivery
+    expires_at: float
+
+def job_id_for(payload: Dict) -> str:
+    """Deterministic job ID of a payload, so re-submitting the same request is a no-op"""
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+class Broker:
+    """
+    Job queue shared by moderation workers on any number of hosts.
+
+    Delivery is at least once: lease() hands a job to one worker for
+    visibility_timeout seconds, and a worker that neither completes, fails
+    nor extends the lease in time is presumed dead, so the job becomes
+    visible to the other workers again. Jobs are keyed by ID (enqueueing an
+    existing ID is a no-op), results are stored per job, and a lease that
+    was taken over can no longer complete its job, so retries are
+    idempotent. Each job keeps a checkpoint of the check results its
+    attempts finished; a redelivered job resumes from it. A job failing
+    max_attempts times moves to the dead state.
+    """
+
+    def enqueue(self, payload: Dict, job_id: Optional[str] = None, max_attempts: int = 3) -> Tuple[str, bool]:
+        """
+        Queue a job unless one with the same ID exists.
+
+        Args:
+            payload: JSON-serializable job description
+            job_id: Job ID (default: derived from the payload)
+            max_attempts: Deliveries before the job is given up
+
+        Returns:
+            (job ID, whether the job was newly queued)
+        """
+        raise NotImplementedError
+
+    def lease(self, visibility_timeout: float) -> Optional[Lease]:
+        """Take the next visible job for visibility_timeout seconds, or None if there is none"""
+        raise NotImplementedError
+
+    def extend(self, lease: Lease, visibility_timeout: float) -> bool:
+        """Push the lease's expiry visibility_timeout seconds from now; False if the lease was lost"""
+        raise NotImplementedError
+
+    def complete(self, lease: Lease, result: Dict) -> bool:
+        """Store the job's result and drop its checkpoint; False if the lease was lost"""
+        raise NotImplementedError
+
+    def fail(self, lease: Lease, error: str, retry_delay: float = 0.0) -> bool:
+        """Make the job visible again after retry_delay seconds, or dead after its last attempt"""
+        raise NotImplementedError
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        """State, attempts, error and result of a job"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        """Job counts by state, as far as the broker can count them cheaply"""
+        raise NotImplementedError
+
+    def load_checkpoint(self, job_id: str) -> Dict[str, Tuple[str, Any]]:
+        """Check name -> (check version, result) saved by earlier attempts of a job"""
+        raise NotImplementedError
+
+    def save_checkpoint(self, job_id: str, check: str, version: str, value: Any):
+        raise NotImplementedError
+
+class Checkpoint:
+    """
+    Check results of one job, saved as each check finishes.
+
+    A redelivered job reloads the results of the checks its earlier
+    attempts finished, as long as the check's version is unchanged.
+    """
+
+    def __init__(self, broker: Broker, job_id: str):
+        self.broker = broker
+        self.job_id = job_id
+
+    def load(self, versions: Dict[str, str]) -> Dict:
+        """
+        Saved results still valid for the given check versions.
+
+        Args:
+            versions: Current version of each check
+
+        Returns:
+            Check name -> result
+        """
+        return {
+            check: value for check, (version, value) in self.broker.load_checkpoint(self.job_id).items()
+            if versions.get(check) == version
+        }
+
+    def save(self, check: str, version: str, value: Any):
+        self.broker.save_checkpoint(self.job_id, check, version, value)
+
+class SQLiteBroker(Broker):
+    """
+    Broker in a single SQLite file, for local runs and tests.
+
+    Any number of worker threads and processes on one host can share the
+    file (leases are taken in an immediate write transaction). It is not
+    meant for network file systems; use RedisBroker across hosts.
+    """
+
+    def __init__(self, path: str = "jobs.sqlite"):
+        """
+        Open (or create) a broker file.
+
+        Args:
+            path: SQLite database path
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs "
+                "(id TEXT PRIMARY KEY, payload TEXT, state TEXT, attempts INTEGER, max_attempts INTEGER, "
+                "token TEXT, visible_at REAL, error TEXT, result TEXT, created_at REAL, updated_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (state, visible_at)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints "
+                "(job_id TEXT, check_name TEXT, version TEXT, value BLOB, PRIMARY KEY (job_id, check_name))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared across threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction taking the database lock up front"""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def enqueue(self, payload: Dict, job_id: Optional[str] = None, max_attempts: int = 3) -> Tuple[str, bool]:
+        job_id = job_id or job_id_for(payload)
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO jobs VALUES (?, ?, 'queued', 0, ?, NULL, ?, NULL, NULL, ?, ?)",
+                (job_id, json.dumps(payload), max_attempts, now, now, now)
+            )
+        return job_id, cursor.rowcount == 1
+
+    def lease(self, visibility_timeout: float) -> Optional[Lease]:
+        now = time.time()
+        with self._transaction() as db:
+            while True:
+                row = db.execute(
+                    "SELECT id, payload, attempts, max_attempts FROM jobs "
+                    "WHERE state IN ('queued', 'leased') AND visible_at <= ? ORDER BY visible_at LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    return None
+                job_id, payload, attempts, max_attempts = row
+                if attempts >= max_attempts:
+                    # The last attempt's lease expired: its worker died mid-job
+                    db.execute(
+                        "UPDATE jobs SET state = 'dead', token = NULL, error = ?, updated_at = ? WHERE id = ?",
+                        ("lease expired on the last attempt", now, job_id)
+                    )
+                    continue
+                token = uuid.uuid4().hex
+                db.execute(
+                    "UPDATE jobs SET state = 'leased', token = ?, attempts = ?, visible_at = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (token, attempts + 1, now + visibility_timeout, now, job_id)
+                )
+                return Lease(job_id, json.loads(payload), token, attempts + 1, now + visibility_timeout)
+
+    def extend(self, lease: Lease, visibility_timeout: float) -> bool:
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET visible_at = ?, updated_at = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                (now + visibility_timeout, now, lease.job_id, lease.token)
+            )
+        if cursor.rowcount == 1:
+            lease.expires_at = now + visibility_timeout
+        return cursor.rowcount == 1
+
+    def complete(self, lease: Lease, result: Dict) -> bool:
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET state = 'done', token = NULL, error = NULL, result = ?, updated_at = ? "
+                "WHERE id = ? AND token = ? AND state = 'leased'",
+                (json.dumps(result), time.time(), lease.job_id, lease.token)
+            )
+            if cursor.rowcount == 1:
+                db.execute("DELETE FROM checkpoints WHERE job_id = ?", (lease.job_id,))
+        return cursor.rowcount == 1
+
+    def fail(self, lease: Lease, error: str, retry_delay: float = 0.0) -> bool:
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END, "
+                "token = NULL, error = ?, visible_at = ?, updated_at = ? "
+                "WHERE id = ? AND token = ? AND state = 'leased'",
+                (error, now + retry_delay, now, lease.job_id, lease.token)
+            )
+        return cursor.rowcount == 1
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT state, attempts, max_attempts, error, result, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        state, attempts, max_attempts, error, result, created_at, updated_at = row
+        return {
+            "id": job_id,
+            "state": state,
+            "attempts": attempts,
+            "max_attempts": max_attempts,
+            "error": error,
+            "result": json.loads(result) if result is not None else None,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def stats(self) -> Dict[str, int]:
+        counts = dict(self._connection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+    def load_checkpoint(self, job_id: str) -> Dict[str, Tuple[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT check_name, version, value FROM checkpoints WHERE job_id = ?", (job_id,)
+        ).fetchall()
+        return {check: (version, pickle.loads(value)) for check, version, value in rows}
+
+    def save_checkpoint(self, job_id: str, check: str, version: str, value: Any):
+        value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)", (job_id, check, version, value))
+
+# Redis scripts: each state change is one atomic server-side step, and every
+# change of a leased job first checks the caller still holds the lease.
+# KEYS[1] is the sorted set of queued and leased job IDs by visibility time
+_ENQUEUE = """
+local key = ARGV[1] .. ':job:' .. ARGV[2]
+if redis.call('EXISTS', key) == 1 then return 0 end
+redis.call('HSET', key, 'payload', ARGV[3], 'state', 'queued', 'attempts', 0, 'max_attempts', ARGV[4],
+           'created_at', ARGV[5], 'updated_at', ARGV[5])
+redis.call('ZADD', KEYS[1], ARGV[5], ARGV[2])
+return 1
+"""
+
+_LEASE = """
+local now = tonumber(ARGV[2])
+while true do
+  local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1)
+  if #ids == 0 then return false end
+  local key = ARGV[1] .. ':job:' .. ids[1]
+  local attempts = tonumber(redis.call('HGET', key, 'attempts'))
+  if attempts >= tonumber(redis.call('HGET', key, 'max_attempts')) then
+    redis.call('ZREM', KEYS[1], ids[1])
+    redis.call('HSET', key, 'state', 'dead', 'token', '', 'error', 'lease expired on the last attempt',
+               'updated_at', ARGV[2])
+  else
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ids[1])
+    redis.call('HSET', key, 'state', 'leased', 'token', ARGV[4], 'attempts', attempts + 1, 'updated_at', ARGV[2])
+    return {ids[1], redis.call('HGET', key, 'payload'), attempts + 1}
+  end
+end
+"""
+
+_EXTEND = """
+local key = ARGV[1] .. ':job:' .. ARGV[2]
+if redis.call('HGET', key, 'state') ~= 'leased' or redis.call('HGET', key, 'token') ~= ARGV[3] then return 0 end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[2])
+return 1
+"""
+
+_COMPLETE = """
+local key = ARGV[1] .. ':job:' .. ARGV[2]
+if redis.call('HGET', key, 'state') ~= 'leased' or redis.call('HGET', key, 'token') ~= ARGV[3] then return 0 end
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('HSET', key, 'state', 'done', 'token', '', 'error', '', 'result', ARGV[4], 'updated_at', ARGV[5])
+redis.call('DEL', ARGV[1] .. ':checkpoint:' .. ARGV[2])
+return 1
+"""
+
+_FAIL = """
+local key = ARGV[1] .. ':job:' .. ARGV[2]
+if redis.call('HGET', key, 'state') ~= 'leased' or redis.call('HGET', key, 'token') ~= ARGV[3] then return 0 end
+if tonumber(redis.call('HGET', key, 'attempts')) >= tonumber(redis.call('HGET', key, 'max_attempts')) then
+  redis.call('ZREM', KEYS[1], ARGV[2])
+  redis.call('HSET', key, 'state', 'dead')
+else
+  redis.call('ZADD', KEYS[1], ARGV[5], ARGV[2])
+  redis.call('HSET', key, 'state', 'queued')
+end
+redis.call('HSET', key, 'token', '', 'error', ARGV[4], 'updated_at', ARGV[6])
+return 1
+"""
+
+class RedisBroker(Broker):
+    """
+    Broker on a Redis-compatible server, shared by workers on every host.
+
+    A job is a hash under {prefix}:job:{id}; queued and leased jobs sit in
+    one sorted set scored by the time they become visible, so expired
+    leases need no sweeper. Each state change runs as one server-side
+    script, and checkpoints are a hash per job. The scripts touch keys
+    they derive from the prefix, so the broker needs a single (non-cluster)
+    server or a cluster slot tag in the prefix, e.g. "{moderation}".
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "moderation"):
+        """
+        Connect to the server.
+
+        Args:
+            url: Server URL
+            prefix: Key prefix of this queue
+        """
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._visible = f"{prefix}:visible"
+        self._enqueue = self.client.register_script(_ENQUEUE)
+        self._lease = self.client.register_script(_LEASE)
+        self._extend = self.client.register_script(_EXTEND)
+        self._complete = self.client.register_script(_COMPLETE)
+        self._fail = self.client.register_script(_FAIL)
+
+    def enqueue(self, payload: Dict, job_id: Optional[str] = None, max_attempts: int = 3) -> Tuple[str, bool]:
+        job_id = job_id or job_id_for(payload)
+        queued = self._enqueue(
+            keys=[self._visible], args=[self.prefix, job_id, json.dumps(payload), max_attempts, time.time()]
+        )
+        return job_id, bool(queued)
+
+    def lease(self, visibility_timeout: float) -> Optional[Lease]:
+        now = time.time()
+        token = uuid.uuid4().hex
+        leased = self._lease(keys=[self._visible], args=[self.prefix, now, visibility_timeout, token])
+        if not leased:
+            return None
+        job_id, payload, attempt = leased
+        return Lease(job_id.decode(), json.loads(payload), token, int(attempt), now + visibility_timeout)
+
+    def extend(self, lease: Lease, visibility_timeout: float) -> bool:
+        expires_at = time.time() + visibility_timeout
+        extended = self._extend(keys=[self._visible], args=[self.prefix, lease.job_id, lease.token, expires_at])
+        if extended:
+            lease.expires_at = expires_at
+        return bool(extended)
+
+    def complete(self, lease: Lease, result: Dict) -> bool:
+        return bool(self._complete(
+            keys=[self._visible], args=[self.prefix, lease.job_id, lease.token, json.dumps(result), time.time()]
+        ))
+
+    def fail(self, lease: Lease, error: str, retry_delay: float = 0.0) -> bool:
+        now = time.time()
+        return bool(self._fail(
+            keys=[self._visible], args=[self.prefix, lease.job_id, lease.token, error, now + retry_delay, now]
+        ))
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        saved = self.client.hgetall(f"{self.prefix}:job:{job_id}")
+        fields = {key.decode(): value.decode() for key, value in saved.items()}
+        if not fields:
+            return None
+        return {
+            "id": job_id,
+            "state": fields["state"],
+            "attempts": int(fields["attempts"]),
+            "max_attempts": int(fields["max_attempts"]),
+            "error": fields.get("error") or None,
+            "result": json.loads(fields["result"]) if fields.get("result") else None,
+            "created_at": float(fields["created_at"]),
+            "updated_at": float(fields["updated_at"])
+        }
+
+    def stats(self) -> Dict[str, int]:
+        # Counting every state needs a scan; only the live ones are cheap to count
+        now = time.time()
+        return {
+            "visible": self.client.zcount(self._visible, "-inf", now),
+            "leased": self.client.zcount(self._visible, f"({now}", "+inf")
+        }
+
+    def load_checkpoint(self, job_id: str) -> Dict[str, Tuple[str, Any]]:
+        saved = self.client.hgetall(f"{self.prefix}:checkpoint:{job_id}")
+        return {check.decode(): pickle.loads(value) for check, value in saved.items()}
+
+    def save_checkpoint(self, job_id: str, check: str, version: str, value: Any):
+        value = pickle.dumps((version, value), protocol=pickle.HIGHEST_PROTOCOL)
+        self.client.hset(f"{self.prefix}:checkpoint:{job_id}", check, value)
+
+def open_broker(url: str) -> Broker:
+    """
+    Broker for a URL: redis://... (or rediss://...) for RedisBroker, anything
+    else (optionally sqlite:///path) for an SQLiteBroker file.
+    """
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBroker(url)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SQLiteBroker(url)
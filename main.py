@@ -1,16 +1,19 @@
 import os
 import json
-from typing import Dict
+import argparse
+from typing import Dict, List, Optional
 from moderator import Moderator
+from metrics import SamplingProfiler
+from rules import RuleSet
 
 class VideoModerationService:
     """
     Main service class that handles video moderation requests.
     """
     
-    def __init__(self):
-        """Initialize moderation service"""
-        self.moderator = Moderator()
+    def __init__(self, profiler: Optional[SamplingProfiler] = None, rules: Optional[RuleSet] = None):
+        """Initialize moderation service, optionally sampling hot paths with profiler and with custom decision rules"""
+        self.moderator = Moderator(profiler=profiler, rules=rules)
         
     def moderate_video(self, video_path: str) -> Dict:
         """
@@ -32,20 +35,94 @@ class VideoModerationService:
             
         return self.moderator.process_video(video_path)
         
-    def save_results(self, results: Dict, output_path: str):
+    def moderate_batch(self, video_paths: List[str]) -> List:
+        """
+        Moderate many videos with batched model inference.
+        
+        Args:
+            video_paths: Paths to video files to moderate
+            
+        Returns:
+            List of moderation results, in the same order as video_paths
+        """
+        for video_path in video_paths:
+            if not os.path.exists(video_path):
+                raise FileNotFoundError(f"Video file not found: {video_path}")
+                
+        return self.moderator.process_batch(video_paths)
+        
+    def save_results(self, results, output_path: str):
         """
         Save moderation results to JSON file.
         
         Args:
-            results: Moderation results dictionary
+            results: Moderation result, or list of results
             output_path: Path to save JSON file
         """
+        if isinstance(results, list):
+            data = [result.to_dict() for result in results]
+        else:
+            data = results.to_dict()
         with open(output_path, 'w') as f:
-            json.dump(results, f, indent=2)
+            json.dump(data, f, indent=2)
 
 if __name__ == "__main__":
-    # Example usage
-    service = VideoModerationService()
-    results = service.moderate_video("input_video.mp4")
-    service.save_results(results, "moderation_results.json")
-    print("Moderation completed. Results saved.")
+    parser = argparse.ArgumentParser(description="Moderate videos")
+    parser.add_argument("videos", nargs="*", help="Video files to moderate")
+    parser.add_argument("--output", default="moderation_results.json", help="Where to save results")
+    parser.add_argument("--serve", action="store_true", help="Run the HTTP API instead")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-queue", type=int, default=100, help="Jobs that may wait before submissions are rejected")
+    parser.add_argument("--concurrency", type=int, default=4, help="Videos moderated at once")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-job timeout in seconds")
+    parser.add_argument("--profile", help="Sample hot paths and write collapsed stacks (flame graph input) here")
+    parser.add_argument("--rules", help="JSON file of decision rules replacing the default policy")
+    parser.add_argument("--broker", default="jobs.sqlite",
+                        help="Job queue for --enqueue/--worker: an SQLite file, or redis://host:port/db")
+    parser.add_argument("--enqueue", action="store_true", help="Queue the videos as jobs instead of moderating them")
+    parser.add_argument("--worker", action="store_true", help="Moderate jobs pulled from the job queue")
+    parser.add_argument("--visibility-timeout", type=float, default=120.0,
+                        help="Seconds a job stays leased to a worker that stopped sending heartbeats")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Deliveries of a job before it is given up")
+    parser.add_argument("--exit-when-idle", action="store_true", help="Stop the worker once the queue is empty")
+    args = parser.parse_args()
+    
+    rules = None
+    if args.rules:
+        with open(args.rules) as f:
+            rules = RuleSet.from_config(json.load(f))
+            
+    if args.enqueue or args.worker:
+        from job_queue import open_broker
+        from worker import JsonlSink, ModerationWorker, enqueue_videos
+        broker = open_broker(args.broker)
+        if args.enqueue:
+            for job_id in enqueue_videos(broker, args.videos, rules, max_attempts=args.max_attempts):
+                print(job_id)
+        if args.worker:
+            worker = ModerationWorker(
+                broker, Moderator(rules=rules), concurrency=args.concurrency,
+                visibility_timeout=args.visibility_timeout, sink=JsonlSink(args.output)
+            )
+            # Results go to the broker and, one JSON line per job, to --output
+            worker.run(exit_when_idle=args.exit_when_idle)
+    elif args.serve:
+        from async_service import AsyncModerationService, serve
+        serve(
+            AsyncModerationService(
+                Moderator(rules=rules), max_queue=args.max_queue, concurrency=args.concurrency, timeout=args.timeout
+            ),
+            host=args.host, port=args.port
+        )
+    elif args.videos:
+        profiler = SamplingProfiler() if args.profile else None
+        service = VideoModerationService(profiler, rules)
+        results = service.moderate_batch(args.videos) if len(args.videos) > 1 else service.moderate_video(args.videos[0])
+        service.save_results(results, args.output)
+        if profiler is not None:
+            with open(args.profile, 'w') as f:
+                f.write(profiler.collapsed())
+        print("Moderation completed. Results saved.")
+    else:
+        parser.error("give video files to moderate, or --serve, or --worker")
@@ -0,0 +1,100 @@
+import os
+import json
+import subprocess
+from dataclasses import dataclass
+from functools import lru_cache
+from fractions import Fraction
+from typing import Dict, Optional
+from metrics import span
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """Stream properties read from the container header"""
+    duration: float  # seconds
+    width: int  # as displayed, i.e. after rotation
+    height: int
+    rotation: int  # degrees clockwise, one of 0, 90, 180, 270
+    codec: str
+    fps: float
+    frame_count: int  # from the header if stored, else estimated from duration and fps
+    has_audio: bool
+    audio_codec: Optional[str]
+    container: str
+
+    @property
+    def aspect_ratio(self) -> float:
+        return self.width / self.height if self.height else 0.0
+
+def probe_video(video_path: str) -> MediaInfo:
+    """
+    Read the stream properties of a video without decoding any frame.
+
+    ffprobe only parses the container header (and, for formats without
+    one, the first packets). Results are cached per path, size and
+    modification time, so every stage of a moderation shares one probe
+    and a growing file is re-probed once it changes.
+
+    Args:
+        video_path: Path to video file
+
+    Returns:
+        Properties of the first video stream and of the audio
+    """
+    stat = os.stat(video_path)
+    return _probe(os.path.realpath(video_path), stat.st_size, stat.st_mtime_ns)
+
+@lru_cache(maxsize=4096)
+def _probe(video_path: str, size: int, mtime_ns: int) -> MediaInfo:
+    cmd = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', video_path]
+    with span("probe", "io"):
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise IOError(f"Could not open video: {video_path}: {process.stderr.decode(errors='replace').strip()}")
+    header = json.loads(process.stdout)
+    streams = header.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if video is None:
+        raise IOError(f"Could not open video: {video_path}: no video stream")
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    container = header.get("format", {})
+
+    fps = _rate(video.get("avg_frame_rate")) or _rate(video.get("r_frame_rate")) or 25.0
+    duration = _float(container.get("duration")) or _float(video.get("duration"))
+    frame_count = int(video.get("nb_frames") or 0) or int(round(duration * fps))
+    rotation = _rotation(video)
+    width, height = int(video.get("width", 0)), int(video.get("height", 0))
+    if rotation in (90, 270):
+        width, height = height, width
+    return MediaInfo(
+        duration=duration,
+        width=width,
+        height=height,
+        rotation=rotation,
+        codec=video.get("codec_name", ""),
+        fps=fps,
+        frame_count=frame_count,
+        has_audio=audio is not None,
+        audio_codec=audio.get("codec_name") if audio is not None else None,
+        container=container.get("format_name", "")
+    )
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _rate(value: Optional[str]) -> float:
+    """Frame rate from an ffprobe ratio such as "30000/1001" (0 if unknown)"""
+    try:
+        return float(Fraction(value))
+    except (TypeError, ValueError, ZeroDivisionError):
+        return 0.0
+
+def _rotation(stream: Dict) -> int:
+    # Newer ffprobe reports a display matrix side data entry (counter-clockwise),
+    # older versions the "rotate" tag (clockwise)
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            return int(-_float(side_data["rotation"])) % 360
+    return int(_float(stream.get("tags", {}).get("rotate"))) % 360
@@ -0,0 +1,338 @@
+import sys
+import time
+import bisect
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Seconds; covers cheap I/O up to whole-video model passes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+HELP = {
+    "moderation_span_seconds": "Duration of instrumented operations by span name and kind",
+    "moderation_stage_queue_seconds": "Time tasks waited in a scheduler stage queue",
+    "moderation_stage_seconds": "Time tasks ran in a scheduler stage",
+    "moderation_stage_errors_total": "Scheduler tasks that raised, by stage",
+    "moderation_model_invocations_total": "Forward passes per model",
+    "moderation_frames_decoded_total": "Video frames decoded",
+    "moderation_videos_total": "Videos moderated, by status",
+    "moderation_video_seconds": "End-to-end moderation time per video",
+    "moderation_job_queue_seconds": "Time jobs waited in the service queue before running"
+}
+
+@dataclass
+class Span:
+    """One timed operation of a moderation"""
+    name: str
+    kind: str  # decode, inference, io, cpu, queue or stage
+    start: float  # seconds since the trace started
+    seconds: float
+    thread: str
+    error: Optional[str] = None
+
+class Trace:
+    """
+    Spans and counters recorded while moderating one video.
+
+    The trace is carried in a context variable; StageScheduler runs thread
+    tasks in the context they were submitted from, so spans recorded by
+    detectors on worker threads land in the trace of their video.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, kind: str, started: float, seconds: float, error: Optional[str] = None):
+        """Record a span that started at perf_counter() time started"""
+        span = Span(name, kind, started - self.origin, seconds, threading.current_thread().name, error)
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def extend(self, other: "Trace"):
+        """Add the spans and counters of a trace shared with other videos (e.g. a batched pass)"""
+        with other._lock:
+            spans, counters = list(other.spans), Counter(other.counters)
+        with self._lock:
+            self.spans.extend(
+                Span(s.name, s.kind, s.start + other.origin - self.origin, s.seconds, s.thread, s.error)
+                for s in spans
+            )
+            self.counters.update(counters)
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Count and total seconds per span name"""
+        totals: Dict[str, Dict[str, float]] = defaultdict(lambda: {"count": 0, "seconds": 0.0})
+        with self._lock:
+            for span in self.spans:
+                key = f"{span.kind}:{span.name}"
+                totals[key]["count"] += 1
+                totals[key]["seconds"] += span.seconds
+        return dict(totals)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+            counters = dict(self.counters)
+        return {
+            "elapsed": time.perf_counter() - self.origin,
+            "counters": counters,
+            "totals": self.totals(),
+            "spans": [asdict(span) for span in spans]
+        }
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+# Open span names per thread ident, innermost last, for the sampling profiler
+_active_spans: Dict[int, List[str]] = {}
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+@contextmanager
+def tracing(trace: Trace) -> Iterator[Trace]:
+    """Make trace the current trace of this context (and of scheduler tasks submitted from it)"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, cumulative count) pairs, ending with +Inf"""
+        pairs, total = [], 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            pairs.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return pairs
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escape = lambda value: value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+class MetricsRegistry:
+    """
+    Process-wide counters and latency histograms.
+
+    Every Moderator, scheduler and detector in the process records into the
+    default registry, which renders in the Prometheus text exposition format.
+    """
+
+    _default: Optional["MetricsRegistry"] = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls) -> "MetricsRegistry":
+        """The registry shared by everything in this process"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add value to the counter name{labels}"""
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record value in the histogram name{labels}"""
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms[name]
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Counter values and histogram count/sum per series"""
+        with self._lock:
+            return {
+                "counters": {
+                    name + _format_labels(key): value
+                    for name, series in self._counters.items() for key, value in series.items()
+                },
+                "histograms": {
+                    name + _format_labels(key): {"count": histogram.count, "sum": histogram.sum}
+                    for name, series in self._histograms.items() for key, histogram in series.items()
+                }
+            }
+
+    def to_prometheus(self) -> str:
+        """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name in sorted(self._histograms):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    for le, count in histogram.cumulative():
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', le),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+@contextmanager
+def span(name: str, kind: str = "cpu") -> Iterator[None]:
+    """
+    Time a block as a span of the current trace and in moderation_span_seconds.
+
+    Spans of kind "inference" are named after the model and also count one
+    invocation of it. A block that raises records the exception type and
+    re-raises.
+    """
+    ident = threading.get_ident()
+    stack = _active_spans.setdefault(ident, [])
+    stack.append(name)
+    error = None
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        stack.pop()
+        if not stack:
+            _active_spans.pop(ident, None)
+        registry = MetricsRegistry.default()
+        registry.observe("moderation_span_seconds", seconds, span=name, kind=kind)
+        if kind == "inference":
+            registry.inc("moderation_model_invocations_total", model=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, kind, started, seconds, error)
+            if kind == "inference":
+                trace.count(f"invocations:{name}")
+
+def count(name: str, value: float = 1, **labels):
+    """Add value to the counter moderation_<name>_total and to the current trace"""
+    MetricsRegistry.default().inc(f"moderation_{name}_total", value, **labels)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+class SamplingProfiler:
+    """
+    Statistical profiler for finding hot paths in production.
+
+    While sampling, a background thread snapshots the Python stack of every
+    other thread each interval seconds and counts the collapsed stacks,
+    prefixed with the innermost open span of the thread, so hot code is
+    attributed to the check it ran for. Output is in the collapsed format
+    that flame graph tools read. Sampling is reference counted, so
+    overlapping moderations share one sampler thread.
+    """
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 64, spans_only: bool = True):
+        """
+        Initialize profiler.
+
+        Args:
+            interval: Seconds between samples
+            max_depth: Innermost frames kept per stack
+            spans_only: Only sample threads inside a span (skips idle pool workers)
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.spans_only = spans_only
+        self.samples: Counter = Counter()
+        self._users = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._lock:
+            self._users += 1
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._users -= 1
+            if self._users > 0 or self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+            self._stop.set()
+        thread.join()
+
+    @contextmanager
+    def sampling(self) -> Iterator["SamplingProfiler"]:
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                spans = _active_spans.get(ident)
+                if ident == own or (self.spans_only and not spans):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                prefix = [f"span:{spans[-1]}"] if spans else []
+                self.samples[";".join(prefix + stack[::-1])] += 1
+
+    def collapsed(self) -> str:
+        """Samples as "frame;frame;frame count" lines, for flame graph tools"""
+        return "\n".join(f"{stack} {n}" for stack, n in self.samples.most_common()) + "\n"
+
+    def hottest(self, limit: int = 20) -> List[Tuple[str, float]]:
+        """Functions most often on top of a sampled stack, with their share of samples"""
+        total = sum(self.samples.values())
+        leaves: Counter = Counter()
+        for stack, n in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        return [(leaf, n / total) for leaf, n in leaves.most_common(limit)] if total else []
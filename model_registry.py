@@ -0,0 +1,129 @@
+import os
+import time
+import resource
+import threading
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Iterable, Optional
+
+I3D_MODEL_URL = "https://tfhub.dev/deepmind/i3d-kinetics-600/1"
+VGGISH_MODEL_URL = "https://tfhub.dev/google/vggish/1"
+
+@dataclass
+class ModelStats:
+    name: str
+    load_seconds: float
+    rss_delta_bytes: int  # approximate when several models load concurrently
+    warmup_seconds: Optional[float] = None
+
+def _current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak RSS (KiB on Linux) is the best portable fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def hub_signature(url: str) -> Callable:
+    """Loader for the default signature of a TensorFlow Hub model"""
+    def _load():
+        import tensorflow_hub as hub
+        return hub.load(url).signatures['default']
+    return _load
+
+def _warm_i3d(model):
+    import tensorflow as tf
+    model(tf.zeros([1, 16, 224, 224, 3], dtype=tf.float32))
+
+def _warm_vggish(model):
+    import tensorflow as tf
+    model(tf.zeros([1, 16000], dtype=tf.float32))
+
+class ModelRegistry:
+    """
+    Process-wide registry of lazily loaded models shared by all detectors.
+
+    Detectors register a loader under a name and fetch the model with get()
+    when they first need it. Each model is loaded once per process, on first
+    use, so a worker that never runs a given check never loads its model.
+    Load time and resident memory growth are recorded for every model.
+    """
+
+    _default: Optional["ModelRegistry"] = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable] = {}
+        self._warmups: Dict[str, Callable] = {}
+        self._models: Dict[str, object] = {}
+        self._stats: Dict[str, ModelStats] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls) -> "ModelRegistry":
+        """The registry shared by every detector in this process"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+                cls._default.register("i3d", hub_signature(I3D_MODEL_URL), _warm_i3d)
+                cls._default.register("vggish", hub_signature(VGGISH_MODEL_URL), _warm_vggish)
+            return cls._default
+
+    def register(self, name: str, loader: Callable[[], object],
+                 warmup: Optional[Callable[[object], None]] = None):
+        """
+        Register a model loader; the first registration of a name wins.
+
+        Args:
+            name: Model name, unique per weights/configuration
+            loader: Function returning the loaded model
+            warmup: Optional function running a dummy inference on the model
+        """
+        with self._lock:
+            self._loaders.setdefault(name, loader)
+            if warmup is not None:
+                self._warmups.setdefault(name, warmup)
+            self._locks.setdefault(name, threading.Lock())
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str):
+        """Return the model called name, loading it on first use"""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._locks:
+            raise KeyError(f"No model registered as {name!r}")
+        with self._locks[name]:
+            if name not in self._models:
+                rss_before = _current_rss()
+                start = time.perf_counter()
+                model = self._loaders[name]()
+                self._stats[name] = ModelStats(
+                    name=name,
+                    load_seconds=time.perf_counter() - start,
+                    rss_delta_bytes=max(_current_rss() - rss_before, 0)
+                )
+                self._models[name] = model
+        return self._models[name]
+
+    def warm_up(self, names: Optional[Iterable[str]] = None):
+        """
+        Load models and run their warm-up inference ahead of the first request.
+
+        Args:
+            names: Models to warm up (default: every registered model)
+        """
+        for name in (list(names) if names is not None else list(self._loaders)):
+            model = self.get(name)
+            warmup = self._warmups.get(name)
+            if warmup is not None and self._stats[name].warmup_seconds is None:
+                start = time.perf_counter()
+                warmup(model)
+                self._stats[name].warmup_seconds = time.perf_counter() - start
+
+    def stats(self) -> Dict[str, dict]:
+        """Load time, warm-up time and memory of every loaded model"""
+        return {name: asdict(stats) for name, stats in self._stats.items()}
@@ -1,9 +1,37 @@
-from typing import Dict, Tuple, Optional
+from typing import BinaryIO, Callable, ContextManager, Dict, Iterator, List, Tuple, Optional, Sequence, Union
 import os
+import time
 import json
-from dataclasses import dataclass
+import hashlib
+import contextlib
+from dataclasses import dataclass, field, asdict
 import concurrent.futures
 from datetime import datetime
+import numpy as np
+from functools import partial
+from frame_source import Frame, FrameSource, FrameSubscription
+from scheduler import StageConfig, StageScheduler, gather, starcall
+from result_cache import ResultCache, content_hash
+from feature_context import FeatureContext, batch_embeddings
+from model_registry import ModelRegistry
+from audio_source import SAMPLE_RATE, read_pcm
+from media_probe import probe_video
+from metrics import MetricsRegistry, SamplingProfiler, Trace, current_trace, span, tracing
+from duplicate_index import DuplicateIndex, VideoSignature
+from sampling_planner import DEFAULT_BUDGETS, SamplingPlanner
+from job_queue import Checkpoint
+from rules import DEFAULT_DECISION_RULES, RuleSet
+from nsfw import NSFWDetector
+from ocr import OCRProcessor
+from object_detection import ObjectDetector
+from copyright_detector import CopyrightDetector
+from audio_fingerprint import AudioFingerprintIndex
+from video_similarity import SEGMENT_FPS, VideoSimilarity
+from quality_detection import QualityDetector
+from content_check import ContentChecker
+from thumbnail_creation import ThumbnailGenerator
+from streaming import ProvisionalDecision, StreamDecoder, StreamState, windows
+from frame_source import select_evenly
 
 @dataclass
 class ModerationResult:
@@ -12,55 +40,572 @@ class ModerationResult:
     thumbnail_path: Optional[str]
     details: Dict
     metadata: dict
+    
+    def to_dict(self) -> Dict:
+        """JSON-serializable form of the result"""
+        return json.loads(json.dumps(asdict(self), default=_json_default))
+
+def _json_default(value):
+    """Encode NumPy values (and anything else) found in check details"""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return str(value)
+
+@dataclass
+class CheckOutcome:
+    """Results of the checks of one video, ready for the final decision"""
+    results: Dict
+    thumbnail_frames: Optional[List[Frame]]
+    context: FeatureContext
+    level: Optional[str] = None  # set when fixed before every check ran
+    skipped: List[str] = field(default_factory=list)
+    thumbnail: Optional[concurrent.futures.Future] = None  # speculatively chosen thumbnail image
+    digest: Optional[str] = None  # content hash of the video, if computed
+
+_MISSING = object()
+
+def _completed(value) -> concurrent.futures.Future:
+    future = concurrent.futures.Future()
+    future.set_result(value)
+    return future
+
+def _failed(error: Exception) -> concurrent.futures.Future:
+    future = concurrent.futures.Future()
+    future.set_exception(error)
+    return future
+
+@dataclass
+class CheckRun:
+    """Checks of one video in flight on the scheduler"""
+    source: Optional[FrameSource]
+    futures: Dict[str, concurrent.futures.Future]
+    thumbnail: Optional[concurrent.futures.Future]  # speculative thumbnail choice
+    decode: Optional[concurrent.futures.Future]
+    deferred: Dict[str, Callable[[], concurrent.futures.Future]]
+    context: FeatureContext
+    digest: Optional[str] = None
+    
+    def submit_deferred(self):
+        """Schedule the checks held back until now"""
+        for key, submit in self.deferred.items():
+            self.futures[key] = submit()
+        self.deferred.clear()
+        
+    def cancel(self) -> List[str]:
+        """Cancel or abandon all unfinished work, returning the checks skipped"""
+        skipped = list(self.deferred)
+        self.deferred.clear()
+        for key, future in self.futures.items():
+            if not future.done():
+                future.cancel()
+                skipped.append(key)
+        if self.thumbnail is not None:
+            self.thumbnail.cancel()
+        if self.decode is not None:
+            self.decode.cancel()
+            self.source.close()
+        return skipped
 
 class Moderator:
     """Orchestrates all moderation checks and makes final decision"""
     
-    def __init__(self):
-        self.nsfw_detector = NSFWDetector()
+    # Checks backed by a neural model, run over stacked inputs in process_batch
+    MODEL_CHECKS = ("nsfw", "objects", "copyright")
+    
+    # Bump a check's version whenever its model changes; its configuration
+    # is folded into the cache key separately (see _check_version)
+    CHECK_VERSIONS = {"nsfw": "1", "ocr": "3", "objects": "1", "copyright": "4", "quality": "3", "content": "2"}
+    
+    # Frame subscription each frame-based check consumes
+    CHECK_FRAMES = {"nsfw": "i3d", "ocr": "ocr", "objects": "objects", "quality": "quality"}
+    
+    # Checks reading another check's result: copyright takes its logos from
+    # the object detections instead of running YOLO on frames of its own
+    CHECK_DEPENDENCIES = {"copyright": ("objects",)}
+    
+    # The decoded inputs each check reads. NSFW and
+    # copyright share the I3D clip (and copyright and quality the audio)
+    # through the per-video FeatureContext; an input is only decoded if a
+    # check that runs reads it. Segment frames are only decoded when there
+    # is a segment index to search
+    CHECK_INPUTS = {
+        "nsfw": ("i3d",),
+        "copyright": ("i3d", "segments", "audio"),
+        "objects": ("objects",),
+        "ocr": ("ocr",),
+        "quality": ("quality", "audio"),
+        "content": ()
+    }
+    
+    # Relative cost of each check, used to order work in short-circuit mode
+    CHECK_COSTS = {"content": 1, "quality": 2, "objects": 4, "ocr": 5, "nsfw": 8, "copyright": 10}
+    
+    # Model, subprocess and whole-array NumPy stages release the GIL and run
+    # on threads
+    DEFAULT_STAGES = {
+        "decode": StageConfig("thread", os.cpu_count() or 1),
+        "audio": StageConfig("thread", os.cpu_count() or 1),
+        "nsfw": StageConfig("thread", 2),
+        "objects": StageConfig("thread", 2),
+        "copyright": StageConfig("thread", 2),
+        "ocr": StageConfig("thread", os.cpu_count() or 1),
+        "quality": StageConfig("thread", os.cpu_count() or 1),
+        "content": StageConfig("thread"),
+        "thumbnail": StageConfig("thread", 2)
+    }
+    
+    # Stages that can be moved to worker processes with StageConfig("process"):
+    # their tasks pickle (detectors rebuild their models in each worker). The
+    # others read the per-video FeatureContext, the similarity indexes or the
+    # decoder's subscriptions and must share the moderator's process
+    PROCESS_STAGES = ("objects", "ocr", "quality")
+    
+    def __init__(self, frame_buffer_size: int = 32, thumbnail_candidates: int = 10,
+                 stages: Optional[Dict[str, StageConfig]] = None,
+                 thread_workers: Optional[int] = None, process_workers: Optional[int] = None,
+                 short_circuit: bool = False, result_cache: Optional[ResultCache] = None,
+                 cache_results: bool = True, registry: Optional[ModelRegistry] = None,
+                 similarity_index_path: Optional[str] = None, index_approved: bool = False,
+                 profiler: Optional[SamplingProfiler] = None, duplicate_index_path: Optional[str] = None,
+                 rules: Optional[RuleSet] = None, report_checks: Sequence[str] = (),
+                 segment_index_path: Optional[str] = None, adaptive_sampling: bool = True,
+                 audio_index_path: Optional[str] = None):
+        # Detectors are cheap to build: their models load through the shared
+        # registry the first time a check actually needs them
+        self.registry = registry or ModelRegistry.default()
+        self.nsfw_detector = NSFWDetector(registry=self.registry)
         self.ocr_processor = OCRProcessor()
-        self.object_detector = ObjectDetector()
-        self.copyright_detector = CopyrightDetector()
+        self.object_detector = ObjectDetector(registry=self.registry)
+        self.copyright_detector = CopyrightDetector(
+            similarity_checker=VideoSimilarity(
+                similarity_index_path, registry=self.registry, segment_index_path=segment_index_path
+            ),
+            object_detector=self.object_detector,
+            # Landmark index of reference music, matched against the shared PCM decode
+            audio_index=AudioFingerprintIndex(audio_index_path) if audio_index_path else None
+        )
         self.quality_detector = QualityDetector()
         self.content_checker = ContentChecker()
-        self.thumbnail_generator = ThumbnailGenerator()
-        
-    def _run_parallel_checks(self, video_path: str) -> Dict:
-        """Run all checks in parallel"""
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {
-                "nsfw": executor.submit(self.nsfw_detector.classify_video, video_path),
-                "ocr": executor.submit(self.ocr_processor.process_video, video_path),
-                "objects": executor.submit(self.object_detector.process_video, video_path),
-                "copyright": executor.submit(self.copyright_detector.detect_copyright, video_path),
-                "quality": executor.submit(self.quality_detector.assess_quality, video_path),
-                "content": executor.submit(self.content_checker.run_content_checks, video_path)
-            }
+        self.thumbnail_generator = ThumbnailGenerator(registry=self.registry)
+        self.frame_buffer_size = frame_buffer_size
+        self.thumbnail_candidates = thumbnail_candidates
+        self.short_circuit = short_circuit
+        self.index_approved = index_approved
+        self.profiler = profiler
+        # Decision policy: only the checks its rules read (plus report_checks,
+        # whose results are wanted in the details anyway) are computed
+        self.rules = (rules or RuleSet.from_config(DEFAULT_DECISION_RULES)) + self.content_checker.rule_set
+        self.report_checks = list(report_checks)
+        # Frame-based checks get frames where the video changes (see SamplingPlanner)
+        self.sampling_planner = SamplingPlanner() if adaptive_sampling else None
+        # Perceptual-hash prefilter: re-uploads of judged content reuse the verdict
+        self.duplicate_index = DuplicateIndex(duplicate_index_path) if duplicate_index_path else None
+        self.result_cache = (result_cache or ResultCache()) if cache_results else None
+        stages = {**self.DEFAULT_STAGES, **(stages or {})}
+        unsupported = sorted(
+            name for name, config in stages.items() if config.pool == "process" and name not in self.PROCESS_STAGES
+        )
+        if unsupported:
+            raise ValueError(f"Stages {unsupported} cannot run in worker processes (only {list(self.PROCESS_STAGES)})")
+        self.scheduler = StageScheduler(
+            stages,
+            thread_workers=thread_workers,
+            process_workers=process_workers
+        )
+        
+    def _check_models(self) -> Dict[str, List[str]]:
+        """Registry names of the models each check uses"""
+        return {
+            "nsfw": ["i3d", self.nsfw_detector.model_name],
+            "objects": [self.object_detector.model_name],
+            "copyright": ["i3d", "vggish", self.object_detector.model_name],
+            "thumbnail": [self.thumbnail_generator.face_model_name, self.thumbnail_generator.emotion_model_name]
+        }
+        
+    def warm_up(self, checks: Optional[Sequence[str]] = None):
+        """
+        Load and warm up the models of the given checks ahead of the first video.
+        
+        Args:
+            checks: Checks this worker will run (default: all of them)
+        """
+        models = self._check_models()
+        names = []
+        for check in (checks if checks is not None else models):
+            names.extend(name for name in models.get(check, []) if name not in names)
+        self.registry.warm_up(names)
+        
+    def model_stats(self) -> Dict[str, dict]:
+        """Load time, warm-up time and memory of every model loaded so far"""
+        return self.registry.stats()
+        
+    def prometheus_metrics(self) -> str:
+        """Counters and latency histograms of this process in the Prometheus text format"""
+        return MetricsRegistry.default().to_prometheus()
+        
+    def _profiling(self) -> ContextManager:
+        return self.profiler.sampling() if self.profiler is not None else contextlib.nullcontext()
+        
+    def close(self):
+        """Shut down the worker pools"""
+        self.scheduler.shutdown()
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+        
+    def _subscribe_checks(self, source: FrameSource, keys: Sequence[str]) -> Dict[str, FrameSubscription]:
+        """Describe the frames each of the given checks needs from the shared decode"""
+        i3d_size = (224, 224)
+        # Full-resolution 1 fps streams are capped at their planning budget,
+        # which also bounds them when the planner is off or fails
+        budgets = {**DEFAULT_BUDGETS, **(self.sampling_planner.budgets if self.sampling_planner is not None else {})}
+        sampling = {
+            "i3d": dict(num_frames=16, sizes=[i3d_size]),
+            "ocr": dict(fps=1, max_frames=budgets["ocr"].max_frames),
+            "objects": dict(fps=1, max_frames=budgets["objects"].max_frames),
+            "segments": dict(fps=SEGMENT_FPS, sizes=[i3d_size], full=False),
+            "quality": dict(
+                timestamps=self.quality_detector.sample_timestamps(source.duration),
+                sizes=[self.quality_detector.analysis_size(source.width, source.height)]
+            ),
+            "thumbnail": dict(num_frames=self.thumbnail_candidates)
+        }
+        return {key: source.subscribe(key, collect=True, **sampling[key]) for key in keys}
+        
+    def _check_version(self, key: str) -> str:
+        """Model version plus configuration of a check, as used in cache keys"""
+        config = {
+            "ocr": self.ocr_processor.config,
+            "objects": self.object_detector.model_name,
+            "copyright": [
+                self.copyright_detector.threshold,
+                self.copyright_detector.similarity_checker.segment_index is not None,
+                self.copyright_detector.audio_index is not None
+            ],
+            "content": self.content_checker.rules
+        }.get(key)
+        if self.sampling_planner is not None and set(self.CHECK_INPUTS[key]) & set(self.sampling_planner.budgets):
+            config = [config, self.sampling_planner.config()]
+        return f"{self.CHECK_VERSIONS[key]}:{json.dumps(config, sort_keys=True, default=str)}"
+        
+    def _required_checks(self, rules: RuleSet) -> List[str]:
+        """Checks to compute for a video judged by rules"""
+        return self._with_dependencies(rules.checks() | set(self.report_checks))
+        
+    def _with_dependencies(self, checks) -> List[str]:
+        """The given checks plus the checks whose results they read"""
+        required = set(checks)
+        for key in list(required):
+            required.update(self.CHECK_DEPENDENCIES.get(key, ()))
+        return [key for key in self.CHECK_VERSIONS if key in required]
+        
+    def _verdict_version(self, rules: RuleSet) -> str:
+        """Version of the checks and of the decision rules; verdicts are only reused within one version"""
+        versions = {key: self._check_version(key) for key in self._required_checks(rules)}
+        versions["decision"] = rules.version()
+        return hashlib.blake2b(json.dumps(versions, sort_keys=True).encode(), digest_size=16).hexdigest()
+        
+    def _admit(self, video_path: str, rules: RuleSet) -> Tuple[Dict, Optional[CheckOutcome]]:
+        """
+        Pre-admission: judge the header-only business checks before any heavy check starts.
+        
+        Returns:
+            (results already computed, for the full run to reuse; outcome
+            rejecting the video if they already fix its level, else None)
+        """
+        checks = self._required_checks(rules)
+        if "content" not in checks:
+            return {}, None
+        results = {"content": self._result_of(
+            self.scheduler.submit("content", self.content_checker.run_content_checks, video_path)
+        )}
+        level = rules.early_level(results)
+        if level is None:
+            return results, None
+        skipped = [key for key in checks if key != "content"]
+        return results, CheckOutcome(results, None, FeatureContext(video_path), level, skipped)
+        
+    def _find_duplicate(self, video_path: str,
+                        rules: RuleSet) -> Tuple[Optional[ModerationResult], Optional[VideoSignature]]:
+        """
+        Look the video up in the perceptual-hash index before any deep model runs.
+        
+        Returns:
+            (result reusing an earlier verdict, or None; the video's signature,
+            or None if there is no index or the video could not be hashed)
+        """
+        if self.duplicate_index is None:
+            return None, None
+        try:
+            signature = self.duplicate_index.signature(video_path)
+        except Exception:
+            return None, None  # the full pipeline reports undecodable videos
+        if signature is None:
+            return None, None
+        match = self.duplicate_index.lookup(signature, self._verdict_version(rules))
+        if match is None:
+            return None, signature
             
-            results = {}
-            for key, future in futures.items():
+        verdict = match.verdict
+        metadata = {
+            "path": video_path,
+            "timestamp": str(datetime.now()),
+            "version": "1.0",
+            "duplicate_of": match.video_id,
+            "duplicate_match": {"matched_frames": match.matched_frames, "distance": match.distance}
+        }
+        trace = current_trace()
+        if trace is not None:
+            metadata["trace"] = trace.to_dict()
+            MetricsRegistry.default().observe("moderation_video_seconds", metadata["trace"]["elapsed"])
+        MetricsRegistry.default().inc("moderation_videos_total", status=verdict["status"])
+        result = ModerationResult(
+            status=verdict["status"],
+            level=verdict["level"],
+            thumbnail_path=verdict["thumbnail_path"],
+            details=verdict["details"],
+            metadata=metadata
+        )
+        return result, signature
+        
+    def _remember_verdict(self, video_path: str, signature: Optional[VideoSignature], result: ModerationResult,
+                          rules: RuleSet):
+        """Store the verdict of a fully moderated video for later re-uploads"""
+        if signature is None:
+            return
+        # A verdict reached with a failed check is not trusted for reuse
+        if any(isinstance(value, dict) and "error" in value for value in result.details.values()):
+            return
+        verdict = result.to_dict()
+        del verdict["metadata"]
+        self.duplicate_index.add(video_path, signature, verdict, self._verdict_version(rules))
+        
+    def _cached(self, digest: Optional[str], key: str):
+        if self.result_cache is None or digest is None:
+            return _MISSING
+        with span("result_cache.get", "io"):
+            return self.result_cache.get(ResultCache.make_key(digest, key, self._check_version(key)), _MISSING)
+        
+    def _store(self, digest: Optional[str], key: str, value):
+        """Cache a successful check result"""
+        if self.result_cache is None or digest is None:
+            return
+        if isinstance(value, dict) and "error" in value:
+            return
+        with span("result_cache.put", "io"):
+            self.result_cache.put(ResultCache.make_key(digest, key, self._check_version(key)), value)
+        
+    def _submit_checks(self, video_path: str, checks: Sequence[str], defer_models: bool = False,
+                       deferred: Sequence[str] = (), known: Optional[Dict] = None,
+                       checkpoint: Optional[Checkpoint] = None) -> CheckRun:
+        """
+        Schedule the given checks of a video on the shared worker pools.
+        
+        Checks with a result in known (e.g. from admission) or cached for
+        this content and version resolve immediately. The video is decoded once on a decode worker, producing
+        only the inputs (see CHECK_INPUTS) of the checks left to compute, or
+        not at all if there are none; each frame-based check is queued on
+        its own stage as soon as its frames are collected. With
+        defer_models the model-backed checks resolve to their frames instead,
+        for batched inference across videos. Checks named in deferred are
+        not scheduled until CheckRun.submit_deferred is called. Each
+        computed result is also saved to checkpoint, if given.
+        """
+        digest = None
+        if self.result_cache is not None:
+            with span("content_hash", "io"):
                 try:
-                    results[key] = future.result()
-                except Exception as e:
-                    results[key] = {"error": str(e)}
+                    digest = content_hash(video_path)
+                except OSError:
+                    pass  # reported below by the checks reading the video
+        known = known or {}
+        cached = {key: self._cached(digest, key) for key in checks if key not in known}
+        cached = {key: value for key, value in cached.items() if value is not _MISSING}
+        cached.update(known)
+        
+        computed = [key for key in checks if key not in cached]
+        try:
+            source = FrameSource(video_path, buffer_size=self.frame_buffer_size)
+        except Exception as e:
+            # A missing or undecodable video fails every check reading its
+            # frames or audio, as error entries the rules fail closed on
+            futures = {key: _completed(value) for key, value in cached.items()}
+            futures.update({key: _failed(e) for key in computed if self.CHECK_INPUTS[key]})
+            if "content" in computed:
+                futures["content"] = self._submit_cached(digest, "content", partial(
+                    self.scheduler.submit, "content", self.content_checker.run_content_checks, video_path
+                ), checkpoint)
+            return CheckRun(None, futures, None, None, {}, FeatureContext(video_path), digest)
+        frame_keys = [key for key in self.CHECK_FRAMES if key in computed]
+        streams = {name for key in computed for name in self.CHECK_INPUTS[key] if name != "audio"}
+        if self.copyright_detector.similarity_checker.segment_index is None:
+            streams.discard("segments")
+        subs = self._subscribe_checks(source, sorted(streams) + ["thumbnail"] if streams else [])
+        context = FeatureContext(video_path, {name: subs[name].frames for name in ("i3d", "segments") if name in subs})
+        runners = {
+            "nsfw": partial(self.nsfw_detector.classify_video, video_path, context=context),
+            "ocr": self.ocr_processor.process_frames,
+            "objects": self.object_detector.process_frames,
+            "quality": partial(self.quality_detector.assess_quality, video_path, duration=source.duration)
+        }
+        
+        submitters = {
+            key: partial(self.scheduler.submit_after, key, subs[self.CHECK_FRAMES[key]].frames, runner)
+            for key, runner in runners.items() if key in frame_keys
+        }
+        if "quality" in frame_keys:
+            # Quality waits for its frames and the audio; the audio decode is
+            # shared with VGGish when copyright runs too
+            audio = partial(self._quality_audio, video_path, context, "copyright" in computed)
+            submitters["quality"] = lambda: self.scheduler.submit_after(
+                "quality", gather(subs["quality"].frames, self.scheduler.submit("audio", audio)),
+                starcall, runners["quality"]
+            )
+        if "copyright" in computed:
+            # Copyright waits for the objects check and filters its detections for logos
+            submitters["copyright"] = lambda: self.scheduler.submit_after(
+                "copyright", futures["objects"], lambda detections: self.copyright_detector.detect_copyright(
+                    video_path, context=context, detections=detections
+                )
+            )
+        if "content" in checks:
+            submitters["content"] = partial(
+                self.scheduler.submit, "content", self.content_checker.run_content_checks, video_path
+            )
+        for key in list(submitters):
+            if key in cached:
+                del submitters[key]
+            elif defer_models and key in self.MODEL_CHECKS:
+                # Copyright is marked pending with its I3D clip; its logos come from the batched objects
+                submitters[key] = partial(lambda frames: frames, subs[self.CHECK_FRAMES.get(key, "i3d")].frames)
+            else:
+                submitters[key] = partial(self._submit_cached, digest, key, submitters[key], checkpoint)
+                
+        futures = {key: _completed(value) for key, value in cached.items()}
+        held = {}
+        for key in sorted(submitters, key=lambda name: self.CHECK_COSTS.get(name, 0)):
+            if key in deferred:
+                held[key] = submitters[key]
+            else:
+                futures[key] = submitters[key]()
+                
+        if not subs:
+            source.close()
+            return CheckRun(None, futures, None, None, held, context, digest)
+        # The thumbnail is chosen speculatively, in parallel with the checks,
+        # from every full frame decoded for them; it is discarded unless approved
+        thumbnail = self.scheduler.submit_after(
+            "thumbnail", gather(*(sub.frames for sub in subs.values() if sub.full)), starcall,
+            self.thumbnail_generator.select_thumbnail, num_candidates=self.thumbnail_candidates
+        )
+        decode = self.scheduler.submit("decode", self._plan_and_decode, video_path, source, subs)
+        return CheckRun(source, futures, thumbnail, decode, held, context, digest)
+        
+    def _plan_and_decode(self, video_path: str, source: FrameSource, subs: Dict[str, FrameSubscription]):
+        """Plan the frames of the adaptively sampled streams, then run the shared decode"""
+        plan = {}
+        if self.sampling_planner is not None:
+            try:
+                plan = self.sampling_planner.plan(video_path, list(subs))
+            except Exception:
+                pass  # subscribers keep their fixed sampling; run() must still resolve them
+        for key, timestamps in plan.items():
+            source.resample(subs[key], timestamps)
+        source.run()
+        
+    def _quality_audio(self, video_path: str, context: FeatureContext, shared: bool, seconds: int = 20):
+        """Audio sample for the quality check, cut from the shared decode if there is one"""
+        if not probe_video(video_path).has_audio:
+            return np.zeros(0, dtype=np.float32)
+        if shared:
+            # Only the sample window is kept, in case quality runs in a worker process
+            return context.get("pcm", partial(read_pcm, video_path))[:seconds * SAMPLE_RATE]
+        return read_pcm(video_path, duration=seconds)
+        
+    def _submit_cached(self, digest: Optional[str], key: str, submit: Callable[[], concurrent.futures.Future],
+                       checkpoint: Optional[Checkpoint] = None) -> concurrent.futures.Future:
+        """Submit a check and cache (and checkpoint) its result once it succeeds"""
+        def _on_done(done: concurrent.futures.Future):
+            if done.cancelled() or done.exception() is not None:
+                return
+            value = done.result()
+            self._store(digest, key, value)
+            if checkpoint is not None and not (isinstance(value, dict) and "error" in value):
+                with span("checkpoint.save", "io"):
+                    checkpoint.save(key, self._check_version(key), value)
+                
+        future = submit()
+        future.add_done_callback(_on_done)
+        return future
+        
+    @staticmethod
+    def _result_of(future: concurrent.futures.Future):
+        """
+        Result of a finished check, flattening failures into an error entry.
+        
+        The timing of the failed stage is in the trace (metadata["trace"]).
+        """
+        try:
+            return future.result()
+        except Exception as e:
+            return {"error": str(e), "error_type": type(e).__name__}
+        
+    def _gather(self, run: CheckRun) -> CheckOutcome:
+        """Wait for every scheduled check (the speculative thumbnail is left running)"""
+        results = {key: self._result_of(future) for key, future in run.futures.items()}
+        return CheckOutcome(results, None, run.context, thumbnail=run.thumbnail, digest=run.digest)
+        
+    def _run_parallel_checks(self, video_path: str, rules: RuleSet, known: Dict,
+                             checkpoint: Optional[Checkpoint] = None) -> CheckOutcome:
+        """Run the required checks in parallel on a single shared decode of the video"""
+        return self._gather(self._submit_checks(
+            video_path, self._required_checks(rules), known=known, checkpoint=checkpoint
+        ))
+        
+    def _run_short_circuit(self, video_path: str, rules: RuleSet, known: Dict,
+                           checkpoint: Optional[Checkpoint] = None) -> CheckOutcome:
+        """
+        Run decisive checks first and stop as soon as the decision is fixed.
+        
+        The decisive checks (those read by rules of the highest level) are
+        scheduled cheapest first while the rest are
+        held back. If their results already fix the level, every other check
+        is cancelled (or abandoned if already running) and decoding stops;
+        otherwise the remaining checks are scheduled, still cheapest first,
+        and the level is re-evaluated as each one completes.
+        """
+        checks = self._required_checks(rules)
+        decisive = self._with_dependencies(rules.decisive_checks())
+        run = self._submit_checks(
+            video_path, checks, deferred=[key for key in checks if key not in decisive], known=known,
+            checkpoint=checkpoint
+        )
+        results = {}
+        while True:
+            waiting = {key: future for key, future in run.futures.items() if key not in results}
+            if not waiting:
+                if not run.deferred:
+                    break
+                run.submit_deferred()
+                continue
+                
+            done, _ = concurrent.futures.wait(waiting.values(), return_when=concurrent.futures.FIRST_COMPLETED)
+            for key, future in waiting.items():
+                if future in done:
+                    results[key] = self._result_of(future)
                     
-            return results
-            
-    def _determine_moderation_level(self, results: Dict) -> str:
-        """Determine overall moderation level"""
-        if results['nsfw'][0] == 1 and results['nsfw'][1] > 0.9:
-            return "HIGH"
-            
-        if len(results['copyright']['detected_logos']) > 0:
-            return "HIGH"
-            
-        if results['quality']['video_score'] < 0.3:
-            return "MEDIUM"
-            
-        if any(obj['class_id'] in [1, 2, 3] for obj in results['objects']['objects']):  # Example restricted classes
-            return "MEDIUM"
-            
-        return "LOW"
+            level = rules.early_level(results)
+            if level is not None:
+                return CheckOutcome(results, None, run.context, level, run.cancel(), digest=run.digest)
+                
+        return self._gather(run)
+        
+    def _determine_moderation_level(self, results: Dict, rules: RuleSet) -> Tuple[str, List[str]]:
+        """Determine overall moderation level and the rules that raised it"""
+        return rules.evaluate(results)
         
     def _make_decision(self, results: Dict, level: str) -> str:
         """Make final moderation decision"""
@@ -70,13 +615,14 @@ class Moderator:
             return "FLAGGED"
         return "APPROVED"
         
-    def process_video(self, video_path: str) -> ModerationResult:
-        """Run complete moderation pipeline"""
-        # Run all checks in parallel
-        check_results = self._run_parallel_checks(video_path)
+    def _finalize(self, video_path: str, outcome: CheckOutcome, rules: RuleSet,
+                  video_id: Optional[str] = None) -> ModerationResult:
+        """Turn check results into the final moderation result"""
+        check_results = outcome.results
         
-        # Determine moderation level
-        level = self._determine_moderation_level(check_results)
+        # Determine moderation level, unless already fixed early
+        level, fired = self._determine_moderation_level(check_results, rules)
+        level = outcome.level or level
         
         # Make final decision
         status = self._make_decision(check_results, level)
@@ -84,19 +630,326 @@ class Moderator:
         # Generate thumbnail if approved
         thumbnail_path = None
         if status == "APPROVED":
-            thumbnail_result = self.thumbnail_generator.generate_thumbnail(video_path)
-            thumbnail_path = thumbnail_result.thumbnail_path
+            image = None
+            if outcome.thumbnail is not None:
+                try:
+                    image = outcome.thumbnail.result()
+                except Exception:
+                    pass  # chosen again from a fresh decode below
+            thumbnail_path = self.thumbnail_generator.generate_thumbnail(
+                video_path, frames=outcome.thumbnail_frames, image=image
+            )
+            # Approved videos join the catalog later uploads are compared against,
+            # under a stable ID: the caller's, else the content hash (as in the
+            # feature store), never the possibly temporary upload path
+            if self.index_approved and os.path.exists(video_path):
+                catalog_id = video_id or outcome.digest or content_hash(video_path)
+                self.copyright_detector.similarity_checker.index_video(
+                    catalog_id, video_path, context=outcome.context
+                )
+        elif outcome.thumbnail is not None:
+            outcome.thumbnail.cancel()  # no thumbnail for a rejected or flagged video
             
-        result = ModerationResult(
+        trace = current_trace()
+        metadata = {
+            "path": video_path,
+            "timestamp": str(datetime.now()),
+            "version": "1.0",
+            "skipped_checks": sorted(set(outcome.skipped) | (set(self.CHECK_VERSIONS) - set(check_results))),
+            "rules_fired": fired,
+            "failed_checks": rules.failed_checks(check_results),
+            "feature_timings": outcome.context.timings()
+        }
+        if trace is not None:
+            metadata["trace"] = trace.to_dict()
+            MetricsRegistry.default().observe("moderation_video_seconds", metadata["trace"]["elapsed"])
+        MetricsRegistry.default().inc("moderation_videos_total", status=status)
+        return ModerationResult(
             status=status,
             level=level,
             thumbnail_path=thumbnail_path,
             details=check_results,
-            metadata={
-                "path": video_path,
-                "timestamp": str(datetime.now()),
-                "version": "1.0"
-            }
+            metadata=metadata
         )
         
-        return result
+    def process_video(self, video_path: str, rules: Optional[RuleSet] = None,
+                      checkpoint: Optional[Checkpoint] = None, video_id: Optional[str] = None) -> ModerationResult:
+        """
+        Run complete moderation pipeline, recording its trace in the result metadata.
+        
+        Args:
+            video_path: Path to video file
+            rules: Decision policy for this video (default: the moderator's);
+                only the checks its rules read are computed
+            checkpoint: Per-job store of finished check results: results saved
+                there at the current check versions are reused, and every
+                check computed is saved as soon as it finishes, so a retried
+                job does not redo them
+            video_id: Catalog ID the video is indexed under if approved and
+                index_approved is set (default: its content hash)
+        """
+        rules = rules or self.rules
+        with self._profiling(), tracing(Trace()):
+            known, rejected = self._admit(video_path, rules)
+            if rejected is not None:
+                return self._finalize(video_path, rejected, rules)
+            if checkpoint is not None:
+                with span("checkpoint.load", "io"):
+                    resumed = checkpoint.load({key: self._check_version(key) for key in self.CHECK_VERSIONS})
+                known = dict(resumed, **known)
+                
+            duplicate, signature = self._find_duplicate(video_path, rules)
+            if duplicate is not None:
+                return duplicate
+                
+            if self.short_circuit:
+                result = self._finalize(
+                    video_path, self._run_short_circuit(video_path, rules, known, checkpoint), rules, video_id
+                )
+            else:
+                # Run the required checks in parallel
+                result = self._finalize(
+                    video_path, self._run_parallel_checks(video_path, rules, known, checkpoint), rules, video_id
+                )
+            self._remember_verdict(video_path, signature, result, rules)
+            return result
+        
+    def process_stream(self, source: Union[str, BinaryIO], name: Optional[str] = None,
+                       window_seconds: float = 2.0, decode_fps: float = 4.0, idle_timeout: float = 10.0,
+                       stop_on_reject: bool = True,
+                       rules: Optional[RuleSet] = None) -> Iterator[Union[ProvisionalDecision, ModerationResult]]:
+        """
+        Moderate a video while it is still being uploaded or streamed.
+        
+        Frames are decoded as the data arrives and checked one time window
+        at a time: NSFW on the window's clip, and objects, logos and OCR on
+        one frame per second (each only if the rules need it). After every
+        window a ProvisionalDecision is yielded; a rule of the highest level
+        firing (by default NSFW or a copyrighted logo) makes it REJECTED
+        right away, and with stop_on_reject decoding stops there.
+        Once the stream ends, for files, quality (on frames at source
+        resolution, as in process_video), similarity search and content
+        checks run on the complete video, and the final ModerationResult is
+        yielded last; a pipe skips them.
+        
+        Args:
+            source: Path of a (possibly growing) file, or a readable binary pipe
+            name: Name used for outputs such as the thumbnail (default: the path, or "stream")
+            window_seconds: Duration of each analysis window
+            decode_fps: Frames decoded per second of video
+            idle_timeout: Seconds without new data after which a growing file is complete
+            stop_on_reject: Stop at the first provisional rejection
+            rules: Decision policy for this video (default: the moderator's)
+        """
+        with self._profiling():
+            yield from self._process_stream(source, name, window_seconds, decode_fps, idle_timeout, stop_on_reject,
+                                            rules or self.rules)
+            
+    def _process_stream(self, source: Union[str, BinaryIO], name: Optional[str], window_seconds: float,
+                        decode_fps: float, idle_timeout: float, stop_on_reject: bool,
+                        rules: RuleSet) -> Iterator[Union[ProvisionalDecision, ModerationResult]]:
+        started = time.perf_counter()
+        checks = self._required_checks(rules)
+        # Logos come from the object detections
+        window_checks = {
+            "nsfw": lambda window, per_second: (self.nsfw_detector.classify_video, name, window),
+            "objects": lambda window, per_second: (self.object_detector.process_frames, per_second),
+            "ocr": lambda window, per_second: (self.ocr_processor.process_frames, per_second)
+        }
+        needed = set(checks) | ({"objects"} if "copyright" in checks else set())
+        window_checks = {key: task for key, task in window_checks.items() if key in needed}
+        path = source if isinstance(source, str) else None
+        name = name or path or "stream"
+        # Not entered around the loop: a context variable set here would leak
+        # into the caller between yields. Scheduler tasks pick it up at submit.
+        trace = Trace()
+        decoder = StreamDecoder(source, fps=decode_fps, idle_timeout=idle_timeout)
+        state = StreamState()
+        step = max(int(round(decode_fps)), 1)
+        level = None
+        try:
+            for window in windows(decoder, window_seconds):
+                per_second = [frame for frame in window if frame.index % step == 0]
+                with tracing(trace):
+                    futures = {
+                        key: self.scheduler.submit(key, *task(window, per_second))
+                        for key, task in window_checks.items()
+                    }
+                results = {key: self._result_of(future) for key, future in futures.items()}
+                if isinstance(results.get("objects"), dict) and "error" not in results["objects"]:
+                    results["logos"] = self.copyright_detector._filter_logos(results["objects"])
+                state.update(window, results, 1.0 / decode_fps)
+                
+                level = rules.early_level(state.results(checks))
+                yield ProvisionalDecision(
+                    status="REJECTED" if level == "HIGH" else "PENDING",
+                    level=level,
+                    seconds=state.seconds,
+                    elapsed=time.perf_counter() - started,
+                    details=state.results(checks)
+                )
+                if level == "HIGH" and stop_on_reject:
+                    break
+        finally:
+            decoder.close()
+            
+        with tracing(trace):
+            result = self._finish_stream(path, name, state, level, stop_on_reject, checks, rules)
+        result.metadata["stream_seconds"] = state.seconds
+        result.metadata["time_to_decision"] = time.perf_counter() - started
+        yield result
+        
+    def _finish_stream(self, path: Optional[str], name: str, state: StreamState, level: Optional[str],
+                       stop_on_reject: bool, checks: Sequence[str], rules: RuleSet) -> ModerationResult:
+        """Whole-video checks (those in checks) and final result of a stream"""
+        results = state.results(checks)
+        # Checks left out of results are reported as skipped by _finalize
+        skipped = []
+        if level == "HIGH" and stop_on_reject:
+            skipped = ["similarity"] if "copyright" in checks else []
+        elif path is not None:
+            if "quality" in checks:
+                # Scored like the batch path, on frames at source resolution:
+                # the stream itself is decoded downscaled for the window checks
+                results["quality"] = self._result_of(
+                    self.scheduler.submit("quality", self.quality_detector.assess_quality, path)
+                )
+            if "copyright" in checks and "error" not in results["copyright"]:
+                results["copyright"]["similar_videos"] = self.copyright_detector.check_video_similarity(path)
+            if "content" in checks:
+                results["content"] = self._result_of(
+                    self.scheduler.submit("content", self.content_checker.run_content_checks, path)
+                )
+        else:
+            # A pipe cannot be read again for similarity or source-resolution quality
+            skipped = (["similarity"] if "copyright" in checks else []) + (["quality"] if "quality" in checks else [])
+                
+        thumbnails = select_evenly(state.samples, min(len(state.samples), self.thumbnail_candidates)) or None
+        return self._finalize(name, CheckOutcome(results, thumbnails, FeatureContext(name), level, skipped), rules)
+        
+    def process_batch(self, video_paths: List[str], rules: Optional[RuleSet] = None) -> List[ModerationResult]:
+        """
+        Moderate many videos, running each model once over stacked inputs.
+        
+        All videos are put in flight on the shared worker pools at once (the
+        decode stage cap bounds how many decode concurrently), then I3D,
+        VGGish, the NSFW head and YOLO each see one batched call for the
+        whole set of videos. Callers draining a large backlog should pass
+        paths in chunks, as decoded frames are held until inference. Batches
+        always run every required check, regardless of short_circuit.
+        
+        Args:
+            video_paths: Paths to video files
+            rules: Decision policy for these videos (default: the moderator's)
+            
+        Returns:
+            Moderation results in input order
+        """
+        with self._profiling():
+            return self._process_batch(video_paths, rules or self.rules)
+            
+    def _process_batch(self, video_paths: List[str], rules: RuleSet) -> List[ModerationResult]:
+        # Each video has its own trace; the batched model passes are recorded
+        # once and added to the trace of every video in the batch
+        traces = [Trace() for _ in video_paths]
+        results: List[Optional[ModerationResult]] = []
+        signatures = []
+        known = []
+        for path, trace in zip(video_paths, traces):
+            with tracing(trace):
+                admitted, rejected = self._admit(path, rules)
+                if rejected is not None:
+                    duplicate, signature = self._finalize(path, rejected, rules), None
+                else:
+                    duplicate, signature = self._find_duplicate(path, rules)
+            results.append(duplicate)
+            signatures.append(signature)
+            known.append(admitted)
+            
+        # Only admitted videos without a reusable verdict go through the models
+        pending = [i for i, result in enumerate(results) if result is None]
+        checks = self._required_checks(rules)
+        submitted = []
+        for i in pending:
+            with tracing(traces[i]):
+                submitted.append(self._submit_checks(video_paths[i], checks, defer_models=True, known=known[i]))
+        outcomes = [self._gather(run) for run in submitted]
+        batch_trace = Trace()
+        with tracing(batch_trace):
+            self._run_batched_models([video_paths[i] for i in pending], submitted, outcomes)
+            
+        for i, outcome in zip(pending, outcomes):
+            traces[i].extend(batch_trace)
+            with tracing(traces[i]):
+                results[i] = self._finalize(video_paths[i], outcome, rules)
+                self._remember_verdict(video_paths[i], signatures[i], results[i], rules)
+        return results
+        
+    def _run_batched_models(self, video_paths: List[str], submitted: List[CheckRun],
+                            outcomes: List[CheckOutcome]):
+        """Run the deferred model checks of a batch with one stacked call per model"""
+        staged = [outcome.results for outcome in outcomes]
+        contexts = [outcome.context for outcome in outcomes]
+        
+        # I3D runs once over every clip still needed by NSFW or copyright;
+        # both then read the shared embedding from the video's context
+        i3d_ids = [
+            i for i, results in enumerate(staged)
+            if any(isinstance(results.get(key), list) for key in ("nsfw", "copyright"))
+        ]
+        if i3d_ids:
+            try:
+                self.scheduler.submit(
+                    "nsfw", batch_embeddings, [contexts[i] for i in i3d_ids], "i3d",
+                    lambda ids: self.nsfw_detector.extract_i3d_features_batch(
+                        [contexts[i3d_ids[j]].frames("i3d") for j in ids]
+                    )
+                ).result()
+            except Exception:
+                pass  # each consumer below computes (or reports) it on its own
+                
+        batched = {
+            "nsfw": lambda ids: self.nsfw_detector.classify_features(np.stack([
+                self.nsfw_detector.extract_i3d_features(video_paths[i], staged[i]["nsfw"], contexts[i])
+                for i in ids
+            ])),
+            "copyright": lambda ids: self.copyright_detector.detect_copyright_batch(
+                [video_paths[i] for i in ids], [staged[i]["copyright"] for i in ids],
+                [contexts[i] for i in ids], detections=[staged[i]["objects"] for i in ids]
+            )
+        }
+        # Only videos whose frames were collected (no decode error) take part
+        pending = {
+            key: [i for i, results in enumerate(staged) if isinstance(results.get(key), list)]
+            for key in ("nsfw", "objects", "copyright")
+        }
+        
+        def _collect(key: str, future: concurrent.futures.Future):
+            try:
+                outputs = future.result()
+            except Exception as e:
+                outputs = [{"error": str(e)}] * len(pending[key])
+            for i, output in zip(pending[key], outputs):
+                staged[i][key] = output
+                self._store(submitted[i].digest, key, output)
+                
+        futures = {}
+        if pending["nsfw"]:
+            futures["nsfw"] = self.scheduler.submit("nsfw", batched["nsfw"], pending["nsfw"])
+        if pending["objects"]:
+            # A bound method rather than a closure, so the stage can run in a worker process
+            futures["objects"] = self.scheduler.submit(
+                "objects", self.object_detector.process_frames_batch, [staged[i]["objects"] for i in pending["objects"]]
+            )
+        # Copyright reads the object detections, so it is batched once they are in
+        if "objects" in futures:
+            _collect("objects", futures.pop("objects"))
+        for i in pending["copyright"]:
+            objects = staged[i].get("objects")
+            if isinstance(objects, dict) and "error" in objects:
+                staged[i]["copyright"] = {"error": f"objects check failed: {objects['error']}"}
+        pending["copyright"] = [i for i in pending["copyright"] if isinstance(staged[i]["copyright"], list)]
+        if pending["copyright"]:
+            futures["copyright"] = self.scheduler.submit("copyright", batched["copyright"], pending["copyright"])
+        for key, future in futures.items():
+            _collect(key, future)
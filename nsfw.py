@@ -1,7 +1,10 @@
 import tensorflow as tf
-import tensorflow_hub as hub
 import numpy as np
-from typing import Tuple
+from typing import List, Optional, Tuple
+from frame_source import Frame, FrameSource, select_evenly
+from feature_context import FeatureContext
+from model_registry import ModelRegistry
+from metrics import span
 
 class NSFWDetector:
     """
@@ -9,39 +12,117 @@ class NSFWDetector:
     Uses I3D features for video classification (0=SFW, 1=NSFW).
     """
     
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, batch_size: int = 8,
+                 registry: Optional[ModelRegistry] = None):
         """
-        Initialize NSFW detector with pre-trained model.
+        Initialize NSFW detector; models are loaded on first use.
         
         Args:
             model_path: Path to pre-trained model (default uses TensorFlow Hub)
+            batch_size: Number of clips per I3D forward pass
+            registry: Model registry to share models through (default: process-wide)
         """
-        self.model = self._load_model(model_path)
+        self.registry = registry or ModelRegistry.default()
+        self.model_name = f"nsfw:{model_path or 'default'}"
+        self.registry.register(self.model_name, lambda: self._load_model(model_path))
+        self.num_frames = 16
+        self.batch_size = batch_size
+        
+    @property
+    def model(self):
+        return self.registry.get(self.model_name)
+        
+    @property
+    def i3d_model(self):
+        return self.registry.get("i3d")
         
     def _load_model(self, model_path: str):
         """Load pre-trained NSFW classification model"""
         pass
         
-    def extract_i3d_features(self, video_path: str) -> np.ndarray:
+    def _stack_clip(self, frames: List[Frame]) -> np.ndarray:
+        """Stack frames into a (num_frames, 224, 224, 3) I3D clip"""
+        return np.array([frame.at_size((224, 224)) for frame in select_evenly(list(frames), self.num_frames)])
+        
+    def extract_i3d_features(self, video_path: str, frames: Optional[List[Frame]] = None,
+                             context: Optional[FeatureContext] = None) -> np.ndarray:
         """
         Extract I3D features from video.
         
         Args:
             video_path: Path to video file
+            frames: Already decoded frames to reuse instead of decoding again
+            context: Per-video feature context sharing the embedding with other consumers
             
         Returns:
             Numpy array of I3D features
         """
-        pass
+        if context is not None:
+            return context.get("i3d", lambda: self._compute_i3d(video_path, context.frames("i3d") or frames))
+        return self._compute_i3d(video_path, frames)
+        
+    def _compute_i3d(self, video_path: str, frames: Optional[List[Frame]]) -> np.ndarray:
+        if frames is None:
+            frames = FrameSource.read(video_path, num_frames=self.num_frames, sizes=[(224, 224)])
+        return self.extract_i3d_features_batch([frames])[0]
+        
+    def extract_i3d_features_batch(self, clips: List[List[Frame]]) -> np.ndarray:
+        """
+        Extract I3D features for many videos with stacked forward passes.
         
-    def classify_video(self, video_path: str) -> Tuple[int, float]:
+        Args:
+            clips: Decoded frames of each video
+            
+        Returns:
+            Array of shape (num_videos, feature_dim)
+        """
+        stacked = np.stack([self._stack_clip(frames) for frames in clips])
+        outputs = []
+        for start in range(0, len(stacked), self.batch_size):
+            inputs = tf.convert_to_tensor(stacked[start:start + self.batch_size], dtype=tf.float32)
+            with span("i3d", "inference"):
+                outputs.append(self.i3d_model(inputs)['default'].numpy())
+        return np.concatenate(outputs).reshape(len(stacked), -1)
+        
+    def classify_video(self, video_path: str, frames: Optional[List[Frame]] = None,
+                       context: Optional[FeatureContext] = None) -> Tuple[int, float]:
         """
         Classify video as SFW (0) or NSFW (1) with confidence score.
         
         Args:
             video_path: Path to video file
+            frames: Already decoded frames to reuse instead of decoding again
+            context: Per-video feature context sharing the I3D embedding
             
         Returns:
             Tuple of (class, confidence_score)
         """
-        pass
+        features = self.extract_i3d_features(video_path, frames, context)
+        return self.classify_features(features[np.newaxis, ...])[0]
+        
+    def classify_batch(self, clips: List[List[Frame]]) -> List[Tuple[int, float]]:
+        """
+        Classify many videos at once.
+        
+        Args:
+            clips: Decoded frames of each video
+            
+        Returns:
+            List of (class, confidence_score), one per video
+        """
+        return self.classify_features(self.extract_i3d_features_batch(clips))
+        
+    def classify_features(self, features: np.ndarray) -> List[Tuple[int, float]]:
+        """
+        Classify videos from precomputed I3D features.
+        
+        Args:
+            features: Array of shape (num_videos, feature_dim)
+            
+        Returns:
+            List of (class, confidence_score), one per video
+        """
+        with span(self.model_name, "inference"):
+            probabilities = np.asarray(self.model(features)).reshape(len(features), -1)
+        labels = probabilities.argmax(axis=1)
+        return [(int(label), float(probs[label])) for label, probs in zip(labels, probabilities)]
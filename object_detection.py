@@ -1,32 +1,96 @@
 import cv2
 import numpy as np
-from typing import List, Dict
-from moviepy.editor import VideoFileClip
+from typing import List, Dict, Iterable, Optional
+from ultralytics import YOLO
+from frame_source import Frame, FrameSource
+from model_registry import ModelRegistry
+from metrics import span
+from yolo_onnx import YoloOnnxModel, export_onnx, quantize_int8
 
 class ObjectDetector:
     """
     Object and logo detection in video frames using YOLOv11.
-    Processes one frame per second to detect objects and logos.
+    Processes one frame per second (or the frames a SamplingPlanner chose)
+    to detect objects and logos.
+    
+    The "onnx" backend runs the exported model on ONNX Runtime's CPU
+    provider, optionally int8-quantized, with letterboxing and NMS done
+    in NumPy; the "ultralytics" backend runs the PyTorch model.
+    
+    A detector pickled to a worker process is rebuilt there on that
+    process's registry and loads its model on first use.
     """
     
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, batch_size: int = 16,
+                 registry: Optional[ModelRegistry] = None, backend: str = "onnx",
+                 precision: str = "fp32", input_size: int = 640):
         """
-        Initialize object detector with pre-trained model.
+        Initialize object detector; the model is loaded on first use.
         
         Args:
             model_path: Path to YOLOv11 model weights
+            batch_size: Number of frames per YOLO forward pass
+            registry: Model registry to share models through (default: process-wide)
+            backend: "onnx" (CPU inference) or "ultralytics"
+            precision: "fp32" or "int8" (onnx backend only)
+            input_size: Square letterboxed input size (onnx backend only)
         """
-        self.model = self._load_model(model_path)
+        self.registry = registry or ModelRegistry.default()
+        self.backend = backend
+        if backend == "onnx":
+            self.model_name = f"yolo:{model_path or 'yolo11n.pt'}:onnx:{precision}:{input_size}"
+            warmup = lambda model: model.detect([np.zeros((input_size, input_size, 3), dtype=np.uint8)])
+        else:
+            self.model_name = f"yolo:{model_path or 'yolo11n.pt'}"
+            warmup = lambda model: model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+        self.registry.register(
+            self.model_name,
+            lambda: self._load_model(model_path, precision, input_size),
+            warmup
+        )
+        self.batch_size = batch_size
         self.logo_classes = self._load_logo_classes()
+        self._options = dict(model_path=model_path, batch_size=batch_size, backend=backend,
+                             precision=precision, input_size=input_size)
+        
+    def __getstate__(self):
+        # The registry holds loaded models and locks; only the configuration travels
+        return self._options
+        
+    def __setstate__(self, options):
+        self.__init__(**options)
+        
+    @property
+    def model(self):
+        return self.registry.get(self.model_name)
         
-    def _load_model(self, model_path: str):
+    def _load_model(self, model_path: str, precision: str = "fp32", input_size: int = 640):
         """Load YOLOv11 model"""
-        pass
+        if self.backend != "onnx":
+            return YOLO(model_path or "yolo11n.pt")
+        onnx_path = export_onnx(model_path or "yolo11n.pt", input_size)
+        if precision == "int8":
+            onnx_path = quantize_int8(onnx_path)
+        return YoloOnnxModel(onnx_path, input_size)
         
     def _load_logo_classes(self) -> List[str]:
         """Load list of logo classes to detect"""
         pass
         
+    def _parse_result(self, result) -> List[Dict]:
+        boxes = result.boxes
+        return [
+            {
+                "class_id": int(class_id),
+                "class_name": result.names[int(class_id)],
+                "confidence": float(confidence),
+                "bbox": [float(v) for v in box]
+            }
+            for class_id, confidence, box in zip(
+                boxes.cls.tolist(), boxes.conf.tolist(), boxes.xyxy.tolist()
+            )
+        ]
+        
     def detect_objects(self, frame) -> List[Dict]:
         """
         Detect objects in single frame.
@@ -37,16 +101,94 @@ class ObjectDetector:
         Returns:
             List of detected objects with bounding boxes and confidence
         """
-        pass
+        return self.detect_objects_batch([frame])[0]
         
-    def process_video(self, video_path: str) -> Dict[int, List[Dict]]:
+    def detect_objects_batch(self, frames: List) -> List[List[Dict]]:
+        """
+        Detect objects in many frames with batched forward passes.
+        
+        Args:
+            frames: Image frames to process
+            
+        Returns:
+            Detected objects for each frame, in input order
+        """
+        if self.backend == "onnx":
+            # The ONNX model takes RGB; flipping channels is a free view
+            return self._detect_rgb([frame[..., ::-1] for frame in frames])
+        detections = []
+        for start in range(0, len(frames), self.batch_size):
+            with span(self.model_name, "inference"):
+                results = self.model(list(frames[start:start + self.batch_size]), verbose=False)
+            detections.extend(self._parse_result(result) for result in results)
+        return detections
+        
+    def _detect_rgb(self, images: List[np.ndarray]) -> List[List[Dict]]:
+        """Detect objects in RGB images with the ONNX backend, batch_size at a time"""
+        detections = []
+        for start in range(0, len(images), self.batch_size):
+            with span(self.model_name, "inference"):
+                detections.extend(self.model.detect(images[start:start + self.batch_size]))
+        return detections
+        
+    def process_frames(self, frames: Iterable[Frame]) -> Dict[int, List[Dict]]:
+        """
+        Detect objects in already decoded frames.
+        
+        Args:
+            frames: Frames sampled at one frame per second, or at planned timestamps
+            
+        Returns:
+            Dictionary of {second: detected_objects}
+        """
+        return self.process_frames_batch([list(frames)])[0]
+        
+    def process_frames_batch(self, frame_lists: List[List[Frame]]) -> List[Dict[int, List[Dict]]]:
+        """
+        Detect objects in the frames of many videos, batching across videos.
+        
+        Args:
+            frame_lists: Decoded frames of each video
+            
+        Returns:
+            Dictionary of {second: detected_objects} for each video
+        """
+        flat = [frame for frames in frame_lists for frame in frames]
+        if self.backend == "onnx":
+            detections = self._detect_rgb([frame.image for frame in flat])
+        else:
+            detections = self._detect_bgr_chunks(flat)
+        detections = iter(detections)
+        results = []
+        for frames in frame_lists:
+            # Adaptive sampling can pick several frames within one second
+            per_second: Dict[int, List[Dict]] = {}
+            for frame in frames:
+                per_second.setdefault(int(frame.timestamp), []).extend(next(detections))
+            results.append(per_second)
+        return results
+        
+    def _detect_bgr_chunks(self, flat: List[Frame]) -> List[List[Dict]]:
+        """Convert frames to BGR one batch at a time for the ultralytics backend"""
+        detections = []
+        for start in range(0, len(flat), self.batch_size):
+            chunk = flat[start:start + self.batch_size]
+            detections.extend(self.detect_objects_batch(
+                [cv2.cvtColor(frame.image, cv2.COLOR_RGB2BGR) for frame in chunk]
+            ))
+        return detections
+        
+    def process_video(self, video_path: str, timestamps: Optional[List[float]] = None) -> Dict[int, List[Dict]]:
         """
         Process video and return detected objects per second.
         
         Args:
             video_path: Path to video file
+            timestamps: Planned frame timestamps (default: one frame per second)
             
         Returns:
             Dictionary of {second: detected_objects}
         """
-        pass
+        if timestamps is not None:
+            return self.process_frames(FrameSource.read(video_path, timestamps=timestamps))
+        return self.process_frames(FrameSource.read(video_path, fps=1))
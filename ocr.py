@@ -1,35 +1,150 @@
+import re
+import threading
 import cv2
-import pytesseract
-from typing import List, Dict
-from moviepy.editor import VideoFileClip
+import numpy as np
+from tesserocr import PyTessBaseAPI, OEM, PSM
+from dataclasses import dataclass
+from typing import List, Dict, Iterable, Optional, Tuple
+from frame_source import Frame, FrameSource
+from metrics import span
+
+Box = Tuple[int, int, int, int]
+
+@dataclass
+class OCRResult:
+    text: Dict[int, str]  # {second: extracted_text}
+    frames_processed: int = 0
+    frames_skipped: int = 0  # frames whose text regions were all unchanged (or absent)
+    regions_recognized: int = 0
+    regions_reused: int = 0
 
 class OCRProcessor:
     """
     Handles OCR (Optical Character Recognition) on video frames.
     Processes one frame per second to extract text content.
+    
+    Only likely text regions are sent to the recognizer, and a region at
+    the position of one in the previous frame whose pixels are unchanged
+    reuses that region's text; a caption changing by one digit is
+    recognized again.
+    Each worker thread keeps its own long-lived Tesseract instance; a
+    processor pickled to a worker process creates its own there.
     """
     
-    def __init__(self, tesseract_config: str = None):
+    def __init__(self, tesseract_config: str = None, min_overlap: float = 0.7, pixel_delta: int = 48,
+                 max_changed: float = 0.02):
         """
         Initialize OCR processor with Tesseract config.
         
         Args:
-            tesseract_config: Custom Tesseract configuration
+            tesseract_config: Custom Tesseract configuration (--oem and --psm are honoured)
+            min_overlap: IoU with a region of the previous frame for a region to be the same one
+            pixel_delta: Gray-level difference at which a pixel of a region has changed
+            max_changed: Changed pixels a region may have and still reuse its text, as a
+                fraction of its height squared (a character's strokes cover about a tenth)
         """
         self.config = tesseract_config or '--oem 3 --psm 6'
+        self.min_overlap = min_overlap
+        self.pixel_delta = pixel_delta
+        self.max_changed = max_changed
+        self._local = threading.local()
+        
+    @property
+    def api(self) -> PyTessBaseAPI:
+        """Tesseract instance of the calling thread, created on first use"""
+        api = getattr(self._local, "api", None)
+        if api is None:
+            oem = re.search(r'--oem\s+(\d+)', self.config)
+            psm = re.search(r'--psm\s+(\d+)', self.config)
+            api = self._local.api = PyTessBaseAPI(
+                oem=int(oem.group(1)) if oem else OEM.DEFAULT,
+                psm=int(psm.group(1)) if psm else PSM.SINGLE_BLOCK
+            )
+        return api
         
-    def extract_frames(self, video_path: str, fps: int = 1) -> List:
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_local"]  # Tesseract instances never leave their thread
+        return state
+        
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        
+    def extract_frames(self, video_path: str, fps: int = 1, timestamps: Optional[List[float]] = None) -> List[Frame]:
         """
         Extract frames from video at specified FPS.
         
         Args:
             video_path: Path to video file
             fps: Frames per second to extract
+            timestamps: Planned frame timestamps, replacing the fixed rate
             
         Returns:
             List of extracted frames
         """
-        pass
+        if timestamps is not None:
+            return FrameSource.read(video_path, timestamps=timestamps)
+        return FrameSource.read(video_path, fps=fps)
+        
+    def find_text_regions(self, gray: np.ndarray) -> List[Box]:
+        """
+        Locate likely text lines with a morphological gradient.
+        
+        Args:
+            gray: Grayscale frame
+            
+        Returns:
+            List of (x, y, width, height) boxes
+        """
+        height, width = gray.shape
+        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+        _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        # Join characters into lines
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 60, 3), 1))
+        connected = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+        contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if h < 8 or w < 2 * h or h > height // 4:
+                continue
+            # Text lines are densely filled with edges
+            if cv2.countNonZero(binary[y:y + h, x:x + w]) < 0.25 * w * h:
+                continue
+            pad = h // 4
+            x0, y0 = max(x - pad, 0), max(y - pad, 0)
+            boxes.append((x0, y0, min(x + w + pad, width) - x0, min(y + h + pad, height) - y0))
+        return sorted(boxes, key=lambda box: (box[1], box[0]))
+        
+    @staticmethod
+    def box_iou(a: Box, b: Box) -> float:
+        """Intersection over union of two (x, y, width, height) boxes"""
+        width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+        height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+        if width <= 0 or height <= 0:
+            return 0.0
+        overlap = width * height
+        return overlap / (a[2] * a[3] + b[2] * b[3] - overlap)
+        
+    def region_unchanged(self, gray: np.ndarray, previous: np.ndarray, box: Box) -> bool:
+        """True if the pixels of box differ between two frames by less than part of a character"""
+        x, y, w, h = box
+        changed = cv2.absdiff(gray[y:y + h, x:x + w], previous[y:y + h, x:x + w]) > self.pixel_delta
+        return int(np.count_nonzero(changed)) <= self.max_changed * h * h
+        
+    def _recognize(self, gray: np.ndarray, boxes: List[Box]) -> List[str]:
+        """Recognize text in each box of a frame with the thread's Tesseract instance"""
+        api = self.api
+        gray = np.ascontiguousarray(gray)
+        api.SetImageBytes(gray.tobytes(), gray.shape[1], gray.shape[0], 1, gray.shape[1])
+        texts = []
+        with span("tesseract", "inference"):
+            for x, y, w, h in boxes:
+                api.SetRectangle(x, y, w, h)
+                texts.append(api.GetUTF8Text().strip())
+        return texts
         
     def process_frame(self, frame) -> str:
         """
@@ -41,16 +156,65 @@ class OCRProcessor:
         Returns:
             Extracted text
         """
-        pass
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        texts = self._recognize(gray, self.find_text_regions(gray))
+        return "\n".join(text for text in texts if text)
+        
+    def process_frames(self, frames: Iterable[Frame]) -> OCRResult:
+        """
+        Run OCR on already decoded frames, recognizing only changed text regions.
+        
+        Args:
+            frames: Frames sampled at one frame per second, or at planned timestamps
+            
+        Returns:
+            OCRResult with {second: extracted_text} and skip counters
+        """
+        result = OCRResult(text={})
+        previous: Optional[Tuple[np.ndarray, List[Tuple[Box, str]]]] = None  # previous frame and its regions
+        for frame in frames:
+            result.frames_processed += 1
+            gray = cv2.cvtColor(frame.image, cv2.COLOR_RGB2GRAY)
+            boxes = self.find_text_regions(gray)
+            
+            texts = [self._lookup(previous, gray, box) for box in boxes]
+            changed = [i for i, text in enumerate(texts) if text is None]
+            if changed:
+                for i, text in zip(changed, self._recognize(gray, [boxes[i] for i in changed])):
+                    texts[i] = text
+                result.regions_recognized += len(changed)
+            else:
+                result.frames_skipped += 1
+            result.regions_reused += len(boxes) - len(changed)
+            
+            previous = (gray, list(zip(boxes, texts)))
+            text = "\n".join(text for text in texts if text)
+            second = int(frame.timestamp)
+            if text and text not in result.text.get(second, ""):
+                # Adaptive sampling can pick several frames within one second
+                result.text[second] = f"{result.text[second]}\n{text}" if second in result.text else text
+        return result
+        
+    def _lookup(self, previous: Optional[Tuple[np.ndarray, List[Tuple[Box, str]]]], gray: np.ndarray,
+                box: Box) -> Optional[str]:
+        """Text of the previous frame's region at the position of box if its pixels are unchanged, else None"""
+        if previous is None or previous[0].shape != gray.shape:
+            return None
+        previous_gray, regions = previous
+        for known, text in regions:
+            if self.box_iou(known, box) >= self.min_overlap and self.region_unchanged(gray, previous_gray, box):
+                return text
+        return None
         
-    def process_video(self, video_path: str) -> Dict[int, str]:
+    def process_video(self, video_path: str, timestamps: Optional[List[float]] = None) -> OCRResult:
         """
         Process video and return text per second.
         
         Args:
             video_path: Path to video file
+            timestamps: Planned frame timestamps (default: one frame per second)
             
         Returns:
-            Dictionary of {second: extracted_text}
+            OCRResult with {second: extracted_text} and skip counters
         """
-        pass
+        return self.process_frames(self.extract_frames(video_path, timestamps=timestamps))
@@ -1,19 +1,22 @@
 import numpy as np
-from pydub import AudioSegment
-from moviepy.editor import VideoFileClip
-from typing import Tuple, Dict, Optional
+from typing import Tuple, Dict, List, Optional, Sequence
 import os
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import datetime
 import cv2
-import subprocess
-import tempfile
+from frame_source import Frame, read_keyframes
+from media_probe import probe_video
+from result_cache import content_hash
+from audio_source import SAMPLE_RATE, read_pcm
+from metrics import span
 
 @dataclass
 class QualityResult:
-    video_score: float
+    video_score: float  # mean sharpness, Laplacian variance / 1000 at source resolution, clipped to [0, 1]
     audio_score: float
     metadata: dict
+    video_stats: Dict[str, Dict[str, float]] = field(default_factory=dict)
 
 class QualityDetector:
     """Video and audio quality assessment"""
@@ -22,68 +25,174 @@ class QualityDetector:
         os.makedirs(feature_storage_path, exist_ok=True)
         self.feature_storage_path = feature_storage_path
         
-    def _extract_sample(self, video_path: str, duration: int = 20):
-        """Extract sample clip for analysis"""
-        with tempfile.NamedTemporaryFile(suffix='.mp4') as temp:
-            cmd = [
-                'ffmpeg', '-y',
-                '-i', video_path,
-                '-ss', '0',
-                '-t', str(duration),
-                '-c:v', 'copy',
-                '-c:a', 'copy',
-                temp.name
-            ]
-            subprocess.run(cmd, check=True)
-            return temp.name
-            
-    def check_video_quality(self, video_path: str) -> float:
-        """Calculate video quality score (simplified)"""
-        clip = VideoFileClip(video_path)
-        if clip.duration < 3:
-            return 0.0
+    # Number of frames sampled across the video and the width they are analysed at
+    NUM_SAMPLES = 8
+    ANALYSIS_WIDTH = 320
+    
+    def analysis_size(self, width: int, height: int) -> Tuple[int, int]:
+        """
+        Reduced (width, height) frames are analysed at.
+        
+        Frames are shrunk by an integer factor of at most 4, so the 8x8
+        coding blocks stay on a regular grid of at least 2 pixels.
+        """
+        factor = min(max(1, width // self.ANALYSIS_WIDTH), 4)
+        return (max(width // factor, 1), max(height // factor, 1))
+        
+    def block_size(self, width: int, analysed_width: int) -> float:
+        """Coding block size in pixels at the analysis resolution"""
+        return 8 * analysed_width / max(width, 1)
+        
+    def sample_timestamps(self, duration: float) -> List[float]:
+        """
+        Instants quality is measured at, for every entry point.
+        
+        The middle of NUM_SAMPLES equal spans, away from intros, outros and
+        the often incomplete last frames.
+        """
+        return [float(t) for t in (np.arange(self.NUM_SAMPLES) + 0.5) * duration / self.NUM_SAMPLES]
+        
+    def check_video_quality(self, video_path: str) -> Tuple[float, Dict[str, Dict[str, float]]]:
+        """Score the frames at sample_timestamps, seeking straight to each"""
+        info = probe_video(video_path)
+        if info.duration < 3:
+            return 0.0, {}
+        size = self.analysis_size(info.width, info.height)
+        # Exact seeks decode the same frames the shared decode gives score_frames
+        gray = read_keyframes(video_path, self.sample_timestamps(info.duration), (info.width, info.height), exact=True)
+        with span("quality.score", "cpu"):
+            reduced = np.stack([cv2.resize(image, size, interpolation=cv2.INTER_AREA) for image in gray])
+            return self._score_stack(gray, reduced, self.block_size(info.width, size[0]))
+        
+    def score_frames(self, frames: List[Frame], duration: float) -> Tuple[float, Dict[str, Dict[str, float]]]:
+        """Score already decoded frames"""
+        if duration < 3 or not frames:
+            return 0.0, {}
+        height, width = frames[0].image.shape[:2]
+        size = self.analysis_size(width, height)
+        with span("quality.score", "cpu"):
+            gray = [cv2.cvtColor(frame.image, cv2.COLOR_RGB2GRAY) for frame in frames]
+            reduced = np.stack([cv2.cvtColor(frame.at_size(size), cv2.COLOR_RGB2GRAY) for frame in frames])
+            return self._score_stack(gray, reduced, self.block_size(width, size[0]))
+        
+    def _score_stack(self, gray: Sequence[np.ndarray], reduced: np.ndarray,
+                     block: float) -> Tuple[float, Dict[str, Dict[str, float]]]:
+        """
+        Per-frame sharpness, exposure and blockiness of sampled frames.
+        
+        Sharpness is measured on the frames at source resolution, so the
+        video score keeps its meaning (and the low_quality threshold its
+        calibration) whatever the analysis size; exposure and blockiness are
+        computed in one pass over the (N, H, W) reduced stack and only
+        reported.
+        
+        Args:
+            gray: Grayscale frames at source resolution
+            reduced: The same frames at the analysis size
+            block: Coding block size in pixels at the analysis size
             
-        # Calculate simple quality metric (would use NIMA in production)
-        frame = clip.get_frame(clip.duration / 2)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        score = cv2.Laplacian(gray, cv2.CV_64F).var() / 1000
-        return float(np.clip(score, 0, 1))
+        Returns:
+            Mean sharpness in [0, 1] (the video score), and mean/min/percentiles
+            of every metric over the frames
+        """
+        # Sharpness: variance of the Laplacian (would use NIMA in production)
+        sharpness = np.clip(
+            np.array([cv2.Laplacian(image, cv2.CV_64F).var() for image in gray]) / 1000, 0, 1
+        )
+        
+        frames = reduced.astype(np.float32)
         
-    def check_audio_quality(self, audio_path: str) -> Tuple[bool, float]:
-        """Check basic audio quality metrics"""
-        sound = AudioSegment.from_file(audio_path)
+        # Exposure: distance of mean luma from mid-grey, penalised by clipped pixels
+        clipped = ((frames < 16) | (frames > 235)).mean(axis=(1, 2))
+        exposure = (1 - np.abs(frames.mean(axis=(1, 2)) / 255 - 0.5) * 2) * (1 - clipped)
         
-        # Simple quality metrics
-        max_amplitude = sound.max
-        silence_ratio = sound.dBFS / -60  # Normalized
+        # Blockiness: gradient across coding block boundaries relative to inside blocks
+        blockiness = np.zeros(len(frames), dtype=np.float32)
+        if block >= 2:
+            dx = np.abs(np.diff(frames, axis=2)).mean(axis=1)
+            dy = np.abs(np.diff(frames, axis=1)).mean(axis=2)
+            for diffs in (dx, dy):
+                boundary = np.zeros(diffs.shape[1], dtype=bool)
+                boundary[np.round(np.arange(block, diffs.shape[1], block)).astype(int) - 1] = True
+                if boundary.any() and (~boundary).any():
+                    ratio = diffs[:, boundary].mean(axis=1) / (diffs[:, ~boundary].mean(axis=1) + 1e-6)
+                    blockiness += np.maximum(ratio - 1, 0) / 2
+                    
+        metrics = {"sharpness": sharpness, "exposure": exposure, "blockiness": blockiness}
+        stats = {
+            name: {
+                "mean": float(values.mean()),
+                "min": float(values.min()),
+                "p10": float(np.percentile(values, 10)),
+                "p50": float(np.percentile(values, 50)),
+                "p90": float(np.percentile(values, 90))
+            }
+            for name, values in metrics.items()
+        }
+        return float(sharpness.mean()), stats
+        
+    def check_audio_quality(self, samples: np.ndarray) -> Tuple[bool, float]:
+        """Check basic audio quality metrics on float PCM samples in [-1, 1]"""
+        if len(samples) == 0:
+            return (False, 0.0)
+            
+        # Simple quality metrics: peak amplitude and loudness relative to full scale
+        max_amplitude = float(np.max(np.abs(samples)))
+        rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+        silence_ratio = 20 * np.log10(max(rms, 1e-10)) / -60  # Normalized dBFS
         
         # Combined score
-        score = 0.7 * (max_amplitude / 32768) + 0.3 * (1 - silence_ratio)
+        score = 0.7 * max_amplitude + 0.3 * (1 - silence_ratio)
         return (score > 0.5, float(score))
         
     def save_features(self, video_path: str, result: QualityResult):
-        """Save quality assessment results"""
-        video_id = os.path.basename(video_path).split('.')[0]
+        """Save quality assessment results, keyed by content hash"""
+        video_id = content_hash(video_path)
         save_path = os.path.join(self.feature_storage_path, f"{video_id}.json")
         
         with open(save_path, 'w') as f:
             json.dump({
                 "video_score": result.video_score,
                 "audio_score": result.audio_score,
-                "metadata": result.metadata
+                "metadata": result.metadata,
+                "video_stats": result.video_stats
             }, f)
             
-    def assess_quality(self, video_path: str) -> QualityResult:
-        """Run full quality assessment"""
-        sample_path = self._extract_sample(video_path)
-        
-        video_score = self.check_video_quality(sample_path)
+    def load_features(self, video_path: str) -> Optional[QualityResult]:
+        """Load previously saved quality assessment for the same video content"""
+        path = os.path.join(self.feature_storage_path, f"{content_hash(video_path)}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return QualityResult(
+            video_score=data["video_score"],
+            audio_score=data["audio_score"],
+            metadata=data["metadata"],
+            video_stats=data.get("video_stats", {})
+        )
+            
+    def assess_quality(self, video_path: str, frames: Optional[List[Frame]] = None,
+                       audio: Optional[np.ndarray] = None, duration: Optional[float] = None,
+                       sample_duration: int = 20) -> QualityResult:
+        """
+        Run full quality assessment, reusing already decoded frames and audio if given.
         
-        # Extract audio
-        with tempfile.NamedTemporaryFile(suffix='.wav') as audio_temp:
-            clip = VideoFileClip(sample_path)
-            clip.audio.write_audiofile(audio_temp.name)
-            _, audio_score = self.check_audio_quality(audio_temp.name)
+        Args:
+            video_path: Path to video file
+            frames: Already decoded frames to score
+            audio: Already decoded 16 kHz mono samples of the whole audio track
+            duration: Video duration in seconds (required with frames)
+            sample_duration: Seconds of audio from the start that are assessed
+        """
+        if frames is not None:
+            video_score, video_stats = self.score_frames(list(frames), duration or 0.0)
+        else:
+            video_score, video_stats = self.check_video_quality(video_path)
+            
+        if audio is None:
+            audio = read_pcm(video_path, duration=sample_duration)
+        _, audio_score = self.check_audio_quality(audio[:sample_duration * SAMPLE_RATE])
             
         result = QualityResult(
             video_score=video_score,
@@ -91,8 +200,9 @@ class QualityDetector:
             metadata={
                 "path": video_path,
                 "timestamp": str(datetime.now()),
-                "sample_duration": 20
-            }
+                "sample_duration": sample_duration
+            },
+            video_stats=video_stats
         )
         self.save_features(video_path, result)
         
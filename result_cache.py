@@ -0,0 +1,125 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any
+
+def content_hash(path: str, num_chunks: int = 16, chunk_size: int = 64 * 1024) -> str:
+    """
+    Fast content fingerprint of a file.
+
+    Hashes the file size plus num_chunks chunks sampled at evenly spaced
+    offsets (always including the first and last chunk). Files small enough
+    to be covered by the samples are hashed in full.
+
+    Args:
+        path: Path to file
+        num_chunks: Number of chunks to sample
+        chunk_size: Size of each chunk in bytes
+
+    Returns:
+        Hex digest identifying the file content
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=20)
+    with open(path, 'rb') as f:
+        if size <= num_chunks * chunk_size:
+            digest.update(f.read())
+        else:
+            step = (size - chunk_size) / (num_chunks - 1)
+            for i in range(num_chunks):
+                f.seek(int(i * step))
+                digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Size-bounded, on-disk LRU cache of detector outputs.
+
+    Entries are keyed by the video content hash, the check name and the
+    check's model/config version, so identical re-uploads hit the cache
+    while a new model or configuration only invalidates its own check.
+    """
+
+    def __init__(self, cache_dir: str = "result_cache", max_bytes: int = 1 << 30):
+        """
+        Initialize cache and index the entries already on disk.
+
+        Args:
+            cache_dir: Directory holding cache entries
+            max_bytes: Total size above which least recently used entries are evicted
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        files = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(".pkl"):
+                stat = os.stat(os.path.join(cache_dir, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+    @staticmethod
+    def make_key(digest: str, check: str, version: str) -> str:
+        """Cache key for one check of one video content"""
+        return hashlib.blake2b(f"{digest}:{check}:{version}".encode(), digest_size=20).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value for key, marking it most recently used"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+            os.utime(self._path(key))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self._lock:
+                self._size -= self._entries.pop(key, 0)
+                self.misses += 1
+            return default
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        """Store value under key and evict least recently used entries over the size bound"""
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, self._path(key))
+        with self._lock:
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,232 @@
+import re
+import json
+import operator
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+class Unavailable(Exception):
+    """Raised when a signal's check did not run or failed"""
+
+def _result(name: str, results: Dict):
+    value = results.get(name)
+    if value is None or (isinstance(value, dict) and "error" in value):
+        raise Unavailable(name)
+    return value
+
+# Signal name -> (check producing it, extractor from that check's result)
+SIGNALS: Dict[str, Tuple[str, Callable]] = {
+    "nsfw.label": ("nsfw", lambda r: int(r[0])),
+    "nsfw.confidence": ("nsfw", lambda r: float(r[1])),
+    "copyright.logo_count": ("copyright", lambda r: len(r["detected_logos"])),
+    "copyright.max_similarity": ("copyright", lambda r: max((m["similarity"] for m in r["similar_videos"]), default=0.0)),
+    "copyright.max_clip_seconds": ("copyright", lambda r: max(
+        (m["query_end"] - m["query_start"] for m in r["similar_videos"] if "query_start" in m), default=0.0
+    )),
+    "copyright.audio_track_ids": ("copyright", lambda r: sorted({m["track_id"] for m in r["audio_matches"]})),
+    "copyright.max_audio_match_seconds": ("copyright", lambda r: max(
+        (m["query_end"] - m["query_start"] for m in r["audio_matches"]), default=0.0
+    )),
+    "objects.class_ids": ("objects", lambda r: sorted({d["class_id"] for ds in r.values() for d in ds})),
+    "objects.class_names": ("objects", lambda r: sorted({d["class_name"] for ds in r.values() for d in ds})),
+    "ocr.text": ("ocr", lambda r: "\n".join(r.text.values())),
+    "quality.video_score": ("quality", lambda r: r.video_score),
+    "quality.audio_score": ("quality", lambda r: r.audio_score),
+    "quality.exposure": ("quality", lambda r: r.video_stats["exposure"]["mean"]),
+    "quality.blockiness": ("quality", lambda r: r.video_stats["blockiness"]["mean"]),
+    "content.duration": ("content", lambda r: r["duration"]),
+    "content.width": ("content", lambda r: r["width"]),
+    "content.height": ("content", lambda r: r["height"]),
+    "content.aspect_ratio": ("content", lambda r: r["aspect_ratio"]),
+    "content.rotation": ("content", lambda r: r["rotation"]),
+    "content.codec": ("content", lambda r: r["codec"]),
+    "content.fps": ("content", lambda r: r["fps"]),
+    "content.has_audio": ("content", lambda r: r["has_audio"])
+}
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda a, b: a in b,
+    "not_in": lambda a, b: a not in b,
+    "intersects": lambda a, b: bool(set(a) & set(b)),
+    "matches": lambda a, b: re.search(b, a, re.IGNORECASE) is not None
+}
+
+# Moderation levels, lowest first; LOW is the level when no rule fires
+LEVELS = ("LOW", "MEDIUM", "HIGH")
+
+# Lowest level of a video whose decision depends on a check that failed
+FAILED_CHECK_LEVEL = "MEDIUM"
+
+@dataclass
+class Condition:
+    """Comparison of one signal against a constant"""
+    signal: str
+    op: str
+    value: Any
+
+    def __post_init__(self):
+        if self.signal not in SIGNALS:
+            raise ValueError(f"Unknown signal {self.signal!r}")
+        if self.op not in OPERATORS:
+            raise ValueError(f"Unknown operator {self.op!r}")
+
+    @property
+    def check(self) -> str:
+        return SIGNALS[self.signal][0]
+
+    def holds(self, results: Dict) -> bool:
+        """Evaluate against check results; raises Unavailable if the check has no usable result"""
+        check, extract = SIGNALS[self.signal]
+        try:
+            value = extract(_result(check, results))
+        except (KeyError, IndexError, TypeError, AttributeError):
+            raise Unavailable(check)
+        return bool(OPERATORS[self.op](value, self.value))
+
+@dataclass
+class Rule:
+    """
+    Declarative rule: raises the moderation level when its conditions hold.
+
+    The checks a rule needs follow from the signals its conditions read.
+    """
+    name: str
+    level: str  # MEDIUM or HIGH
+    conditions: List[Condition]
+    match: str = "all"  # all or any of the conditions
+
+    def __post_init__(self):
+        if self.level not in LEVELS[1:]:
+            raise ValueError(f"Rule {self.name!r} has invalid level {self.level!r}")
+        if self.match not in ("all", "any"):
+            raise ValueError(f"Rule {self.name!r} has invalid match {self.match!r}")
+
+    @classmethod
+    def from_dict(cls, config: Dict) -> "Rule":
+        """
+        Build a rule from its configuration, e.g.
+        {"name": "nsfw", "level": "HIGH", "when": [{"signal": "nsfw.confidence", "op": ">", "value": 0.9}]}
+        """
+        return cls(
+            name=config["name"],
+            level=config["level"],
+            conditions=[Condition(**condition) for condition in config["when"]],
+            match=config.get("match", "all")
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "level": self.level,
+            "match": self.match,
+            "when": [{"signal": c.signal, "op": c.op, "value": c.value} for c in self.conditions]
+        }
+
+    def checks(self) -> Set[str]:
+        return {condition.check for condition in self.conditions}
+
+    def fires(self, results: Dict) -> Optional[bool]:
+        """
+        Whether the rule fires on the results available so far.
+
+        Returns:
+            True or False once decided, None while a needed result is missing
+        """
+        undecided = False
+        for condition in self.conditions:
+            try:
+                holds = condition.holds(results)
+            except Unavailable:
+                undecided = True
+                continue
+            if holds and self.match == "any":
+                return True
+            if not holds and self.match == "all":
+                return False
+        return None if undecided else self.match == "all"
+
+class RuleSet:
+    """
+    Decision policy: the level of a video is the highest level of the rules that fire.
+
+    Only checks some rule reads need to run; HIGH rules can fix the decision
+    as soon as their own checks complete.
+    """
+
+    def __init__(self, rules: Sequence[Rule]):
+        self.rules = list(rules)
+
+    @classmethod
+    def from_config(cls, config: Sequence[Dict]) -> "RuleSet":
+        return cls([Rule.from_dict(rule) for rule in config])
+
+    def to_config(self) -> List[Dict]:
+        return [rule.to_dict() for rule in self.rules]
+
+    def __add__(self, other: "RuleSet") -> "RuleSet":
+        return RuleSet(self.rules + other.rules)
+
+    def version(self) -> str:
+        """Canonical form of the rules, for cache and verdict keys"""
+        return json.dumps(self.to_config(), sort_keys=True, default=str)
+
+    def checks(self) -> Set[str]:
+        """Checks whose results some rule reads"""
+        return {check for rule in self.rules for check in rule.checks()}
+
+    def decisive_checks(self) -> Set[str]:
+        """Checks read by the rules that can fix the decision on their own"""
+        return {check for rule in self.rules if rule.level == LEVELS[-1] for check in rule.checks()}
+
+    def early_level(self, results: Dict) -> Optional[str]:
+        """The highest level, if a rule of that level already fires on the results so far"""
+        if any(rule.fires(results) for rule in self.rules if rule.level == LEVELS[-1]):
+            return LEVELS[-1]
+        return None
+
+    def failed_checks(self, results: Dict) -> List[str]:
+        """Checks some rule reads whose result is an error entry"""
+        return sorted(
+            check for check in self.checks()
+            if isinstance(results.get(check), dict) and "error" in results[check]
+        )
+
+    def evaluate(self, results: Dict) -> Tuple[str, List[str]]:
+        """
+        Level of a video and the rules that fired.
+
+        Fails closed: a check some rule reads that failed (its result is an
+        {"error": ...} entry) raises the level to at least FAILED_CHECK_LEVEL
+        and is listed as "check_failed:<check>", so a broken detector sends
+        videos to review instead of approving them. Rules reading a failed
+        or skipped check do not fire themselves.
+        """
+        fired = [rule for rule in self.rules if rule.fires(results)]
+        levels = [rule.level for rule in fired]
+        failed = self.failed_checks(results)
+        if failed:
+            levels.append(FAILED_CHECK_LEVEL)
+        level = max(levels, key=LEVELS.index, default=LEVELS[0])
+        return level, [rule.name for rule in fired] + [f"check_failed:{check}" for check in failed]
+
+# The decision policy, as rules over the check outputs
+DEFAULT_DECISION_RULES = [
+    {"name": "nsfw", "level": "HIGH", "when": [
+        {"signal": "nsfw.label", "op": "==", "value": 1},
+        {"signal": "nsfw.confidence", "op": ">", "value": 0.9}
+    ]},
+    {"name": "copyrighted_logo", "level": "HIGH", "when": [
+        {"signal": "copyright.logo_count", "op": ">", "value": 0}
+    ]},
+    {"name": "low_quality", "level": "MEDIUM", "when": [
+        {"signal": "quality.video_score", "op": "<", "value": 0.3}
+    ]},
+    {"name": "restricted_objects", "level": "MEDIUM", "when": [
+        {"signal": "objects.class_ids", "op": "intersects", "value": [1, 2, 3]}  # Example restricted classes
+    ]}
+]
@@ -0,0 +1,137 @@
+import subprocess
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from metrics import span
+
+# Motion analysis decodes the video once at this rate and size, in grayscale
+ANALYSIS_FPS = 4
+ANALYSIS_SIZE = (64, 36)
+
+@dataclass
+class Budget:
+    """How many frames a check may get, and how they may be spaced"""
+    min_frames: int
+    max_frames: int
+    change_per_frame: float  # accumulated visual change (mean absolute gray difference) per frame
+    min_gap: float = 0.0  # seconds; closer frames are merged
+    max_gap: Optional[float] = None  # seconds; longer static stretches still get a frame
+
+# Frame streams the planner places; the rest keep their fixed sampling
+DEFAULT_BUDGETS = {
+    "i3d": Budget(16, 16, 0.0),
+    "objects": Budget(4, 120, 24.0, min_gap=0.25, max_gap=5.0),
+    "ocr": Budget(4, 120, 16.0, min_gap=0.5, max_gap=4.0)
+}
+
+@dataclass
+class MotionProfile:
+    """Visual change between consecutive low-resolution analysis frames"""
+    timestamps: np.ndarray  # seconds
+    change: np.ndarray  # mean absolute gray difference from the previous frame (0 for the first)
+
+    @property
+    def duration(self) -> float:
+        return float(self.timestamps[-1]) + 1.0 / ANALYSIS_FPS if len(self.timestamps) else 0.0
+
+def analyze_motion(video_path: str, fps: float = ANALYSIS_FPS, size=ANALYSIS_SIZE) -> MotionProfile:
+    """
+    Measure scene and motion change over a video.
+
+    One ffmpeg process decodes the video with the loop filter skipped and
+    writes fps tiny grayscale frames per second to a pipe; consecutive
+    frames are compared in NumPy.
+
+    Args:
+        video_path: Path to video file
+        fps: Analysis frames per second
+        size: (width, height) of the analysis frames
+
+    Returns:
+        Change profile; empty if nothing could be decoded
+    """
+    width, height = size
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-skip_loop_filter', 'all', '-flags2', 'fast',
+           '-i', video_path, '-an', '-vf', f"fps={fps},scale={width}:{height}:flags=area",
+           '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1']
+    with span("sampling.analyze", "decode"):
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    frames = np.frombuffer(process.stdout, dtype=np.uint8)
+    frames = frames[:len(frames) - len(frames) % (width * height)].reshape(-1, height, width).astype(np.float32)
+    change = np.zeros(len(frames), dtype=np.float32)
+    if len(frames) > 1:
+        change[1:] = np.abs(frames[1:] - frames[:-1]).mean(axis=(1, 2))
+    return MotionProfile(np.arange(len(frames)) / fps, change)
+
+class SamplingPlanner:
+    """
+    Chooses the frame timestamps of each frame-based check from the video's visual change.
+
+    The number of frames a check gets grows with the total change in the
+    video (within its budget), not with its duration, and frames are
+    placed at equal steps of accumulated change: a static talking head
+    gets a few frames max_gap apart, while a fast-cut montage gets one
+    right after each cut.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, Budget]] = None):
+        """
+        Initialize planner.
+
+        Args:
+            budgets: Budget per frame stream (default: DEFAULT_BUDGETS)
+        """
+        self.budgets = dict(budgets or DEFAULT_BUDGETS)
+
+    def config(self) -> Dict:
+        """Budgets, for cache keys"""
+        return {name: asdict(budget) for name, budget in sorted(self.budgets.items())}
+
+    def plan(self, video_path: str, streams: Sequence[str]) -> Dict[str, List[float]]:
+        """
+        Analyse the video and plan the given streams.
+
+        Returns:
+            Timestamps per planned stream (streams without a budget are left out)
+        """
+        streams = [name for name in streams if name in self.budgets]
+        if not streams:
+            return {}
+        profile = analyze_motion(video_path)
+        if not len(profile.timestamps):
+            return {}
+        return {name: self.place(profile, self.budgets[name]) for name in streams}
+
+    def place(self, profile: MotionProfile, budget: Budget) -> List[float]:
+        """Timestamps for one budget at equal steps of accumulated change"""
+        # A small floor keeps static stretches from collapsing to nothing
+        weights = profile.change + 0.05 * max(float(profile.change.mean()), 1e-3)
+        cumulative = np.cumsum(weights)
+        total = float(cumulative[-1])
+        if budget.change_per_frame > 0:
+            count = int(round(float(profile.change.sum()) / budget.change_per_frame))
+        else:
+            count = budget.max_frames
+        count = min(max(count, budget.min_frames), budget.max_frames)
+        targets = (np.arange(count) + 0.5) * total / count
+        positions = np.minimum(np.searchsorted(cumulative, targets), len(cumulative) - 1)
+        timestamps = sorted({float(profile.timestamps[i]) for i in positions})
+
+        if budget.max_gap:
+            filled = []
+            for previous, current in zip([0.0] + timestamps, timestamps + [profile.duration]):
+                filled.extend(np.arange(previous + budget.max_gap, current, budget.max_gap).tolist())
+            # Filling must not exceed the budget: on long static videos the
+            # filler frames are thinned evenly (their gap widened) to fit
+            allowance = budget.max_frames - len(timestamps)
+            if len(filled) > allowance:
+                keep = np.linspace(0, len(filled) - 1, allowance).round().astype(int) if allowance > 0 else []
+                filled = [filled[i] for i in keep]
+            timestamps = sorted(timestamps + filled)
+        if budget.min_gap:
+            spaced = []
+            for timestamp in timestamps:
+                if not spaced or timestamp - spaced[-1] >= budget.min_gap:
+                    spaced.append(timestamp)
+            timestamps = spaced
+        return timestamps
@@ -0,0 +1,205 @@
+import os
+import time
+import threading
+import contextvars
+import multiprocessing
+from collections import defaultdict, deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+from metrics import MetricsRegistry, Trace, current_trace
+
+@dataclass
+class StageConfig:
+    """Where a stage runs and how many of its tasks may run at once"""
+    pool: str = "thread"  # thread (I/O, subprocess, GIL-releasing native code) or process (GIL-bound Python/NumPy)
+    max_concurrency: Optional[int] = None  # None means limited only by the pool size
+
+class StageScheduler:
+    """
+    Long-lived worker pools shared by every video in flight.
+
+    Tasks are submitted under a stage name. Each stage is routed to the thread
+    or process pool given by its StageConfig and is capped to max_concurrency
+    running tasks; tasks over the cap wait in a per-stage queue without
+    occupying a worker, so one saturated stage cannot starve the others.
+
+    Thread tasks run in a copy of the context they were submitted from, so
+    the submitter's trace follows them; queue wait and run time of every
+    task are recorded per stage in that trace and in the metrics registry.
+    Process tasks are pickled to a spawned worker: the function must be a
+    module-level function or a bound method of a picklable object, and
+    spans recorded inside the worker stay there.
+    """
+
+    def __init__(self, stages: Dict[str, StageConfig], thread_workers: Optional[int] = None,
+                 process_workers: Optional[int] = None):
+        """
+        Initialize scheduler.
+
+        Args:
+            stages: Configuration for each stage name (unknown stages use threads, uncapped)
+            thread_workers: Size of the shared thread pool
+            process_workers: Size of the shared process pool (created on first use)
+        """
+        cpus = os.cpu_count() or 1
+        self.stages = dict(stages)
+        self.thread_workers = thread_workers or min(32, cpus + 4)
+        self.process_workers = process_workers or cpus
+        self._threads = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="stage")
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.RLock()
+        self._pending: Dict[str, deque] = defaultdict(deque)
+        self._running: Dict[str, int] = defaultdict(int)
+        self._completed: Dict[str, int] = defaultdict(int)
+        self._busy: Dict[str, float] = defaultdict(float)
+
+    def _pool(self, config: StageConfig):
+        if config.pool != "process":
+            return self._threads
+        if self._processes is None:
+            # Spawn rather than fork: the parent runs model threads that must not be forked
+            self._processes = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._processes
+
+    def submit(self, stage: str, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Queue fn(*args, **kwargs) under stage.
+
+        Returns:
+            Future resolved with the task result; cancelling it before the
+            task starts removes it from the stage queue
+        """
+        future = Future()
+        task = (future, fn, args, kwargs, contextvars.copy_context(), time.perf_counter())
+        with self._lock:
+            self._pending[stage].append(task)
+            self._dispatch(stage)
+        return future
+
+    def submit_after(self, stage: str, dependency: Future, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Queue fn(dependency_result, *args, **kwargs) under stage once dependency resolves.
+
+        Returns:
+            Future resolved with the task result, or with the dependency's error
+        """
+        future = Future()
+        context = contextvars.copy_context()
+
+        def _chain(done: Future):
+            if future.cancelled():
+                return
+            try:
+                value = done.result()
+            except BaseException as e:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+                return
+            inner = context.run(self.submit, stage, fn, value, *args, **kwargs)
+            inner.add_done_callback(lambda task: _forward(task, future))
+            future.add_done_callback(lambda outer: outer.cancelled() and inner.cancel())
+
+        dependency.add_done_callback(_chain)
+        return future
+
+    def _dispatch(self, stage: str):
+        config = self.stages.get(stage, StageConfig())
+        pending = self._pending[stage]
+        while pending and (config.max_concurrency is None or self._running[stage] < config.max_concurrency):
+            future, fn, args, kwargs, context, queued = pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._running[stage] += 1
+            started = time.perf_counter()
+            trace = context.run(current_trace)
+            MetricsRegistry.default().observe("moderation_stage_queue_seconds", started - queued, stage=stage)
+            if trace is not None:
+                trace.add(stage, "queue", queued, started - queued)
+            if config.pool == "process":
+                task = self._pool(config).submit(fn, *args, **kwargs)
+            else:
+                task = self._pool(config).submit(context.run, fn, *args, **kwargs)
+            task.add_done_callback(
+                lambda done, future=future, started=started, trace=trace:
+                    self._complete(stage, future, done, started, trace)
+            )
+
+    def _complete(self, stage: str, future: Future, task: Future, started: float,
+                  trace: Optional[Trace] = None):
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self._running[stage] -= 1
+            self._completed[stage] += 1
+            self._busy[stage] += seconds
+            self._dispatch(stage)
+        error = None
+        if task.cancelled():
+            error = "CancelledError"
+        elif task.exception() is not None:
+            error = type(task.exception()).__name__
+        metrics = MetricsRegistry.default()
+        metrics.observe("moderation_stage_seconds", seconds, stage=stage)
+        if error is not None:
+            metrics.inc("moderation_stage_errors_total", stage=stage, error=error)
+        if trace is not None:
+            trace.add(stage, "stage", started, seconds, error)
+        _forward(task, future, running=True)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Running, queued and completed task counts and busy time per stage"""
+        with self._lock:
+            names = set(self._pending) | set(self._running)
+            return {
+                name: {
+                    "running": self._running[name],
+                    "queued": len(self._pending[name]),
+                    "completed": self._completed[name],
+                    "busy_seconds": self._busy[name]
+                }
+                for name in sorted(names)
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting work and release the pools"""
+        self._threads.shutdown(wait=wait)
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait)
+
+def _forward(task: Future, future: Future, running: bool = False):
+    """Copy the outcome of task onto future"""
+    if not running and not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(task.result())
+    except BaseException as e:
+        future.set_exception(e)
+
+def gather(*futures: Future) -> Future:
+    """Future resolved with the tuple of results of futures, or with the first error"""
+    combined = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _on_done(done: Future):
+        with lock:
+            if combined.done():
+                return
+            if done.cancelled() or done.exception() is not None:
+                if combined.set_running_or_notify_cancel():
+                    combined.set_exception(done.exception() if not done.cancelled() else CancelledError())
+                return
+            remaining[0] -= 1
+            if remaining[0] == 0 and combined.set_running_or_notify_cancel():
+                combined.set_result(tuple(future.result() for future in futures))
+
+    for future in futures:
+        future.add_done_callback(_on_done)
+    return combined
+
+def starcall(args: tuple, fn: Callable, **kwargs):
+    """fn(*args, **kwargs); lets submit_after pass gathered results as separate arguments"""
+    return fn(*args, **kwargs)
@@ -0,0 +1,124 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from faiss_index import FaissIndexManager
+
+# Low bits of a segment's FAISS ID hold its position in the video (up to
+# 2^20 segments, about 24 days of 2 s windows); the high bits the video's ID
+SEGMENT_BITS = 20
+SEGMENT_MASK = (1 << SEGMENT_BITS) - 1
+
+SegmentKey = Tuple[str, int]  # (video ID, segment number)
+
+class SegmentIndex(FaissIndexManager):
+    """
+    FAISS index of per-segment fingerprints, one vector per fixed-length window of a video.
+
+    Files, IVF-PQ compression, memory-mapping and the base/delta layout are
+    those of FaissIndexManager, but vectors are keyed by (video ID, segment
+    number). The ID map only holds videos: a segment's int64 ID packs the
+    video's ID with the segment number, so the map does not grow with
+    video length. At catalog scale a segment costs pq_m bytes of PQ code
+    (56 for the default 728-d segment vectors, see pq_subquantizers) plus
+    its 8-byte ID in the memory-mapped base index.
+    """
+
+    def _assign(self, keys: Sequence[SegmentKey]) -> np.ndarray:
+        keys = list(keys)
+        videos = sorted({video_id for video_id, _ in keys})
+        ids = dict(zip(videos, self.id_map.assign(videos).tolist()))
+        return np.array([(ids[video_id] << SEGMENT_BITS) | segment for video_id, segment in keys], dtype=np.int64)
+
+    def _ids(self, keys: Sequence[SegmentKey]) -> np.ndarray:
+        keys = list(keys)
+        ids = self.id_map.ids_for([video_id for video_id, _ in keys]).tolist()
+        return np.array([
+            (video << SEGMENT_BITS) | segment if video >= 0 else -1
+            for video, (_, segment) in zip(ids, keys)
+        ], dtype=np.int64)
+
+    def _keys(self, ids: Sequence[int]) -> Dict[int, SegmentKey]:
+        ids = [int(i) for i in ids if i >= 0]
+        videos = self.id_map.video_ids_for([i >> SEGMENT_BITS for i in ids])
+        return {i: (videos[i >> SEGMENT_BITS], i & SEGMENT_MASK) for i in ids if i >> SEGMENT_BITS in videos}
+
+@dataclass
+class ClipMatch:
+    """Part of an upload aligned with part of a catalog video"""
+    video_id: str
+    similarity: float  # mean similarity of the aligned segment pairs
+    matched_segments: int
+    query_start: float  # seconds into the upload
+    query_end: float
+    source_start: float  # seconds into the catalog video
+    source_end: float
+
+    @property
+    def offset(self) -> float:
+        """Seconds to add to an upload time to get the catalog video time"""
+        return self.source_start - self.query_start
+
+    def to_dict(self) -> Dict:
+        return {
+            "video_id": self.video_id,
+            "similarity": self.similarity,
+            "matched_segments": self.matched_segments,
+            "query_start": self.query_start,
+            "query_end": self.query_end,
+            "source_start": self.source_start,
+            "source_end": self.source_end,
+            "offset": self.offset
+        }
+
+def align(neighbours: Sequence[Sequence[Tuple[SegmentKey, float]]], segment_seconds: float,
+          threshold: float, min_segments: int = 3, max_skew: int = 1) -> List[ClipMatch]:
+    """
+    Temporal alignment of the neighbours of every segment of an upload.
+
+    A copied clip shows up as a run of upload segments i whose neighbours
+    in one catalog video sit at a constant offset j - i. Every pair above
+    threshold votes for its (video, offset); per video the offset with the
+    most votes, counting votes up to max_skew segments away (windows are
+    not aligned between videos, and re-timed copies drift), wins. Each
+    upload segment then keeps its best pair near that offset.
+
+    Args:
+        neighbours: (segment key, similarity) pairs for each upload segment, in time order
+        segment_seconds: Length of a segment
+        threshold: Minimum similarity of a segment pair
+        min_segments: Upload segments that must align for a match
+        max_skew: Offset tolerance in segments
+
+    Returns:
+        One match per catalog video, longest first
+    """
+    votes: Dict[str, Dict[int, List[Tuple[int, int, float]]]] = defaultdict(lambda: defaultdict(list))
+    for i, pairs in enumerate(neighbours):
+        for (video_id, j), score in pairs:
+            if score > threshold:
+                votes[video_id][j - i].append((i, j, score))
+
+    window = range(-max_skew, max_skew + 1)
+    matches = []
+    for video_id, offsets in votes.items():
+        best = max(offsets, key=lambda offset: (sum(len(offsets.get(offset + d, ())) for d in window), -abs(offset)))
+        aligned: Dict[int, Tuple[int, float]] = {}
+        for d in window:
+            for i, j, score in offsets.get(best + d, ()):
+                if i not in aligned or score > aligned[i][1]:
+                    aligned[i] = (j, score)
+        if len(aligned) < min_segments:
+            continue
+        query = sorted(aligned)
+        source = [aligned[i][0] for i in query]
+        matches.append(ClipMatch(
+            video_id=video_id,
+            similarity=float(np.mean([aligned[i][1] for i in query])),
+            matched_segments=len(query),
+            query_start=query[0] * segment_seconds,
+            query_end=(query[-1] + 1) * segment_seconds,
+            source_start=min(source) * segment_seconds,
+            source_end=(max(source) + 1) * segment_seconds
+        ))
+    return sorted(matches, key=lambda match: (-match.matched_segments, -match.similarity))
@@ -0,0 +1,158 @@
+import subprocess
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import cv2
+import numpy as np
+from frame_source import Frame
+from metrics import count
+from ocr import OCRResult
+
+@dataclass
+class ProvisionalDecision:
+    """Decision based on the part of the video received so far"""
+    status: str  # REJECTED once a decisive check fires, else PENDING
+    level: Optional[str]  # HIGH when already fixed, else None
+    seconds: float  # video time analysed so far
+    elapsed: float  # wall-clock seconds since the stream started
+    details: Dict = field(default_factory=dict)
+
+class StreamDecoder:
+    """
+    Decodes a video while it is still arriving, from a growing file or a pipe.
+
+    ffmpeg reads the input as it grows (following the file until no new
+    data arrives for idle_timeout seconds, or until the pipe closes) and
+    emits frames at a fixed rate as a YUV4MPEG stream, whose header
+    carries the frame size. Frames are yielded as soon as they are decoded.
+    The container must be streamable (fragmented MP4, WebM, MPEG-TS or an
+    MP4 with the moov atom first).
+    """
+
+    def __init__(self, source: Union[str, BinaryIO], fps: float = 4.0, width: int = 640,
+                 idle_timeout: float = 10.0):
+        """
+        Start decoding.
+
+        Args:
+            source: Path of a (possibly growing) file, or a readable binary pipe
+            fps: Frames per second to emit
+            width: Output width (height keeps the aspect ratio)
+            idle_timeout: Seconds without new data after which a growing file is considered complete
+        """
+        self.fps = fps
+        if isinstance(source, str):
+            cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-follow', '1',
+                   '-rw_timeout', str(int(idle_timeout * 1e6)), '-i', f"file:{source}"]
+            stdin = subprocess.DEVNULL
+        else:
+            cmd = ['ffmpeg', '-v', 'error', '-i', 'pipe:0']
+            stdin = source
+        cmd += ['-an', '-vf', f"fps={fps},scale={width}:-2", '-pix_fmt', 'yuv420p', '-f', 'yuv4mpegpipe', 'pipe:1']
+        self._process = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.width = 0
+        self.height = 0
+
+    def _read_header(self) -> bool:
+        header = self._process.stdout.readline()
+        if not header.startswith(b"YUV4MPEG2"):
+            return False
+        for token in header.split()[1:]:
+            if token.startswith(b"W"):
+                self.width = int(token[1:])
+            elif token.startswith(b"H"):
+                self.height = int(token[1:])
+        return True
+
+    def __iter__(self) -> Iterator[Frame]:
+        if not self._read_header():
+            return
+        frame_bytes = self.width * self.height * 3 // 2
+        index = 0
+        while True:
+            marker = self._process.stdout.readline()
+            if not marker.startswith(b"FRAME"):
+                return
+            data = self._process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                return
+            yuv = np.frombuffer(data, dtype=np.uint8).reshape(self.height * 3 // 2, self.width)
+            count("frames_decoded")
+            yield Frame(index=index, timestamp=index / self.fps, image=cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB_I420))
+            index += 1
+
+    def close(self):
+        """Stop decoding"""
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+
+def windows(frames: Iterable[Frame], seconds: float) -> Iterator[List[Frame]]:
+    """Group a frame stream into consecutive windows of the given duration"""
+    window: List[Frame] = []
+    end = seconds
+    for frame in frames:
+        if frame.timestamp >= end and window:
+            yield window
+            window = []
+            while frame.timestamp >= end:
+                end += seconds
+        window.append(frame)
+    if window:
+        yield window
+
+@dataclass
+class StreamState:
+    """Check results accumulated over the windows received so far"""
+    nsfw: Optional[Tuple[int, float]] = None
+    objects: Dict[int, List[Dict]] = field(default_factory=dict)
+    ocr: OCRResult = field(default_factory=lambda: OCRResult(text={}))
+    logos: List[Dict] = field(default_factory=list)
+    samples: List[Frame] = field(default_factory=list)  # one frame per window, for the thumbnail
+    seconds: float = 0.0
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    def update(self, window: List[Frame], results: Dict, frame_interval: float):
+        """Fold the check results of one window into the running state"""
+        self.seconds = window[-1].timestamp + frame_interval
+        for key, value in results.items():
+            if isinstance(value, dict) and "error" in value:
+                self.errors[key] = value["error"]
+
+        nsfw = results.get("nsfw")
+        if isinstance(nsfw, tuple):
+            # Keep the most NSFW window: any NSFW window wins, else the least confident SFW one
+            severity = lambda result: result[1] if result[0] == 1 else -result[1]
+            if self.nsfw is None or severity(nsfw) > severity(self.nsfw):
+                self.nsfw = nsfw
+
+        if isinstance(results.get("objects"), dict) and "error" not in results["objects"]:
+            self.objects.update(results["objects"])
+        if isinstance(results.get("logos"), list):
+            self.logos.extend(results["logos"])
+
+        ocr = results.get("ocr")
+        if isinstance(ocr, OCRResult):
+            self.ocr.text.update(ocr.text)
+            self.ocr.frames_processed += ocr.frames_processed
+            self.ocr.frames_skipped += ocr.frames_skipped
+            self.ocr.regions_recognized += ocr.regions_recognized
+            self.ocr.regions_reused += ocr.regions_reused
+
+        self.samples.append(window[len(window) // 2])
+
+    def results(self, checks: Optional[Sequence[str]] = None) -> Dict:
+        """Check results (of the given checks, default all) in the shape the batch pipeline produces"""
+        results = {
+            "nsfw": self.nsfw if self.nsfw is not None else {"error": "no frames"},
+            "objects": self.objects,
+            "ocr": self.ocr,
+            "copyright": {"similar_videos": [], "audio_matches": [], "detected_logos": self.logos}
+        }
+        # A check that failed on any window has no complete result; copyright
+        # takes its logos from the object detections
+        errors = dict(self.errors)
+        if "objects" in errors:
+            errors.setdefault("copyright", errors["objects"])
+        results.update({key: {"error": errors[key]} for key in results if key in errors})
+        return {key: value for key, value in results.items() if checks is None or key in checks}
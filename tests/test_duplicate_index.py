@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from duplicate_index import DuplicateIndex, VideoSignature, chunk_layout
+
+def _signature(rng, duration: float = 30.0) -> VideoSignature:
+    return VideoSignature(
+        duration=duration,
+        phashes=rng.integers(0, 2 ** 63, 5, dtype=np.uint64),
+        dhashes=rng.integers(0, 2 ** 63, 5, dtype=np.uint64)
+    )
+
+def _flip(hashes: np.ndarray, bits) -> np.ndarray:
+    mask = np.uint64(sum(1 << bit for bit in bits))
+    return hashes ^ mask
+
+def test_chunks_cover_every_bit():
+    for max_distance in (0, 3, 10, 63):
+        layout = chunk_layout(max_distance)
+        assert len(layout) == max_distance + 1
+        assert sum(bin(mask).count("1") for _, mask in layout) == 64
+    with pytest.raises(ValueError):
+        chunk_layout(64)
+
+@pytest.mark.parametrize("max_distance", [3, 10])
+def test_frames_at_max_distance_are_retrieved(tmp_path, max_distance):
+    rng = np.random.default_rng(max_distance)
+    index = DuplicateIndex(str(tmp_path / "duplicates.sqlite"), max_distance=max_distance)
+    original = _signature(rng)
+    index.add("original", original, {"status": "APPROVED"}, "v1")
+    for i in range(200):
+        index.add(f"other-{i}", _signature(rng), {"status": "APPROVED"}, "v1")
+
+    # One bit flipped in every chunk but the first
+    flipped = [shift for shift, _ in chunk_layout(max_distance)][1:]
+    reupload = VideoSignature(30.2, _flip(original.phashes, flipped), _flip(original.dhashes, flipped))
+    match = index.lookup(reupload, "v1")
+    assert match is not None and match.video_id == "original"
+    assert match.distance == max_distance
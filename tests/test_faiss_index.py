@@ -0,0 +1,34 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+from faiss_index import FaissIndexManager, pq_subquantizers
+
+# Whole-video vectors: 600 I3D logits and a 128-d VGGish embedding
+DIM = 728
+
+def test_default_pq_m_divides_dim():
+    assert pq_subquantizers(DIM) == 56
+    assert pq_subquantizers(1024) == 64
+
+def test_pq_m_not_dividing_dim_is_rejected():
+    with pytest.raises(ValueError):
+        pq_subquantizers(DIM, 64)
+
+def test_build_default_index_at_video_dimension(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((2000, DIM)).astype(np.float32)
+    video_ids = [f"video-{i}" for i in range(len(vectors))]
+    manager = FaissIndexManager(str(tmp_path / "videos.index"))
+    manager.build(vectors, video_ids)
+
+    assert manager.base.ntotal == len(vectors)
+    results = manager.search(vectors[:5], k=5, nprobe=256)
+    for video_id, matches in zip(video_ids, results):
+        assert video_id in [match for match, _ in matches]
+
+def test_build_rejects_pq_m_not_dividing_dim(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((300, DIM)).astype(np.float32)
+    manager = FaissIndexManager(str(tmp_path / "videos.index"))
+    with pytest.raises(ValueError):
+        manager.build(vectors, [str(i) for i in range(len(vectors))], nlist=4, pq_m=64)
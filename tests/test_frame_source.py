@@ -0,0 +1,28 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from frame_source import Frame, FrameSubscription
+
+def _feed(subscription: FrameSubscription, seconds: int, fps: int = 25):
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    for index in range(seconds * fps):
+        if subscription.wants(index, index / fps):
+            subscription._put(Frame(index, index / fps, image))
+    subscription._finish()
+    return subscription.frames.result()
+
+def test_collection_is_capped_at_max_frames():
+    subscription = FrameSubscription("ocr", 1.0, [], [], buffer_size=4, collect=True, max_frames=16)
+    frames = _feed(subscription, seconds=600)
+    assert 8 <= len(frames) <= 16
+    # Still spread over the whole video, at a steady spacing
+    assert frames[0].timestamp == 0.0
+    assert frames[-1].timestamp > 500
+    gaps = np.diff([frame.timestamp for frame in frames])
+    assert gaps.max() == gaps.min()
+
+def test_short_collection_is_untouched():
+    subscription = FrameSubscription("ocr", 1.0, [], [], buffer_size=4, collect=True, max_frames=16)
+    assert [frame.timestamp for frame in _feed(subscription, seconds=10)] == [float(t) for t in range(10)]
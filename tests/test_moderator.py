@@ -0,0 +1,23 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+for module in ("tensorflow", "ultralytics", "tesserocr", "faiss"):
+    pytest.importorskip(module)
+
+from moderator import Moderator
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / "clip.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 25, (64, 48))
+    for i in range(50):
+        writer.write(np.full((48, 64, 3), i * 5, dtype=np.uint8))
+    writer.release()
+    return path
+
+def test_content_check_runs_when_not_precomputed(video, monkeypatch):
+    with Moderator(cache_results=False, adaptive_sampling=False) as moderator:
+        monkeypatch.setattr(moderator.content_checker, "run_content_checks", lambda path: {"duration": 2.0})
+        run = moderator._submit_checks(video, ["content"])
+        assert run.futures["content"].result(timeout=30) == {"duration": 2.0}
@@ -0,0 +1,20 @@
+import pickle
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+pytest.importorskip("onnxruntime")
+
+from model_registry import ModelRegistry
+from object_detection import ObjectDetector
+
+def test_detector_pickles_as_its_configuration():
+    detector = ObjectDetector(registry=ModelRegistry(), precision="int8", input_size=320, batch_size=4)
+    restored = pickle.loads(pickle.dumps(detector))
+    assert restored.model_name == detector.model_name
+    assert restored.batch_size == 4
+    # Rebuilt on the registry of the process it lands in, model not loaded yet
+    assert restored.registry is ModelRegistry.default()
+    assert not restored.registry.is_loaded(restored.model_name)
@@ -0,0 +1,48 @@
+import pickle
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("tesserocr")
+
+from frame_source import Frame
+from ocr import OCRProcessor
+from scheduler import StageConfig, StageScheduler
+
+def _caption(text: str, width: int = 640, height: int = 360) -> np.ndarray:
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    cv2.putText(image, text, (40, 300), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 3, cv2.LINE_AA)
+    return image
+
+def test_processor_pickles_without_its_tesseract_instances():
+    processor = OCRProcessor()
+    processor.process_frame(_caption("Hello"))
+    restored = pickle.loads(pickle.dumps(processor))
+    assert restored.config == processor.config
+    assert getattr(restored._local, "api", None) is None
+
+def test_ocr_stage_runs_in_a_worker_process():
+    scheduler = StageScheduler({"ocr": StageConfig("process", 1)}, process_workers=1)
+    try:
+        frames = [Frame(index=0, timestamp=0.0, image=_caption("Part 1"))]
+        result = scheduler.submit("ocr", OCRProcessor().process_frames, frames).result(timeout=120)
+    finally:
+        scheduler.shutdown()
+    assert result.frames_processed == 1
+    assert "Part 1" in result.text[0]
+
+def _frames(*captions: str):
+    return [Frame(index=i, timestamp=float(i), image=_caption(text)) for i, text in enumerate(captions)]
+
+def test_unchanged_caption_reuses_its_text():
+    result = OCRProcessor().process_frames(_frames("Part 1", "Part 1"))
+    assert result.regions_recognized == 1
+    assert result.regions_reused == 1
+    assert result.text[1] == result.text[0]
+
+def test_caption_with_a_changed_digit_is_recognized_again():
+    result = OCRProcessor().process_frames(_frames("Call 555-0101", "Call 555-0107"))
+    assert result.regions_recognized == 2
+    assert result.regions_reused == 0
+    assert "0107" in result.text[1]
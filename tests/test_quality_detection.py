@@ -0,0 +1,33 @@
+import shutil
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from frame_source import FrameSource
+from quality_detection import QualityDetector
+
+def test_samples_the_middle_of_equal_spans(tmp_path):
+    detector = QualityDetector(str(tmp_path))
+    assert detector.sample_timestamps(80.0) == [5.0 + 10 * i for i in range(8)]
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_standalone_and_pipeline_scores_agree(tmp_path):
+    path = str(tmp_path / "clip.mp4")
+    rng = np.random.default_rng(0)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 25, (320, 240))
+    for i in range(250):
+        # Sharp noise in the first half, blurred in the second
+        image = rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+        writer.write(image if i < 125 else cv2.GaussianBlur(image, (15, 15), 5))
+    writer.release()
+
+    detector = QualityDetector(str(tmp_path / "features"))
+    standalone, _ = detector.check_video_quality(path)
+    source = FrameSource(path)
+    duration = source.duration
+    source.close()
+    frames = FrameSource.read(path, timestamps=detector.sample_timestamps(duration))
+    pipeline, _ = detector.score_frames(frames, duration)
+    assert pipeline == pytest.approx(standalone, rel=0.1)
@@ -0,0 +1,48 @@
+import os
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from scheduler import StageConfig, StageScheduler, gather, starcall
+
+def _describe(values, scale=1):
+    return os.getpid(), [value * scale for value in values]
+
+@pytest.fixture
+def scheduler():
+    scheduler = StageScheduler(
+        {"cpu": StageConfig("process", 2), "io": StageConfig("thread", 1)},
+        thread_workers=4, process_workers=2
+    )
+    yield scheduler
+    scheduler.shutdown()
+
+def test_process_stage_runs_in_a_worker_process(scheduler):
+    pid, values = scheduler.submit("cpu", _describe, [1, 2, 3], scale=2).result(timeout=60)
+    assert pid != os.getpid()
+    assert values == [2, 4, 6]
+    assert scheduler.stats()["cpu"]["completed"] == 1
+
+def test_process_stage_after_a_dependency(scheduler):
+    inputs = gather(scheduler.submit("io", list, range(3)), scheduler.submit("io", int, "4"))
+    future = scheduler.submit_after("cpu", inputs, starcall, _describe)
+    pid, values = future.result(timeout=60)
+    assert pid != os.getpid()
+    assert values == [0, 4, 8]
+
+def test_unpicklable_process_task_fails_its_future(scheduler):
+    lock = threading.Lock()
+    with pytest.raises(Exception):
+        scheduler.submit("cpu", _describe, [lock]).result(timeout=60)
+
+def test_capped_stage_queues_without_blocking_others(scheduler):
+    release = threading.Event()
+    first = scheduler.submit("io", release.wait, 10)
+    second = scheduler.submit("io", lambda: "done")
+    assert scheduler.stats()["io"]["queued"] == 1
+    second.cancel()
+    release.set()
+    assert first.result(timeout=10) is True
+    with pytest.raises(CancelledError):
+        second.result()
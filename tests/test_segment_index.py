@@ -0,0 +1,30 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+from segment_index import SegmentIndex, align
+
+# Segment vectors: an I3D clip embedding (600) and the window's VGGish mean (128)
+DIM = 728
+
+def test_build_default_index_at_segment_dimension(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, DIM)).astype(np.float32)
+    keys = [(f"video-{i // 100}", i % 100) for i in range(len(vectors))]
+    index = SegmentIndex(str(tmp_path / "segments.index"))
+    index.build(vectors, keys)
+
+    assert index.base.ntotal == len(vectors)
+    # An excerpt of video-3, segments 40-49, with a little noise
+    queries = vectors[340:350] + 0.05 * rng.standard_normal((10, DIM)).astype(np.float32)
+    matches = align(index.search(queries, k=5, nprobe=256), segment_seconds=2.0, threshold=0.3)
+    assert matches[0].video_id == "video-3"
+    assert matches[0].source_start == 80.0
+    assert matches[0].matched_segments >= 8
+
+def test_build_rejects_pq_m_not_dividing_dim(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((300, DIM)).astype(np.float32)
+    index = SegmentIndex(str(tmp_path / "segments.index"))
+    with pytest.raises(ValueError):
+        index.build(vectors, [("video", i) for i in range(len(vectors))], nlist=4, pq_m=64)
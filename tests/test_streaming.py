@@ -0,0 +1,28 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("tesserocr")
+
+from frame_source import Frame
+from rules import DEFAULT_DECISION_RULES, RuleSet
+from streaming import StreamState
+
+def _window(start: int, count: int = 4):
+    return [Frame(index=i, timestamp=i / 4, image=np.zeros((8, 8, 3), dtype=np.uint8)) for i in range(start, start + count)]
+
+def test_failed_window_checks_are_reported_as_errors():
+    state = StreamState()
+    state.update(_window(0), {"nsfw": (0, 0.99), "objects": {0: []}, "logos": []}, 0.25)
+    state.update(_window(4), {"nsfw": (0, 0.99), "objects": {"error": "detector crashed"},
+                              "ocr": {"error": "tesseract crashed"}}, 0.25)
+
+    results = state.results()
+    assert results["objects"] == {"error": "detector crashed"}
+    assert results["copyright"] == {"error": "detector crashed"}
+    assert results["ocr"] == {"error": "tesseract crashed"}
+    assert results["nsfw"] == (0, 0.99)
+
+    level, reasons = RuleSet.from_config(DEFAULT_DECISION_RULES).evaluate(results)
+    assert level != "LOW"
+    assert "check_failed:objects" in reasons
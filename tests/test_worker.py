@@ -0,0 +1,39 @@
+import threading
+import pytest
+
+for module in ("numpy", "cv2", "tensorflow", "ultralytics", "tesserocr", "faiss"):
+    pytest.importorskip(module)
+
+from job_queue import Lease
+from metrics import MetricsRegistry
+from worker import ModerationWorker
+
+class FlakyBroker:
+    """Broker whose first lease extension fails"""
+
+    def __init__(self):
+        self.calls = 0
+        self.extended = threading.Event()
+
+    def extend(self, lease, visibility_timeout):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("broker unavailable")
+        self.extended.set()
+        return True
+
+def test_heartbeat_survives_broker_error():
+    broker = FlakyBroker()
+    worker = ModerationWorker(broker, moderator=object(), visibility_timeout=0.06)
+    worker._in_flight["job"] = Lease("job", {}, "token", 1, 0.0)
+    finished = threading.Event()
+    heartbeat = threading.Thread(target=worker._heartbeat, args=(finished,), daemon=True)
+    heartbeat.start()
+    try:
+        assert broker.extended.wait(5)
+        assert heartbeat.is_alive()
+    finally:
+        finished.set()
+        heartbeat.join()
+    errors = MetricsRegistry.default().snapshot()["counters"]
+    assert any(name.startswith("moderation_worker_heartbeat_errors_total") for name in errors)
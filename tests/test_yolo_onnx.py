@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("ultralytics")
+
+from yolo_onnx import box_iou, nms
+
+def _boxes(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    corners = rng.uniform(0, 600, (count, 2))
+    boxes = np.concatenate([corners, corners + rng.uniform(10, 80, (count, 2))], axis=1).astype(np.float32)
+    return boxes, rng.uniform(0.25, 1.0, count).astype(np.float32), rng.integers(0, 3, count)
+
+def _reference_nms(boxes, scores, classes, iou_threshold):
+    keep = []
+    for i in np.argsort(-scores, kind="stable"):
+        if all(classes[i] != classes[j] or box_iou(boxes[[i]], boxes[[j]])[0, 0] <= iou_threshold for j in keep):
+            keep.append(i)
+    return keep
+
+def test_matches_greedy_suppression():
+    boxes, scores, classes = _boxes(400)
+    assert nms(boxes, scores, classes, 0.45).tolist() == _reference_nms(boxes, scores, classes, 0.45)
+
+def test_thousands_of_boxes_stay_cheap():
+    boxes, scores, classes = _boxes(50000, seed=1)
+    start = time.perf_counter()
+    keep = nms(boxes, scores, classes, 0.45, max_candidates=30000, max_keep=300)
+    assert time.perf_counter() - start < 5
+    assert 0 < len(keep) <= 300
+    # Only the 30000 most confident boxes are candidates
+    assert scores[keep].min() >= np.sort(scores)[-30000]
+    assert list(scores[keep]) == sorted(scores[keep], reverse=True)
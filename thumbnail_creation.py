@@ -1,23 +1,42 @@
+import os
 import cv2
 import numpy as np
-from typing import Optional
-from moviepy.editor import VideoFileClip
+from typing import List, Optional, Sequence
+from frame_source import Frame, FrameSource
+from model_registry import ModelRegistry
+from metrics import span
 
 class ThumbnailGenerator:
     """
     Generates thumbnails from videos based on quality, face detection and emotions.
     """
     
-    def __init__(self, face_model_path: str = None, emotion_model_path: str = None):
+    # Width frames are compared and scored at
+    ANALYSIS_WIDTH = 320
+    
+    def __init__(self, face_model_path: str = None, emotion_model_path: str = None,
+                 registry: Optional[ModelRegistry] = None):
         """
-        Initialize thumbnail generator with face and emotion detection models.
+        Initialize thumbnail generator; face and emotion models are loaded on first use.
         
         Args:
             face_model_path: Path to face detection model
             emotion_model_path: Path to emotion recognition model
+            registry: Model registry to share models through (default: process-wide)
         """
-        self.face_detector = self._load_face_model(face_model_path)
-        self.emotion_detector = self._load_emotion_model(emotion_model_path)
+        self.registry = registry or ModelRegistry.default()
+        self.face_model_name = f"face:{face_model_path or 'default'}"
+        self.emotion_model_name = f"emotion:{emotion_model_path or 'default'}"
+        self.registry.register(self.face_model_name, lambda: self._load_face_model(face_model_path))
+        self.registry.register(self.emotion_model_name, lambda: self._load_emotion_model(emotion_model_path))
+        
+    @property
+    def face_detector(self):
+        return self.registry.get(self.face_model_name)
+        
+    @property
+    def emotion_detector(self):
+        return self.registry.get(self.emotion_model_name)
         
     def _load_face_model(self, model_path: str):
         """Load face detection model"""
@@ -27,17 +46,66 @@ class ThumbnailGenerator:
         """Load emotion recognition model"""
         pass
         
-    def extract_candidate_frames(self, video_path: str) -> List:
+    def extract_candidate_frames(self, video_path: str, num_candidates: int = 10) -> List:
         """
         Extract potential thumbnail frames from video.
         
         Args:
             video_path: Path to video file
+            num_candidates: Number of frames spread over the video to consider
             
         Returns:
             List of candidate frames
         """
-        pass
+        return [frame.image for frame in FrameSource.read(video_path, num_frames=num_candidates)]
+        
+    def _analysis_stack(self, images: Sequence[np.ndarray]) -> np.ndarray:
+        """(N, H, W) grayscale stack of images at ANALYSIS_WIDTH"""
+        height, width = images[0].shape[:2]
+        scale = min(1.0, self.ANALYSIS_WIDTH / max(width, 1))
+        size = (max(int(width * scale), 1), max(int(height * scale), 1))
+        return np.stack([cv2.cvtColor(cv2.resize(image, size), cv2.COLOR_RGB2GRAY) for image in images])
+        
+    def select_candidates(self, images: Sequence[np.ndarray], num_candidates: int) -> List[int]:
+        """
+        Pick the frames that open a new shot among frames already decoded.
+        
+        Args:
+            images: Decoded frames in time order
+            num_candidates: Number of frames to pick
+            
+        Returns:
+            Positions in images of the first frame and of the frames with
+            the largest change from their predecessor (scene cuts), in time order
+        """
+        if len(images) <= num_candidates:
+            return list(range(len(images)))
+        gray = self._analysis_stack(images).astype(np.float32)
+        change = np.empty(len(gray), dtype=np.float32)
+        change[0] = np.inf
+        change[1:] = np.abs(gray[1:] - gray[:-1]).mean(axis=(1, 2))
+        return sorted(np.argsort(-change, kind="stable")[:num_candidates].tolist())
+        
+    def score_frames(self, images: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        Score frames on sharpness and face presence in one pass over the stack.
+        
+        Args:
+            images: Image frames to score
+            
+        Returns:
+            Score of each frame
+        """
+        gray = self._analysis_stack(images)
+        frames = gray.astype(np.float32)
+        laplacian = (frames[:, 1:-1, :-2] + frames[:, 1:-1, 2:] + frames[:, :-2, 1:-1]
+                     + frames[:, 2:, 1:-1] - 4 * frames[:, 1:-1, 1:-1])
+        scores = np.minimum(laplacian.reshape(len(frames), -1).var(axis=1) / 1000, 1.0)
+        if self.face_detector is not None:
+            with span(self.face_model_name, "inference"):
+                faces = np.array([len(self.face_detector.detectMultiScale(image)) for image in gray])
+            scores += 0.5 * (faces > 0)
+        return scores
         
     def score_frame(self, frame) -> float:
         """
@@ -49,17 +117,65 @@ class ThumbnailGenerator:
         Returns:
             Frame quality score
         """
-        pass
+        return float(self.score_frames([frame])[0])
+        
+    def pick_best(self, images: Sequence[np.ndarray], num_candidates: Optional[int] = None) -> Optional[np.ndarray]:
+        """
+        Best thumbnail among images.
+        
+        Args:
+            images: Decoded frames in time order
+            num_candidates: Only score this many scene-change frames (default: all frames)
+            
+        Returns:
+            Chosen image, or None if there are no images
+        """
+        if not images:
+            return None
+        positions = self.select_candidates(images, num_candidates or len(images))
+        with span("thumbnail.score", "cpu"):
+            scores = self.score_frames([images[i] for i in positions])
+        return images[positions[int(np.argmax(scores))]]
         
-    def generate_thumbnail(self, video_path: str, output_path: Optional[str] = None) -> str:
+    def select_thumbnail(self, *frame_lists: Sequence[Frame], num_candidates: int = 10) -> Optional[np.ndarray]:
+        """
+        Choose a thumbnail from frames decoded for other stages, without writing it.
+        
+        Args:
+            *frame_lists: Frames decoded for any subscriber (duplicates are merged)
+            num_candidates: Number of scene-change frames to score
+            
+        Returns:
+            Chosen image, or None if there are no frames
+        """
+        frames = {frame.index: frame for frames in frame_lists for frame in frames}
+        return self.pick_best([frames[index].image for index in sorted(frames)], num_candidates)
+        
+    def generate_thumbnail(self, video_path: str, output_path: Optional[str] = None,
+                           frames: Optional[List[Frame]] = None,
+                           image: Optional[np.ndarray] = None) -> Optional[str]:
         """
         Generate and save thumbnail for video.
         
         Args:
             video_path: Path to video file
             output_path: Optional custom output path
+            frames: Already decoded candidate frames to reuse instead of decoding again
+            image: Thumbnail already chosen (see select_thumbnail); only written
             
         Returns:
             Path to generated thumbnail
         """
-        pass
+        if image is None:
+            if frames is not None:
+                candidates = [frame.image for frame in frames]
+            else:
+                candidates = self.extract_candidate_frames(video_path)
+            image = self.pick_best(candidates)
+        if image is None:
+            return None
+            
+        output_path = output_path or f"{os.path.splitext(video_path)[0]}_thumbnail.jpg"
+        with span("thumbnail.write", "io"):
+            cv2.imwrite(output_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        return output_path
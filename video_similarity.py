@@ -1,14 +1,29 @@
-import faiss
+import os
 import numpy as np
 import tensorflow as tf
-import tensorflow_hub as hub
-import os
-import json
 from typing import Tuple, List, Dict, Optional
+from collections import defaultdict
 from dataclasses import dataclass
-import cv2
-from moviepy.editor import VideoFileClip
-import librosa
+from datetime import datetime
+from frame_source import Frame, FrameSource, select_evenly
+from result_cache import content_hash
+from feature_context import FeatureContext, batch_embeddings
+from model_registry import ModelRegistry
+from faiss_index import FaissIndexManager
+from segment_index import ClipMatch, SegmentIndex, align
+from feature_store import FeatureStore
+from audio_source import SAMPLE_RATE, read_pcm
+from metrics import span
+
+# VGGish embeds audio in non-overlapping 0.96 s patches of 16 kHz samples
+VGGISH_SAMPLE_RATE = SAMPLE_RATE
+VGGISH_PATCH_SAMPLES = 15360
+VGGISH_EMBEDDING_SIZE = 128
+
+# Segment fingerprints: one vector per SEGMENT_SECONDS window, from an I3D
+# clip of the window's frames (decoded at SEGMENT_FPS) and its VGGish patches
+SEGMENT_SECONDS = 2.0
+SEGMENT_FPS = 2
 
 @dataclass
 class VideoFeatures:
@@ -19,88 +34,322 @@ class VideoFeatures:
 class VideoSimilarity:
     """Handles video similarity detection using FAISS and feature extraction"""
     
-    def __init__(self, faiss_index_path: Optional[str] = None, feature_storage_path: str = "features"):
-        os.makedirs(feature_storage_path, exist_ok=True)
+    def __init__(self, faiss_index_path: Optional[str] = None, feature_storage_path: str = "features",
+                 registry: Optional[ModelRegistry] = None, segment_index_path: Optional[str] = None,
+                 segment_neighbours: int = 10, min_segments: int = 3):
+        """
+        Initialize similarity search.
+        
+        Args:
+            faiss_index_path: Whole-video index (default: no search)
+            feature_storage_path: Directory of the whole-video feature store; approved
+                videos are also kept, under their catalog IDs, in its catalog/ store
+            registry: Model registry to share models through (default: process-wide)
+            segment_index_path: Segment fingerprint index for partial-clip matches (default: none)
+            segment_neighbours: Catalog segments retrieved per upload segment
+            min_segments: Aligned segments needed for a partial-clip match
+        """
         self.feature_storage_path = feature_storage_path
-        self.index = self._load_faiss_index(faiss_index_path)
-        self.video_model = hub.load("https://tfhub.dev/deepmind/i3d-kinetics-600/1").signatures['default']
-        self.audio_model = hub.load("https://tfhub.dev/google/vggish/1").signatures['default']
-        
-    def _load_faiss_index(self, path: Optional[str]) -> Optional[faiss.Index]:
-        if path and os.path.exists(path):
-            return faiss.read_index(path)
-        return None
-        
-    def _extract_frames(self, video_path: str, num_frames: int = 16) -> np.ndarray:
-        clip = VideoFileClip(video_path)
-        frames = []
-        for t in np.linspace(0, clip.duration, num_frames):
-            frame = clip.get_frame(t)
-            frame = cv2.resize(frame, (224, 224))
-            frames.append(frame)
-        return np.array(frames)
-        
-    def extract_video_features(self, video_path: str) -> np.ndarray:
-        """Extract I3D features from video"""
-        frames = self._extract_frames(video_path)
-        inputs = tf.convert_to_tensor(frames, dtype=tf.float32)[tf.newaxis, ...]
-        outputs = self.video_model(inputs)
+        # Every moderated upload, by content hash (rejected ones included)
+        self.feature_store = FeatureStore(feature_storage_path)
+        # Approved videos only, by catalog ID: what the similarity index holds
+        self.catalog_store = FeatureStore(os.path.join(feature_storage_path, "catalog"))
+        self.index = FaissIndexManager(faiss_index_path) if faiss_index_path else None
+        self.segment_index = SegmentIndex(segment_index_path) if segment_index_path else None
+        self.segment_neighbours = segment_neighbours
+        self.min_segments = min_segments
+        self.registry = registry or ModelRegistry.default()
+        
+    @property
+    def video_model(self):
+        return self.registry.get("i3d")
+        
+    @property
+    def audio_model(self):
+        return self.registry.get("vggish")
+        
+    def _extract_frames(self, video_path: str, num_frames: int = 16,
+                        timestamps: Optional[List[float]] = None) -> np.ndarray:
+        if timestamps is not None:
+            frames = FrameSource.read(video_path, timestamps=timestamps, sizes=[(224, 224)])
+        else:
+            frames = FrameSource.read(video_path, num_frames=num_frames, sizes=[(224, 224)])
+        return self._stack_frames(frames, num_frames)
+        
+    def _stack_frames(self, frames: List[Frame], num_frames: int = 16) -> np.ndarray:
+        return np.array([frame.at_size((224, 224)) for frame in select_evenly(frames, num_frames)])
+        
+    def extract_video_features(self, video_path: str, frames: Optional[List[Frame]] = None,
+                               context: Optional[FeatureContext] = None) -> np.ndarray:
+        """Extract I3D features from video, reusing already decoded frames or a shared embedding if given"""
+        if context is not None:
+            return context.get("i3d", lambda: self.extract_video_features(video_path, context.frames("i3d") or frames))
+        if frames is not None:
+            clip = self._stack_frames(frames)
+        else:
+            clip = self._extract_frames(video_path)
+        inputs = tf.convert_to_tensor(clip, dtype=tf.float32)[tf.newaxis, ...]
+        with span("i3d", "inference"):
+            outputs = self.video_model(inputs)
         return outputs['default'].numpy().flatten()
         
-    def extract_audio_features(self, video_path: str) -> np.ndarray:
-        """Extract VGGish audio features"""
-        clip = VideoFileClip(video_path)
-        audio_path = "temp_audio.wav"
-        clip.audio.write_audiofile(audio_path)
+    def extract_video_features_batch(self, frame_lists: List[List[Frame]], batch_size: int = 8) -> List[np.ndarray]:
+        """Extract I3D features for many videos with stacked forward passes"""
+        stacked = np.stack([self._stack_frames(frames) for frames in frame_lists])
+        outputs = []
+        for start in range(0, len(stacked), batch_size):
+            inputs = tf.convert_to_tensor(stacked[start:start + batch_size], dtype=tf.float32)
+            with span("i3d", "inference"):
+                outputs.append(self.video_model(inputs)['default'].numpy())
+        return list(np.concatenate(outputs).reshape(len(stacked), -1))
         
-        # Load audio and extract features
-        audio, sr = librosa.load(audio_path, sr=16000)
+    def _load_audio(self, video_path: str, context: Optional[FeatureContext] = None) -> np.ndarray:
+        """16 kHz mono samples of the audio track, shared through the context if given"""
+        if context is not None:
+            return context.get("pcm", lambda: read_pcm(video_path, VGGISH_SAMPLE_RATE))
+        return read_pcm(video_path, VGGISH_SAMPLE_RATE)
+        
+    def extract_audio_features(self, video_path: str, context: Optional[FeatureContext] = None) -> np.ndarray:
+        """Extract VGGish audio features, reusing a shared embedding if given"""
+        if context is not None:
+            return context.get("vggish", lambda: self._embed_audio(self._load_audio(video_path, context)))
+        return self._embed_audio(self._load_audio(video_path))
+        
+    def _embed_audio(self, audio: np.ndarray) -> np.ndarray:
         inputs = tf.convert_to_tensor(audio, dtype=tf.float32)[tf.newaxis, ...]
-        outputs = self.audio_model(inputs)
-        os.remove(audio_path)
+        with span("vggish", "inference"):
+            outputs = self.audio_model(inputs)
         return outputs['default'].numpy().flatten()
         
+    def extract_audio_features_batch(self, video_paths: List[str],
+                                     contexts: Optional[List[Optional[FeatureContext]]] = None) -> List[np.ndarray]:
+        """
+        Extract VGGish features for many videos with a single forward pass.
+        
+        Each waveform is trimmed to whole VGGish patches (which VGGish would
+        drop anyway) so the concatenated embeddings split back cleanly.
+        """
+        contexts = contexts or [None] * len(video_paths)
+        waveforms = []
+        for path, context in zip(video_paths, contexts):
+            audio = self._load_audio(path, context)
+            waveforms.append(audio[:len(audio) - len(audio) % VGGISH_PATCH_SAMPLES])
+        patch_counts = [len(audio) // VGGISH_PATCH_SAMPLES for audio in waveforms]
+        if sum(patch_counts) == 0:
+            return [np.zeros(0, dtype=np.float32) for _ in video_paths]
+            
+        inputs = tf.convert_to_tensor(np.concatenate(waveforms), dtype=tf.float32)[tf.newaxis, ...]
+        with span("vggish", "inference"):
+            embeddings = self.audio_model(inputs)['default'].numpy()
+        splits = np.cumsum(patch_counts)[:-1]
+        return [chunk.flatten() for chunk in np.split(embeddings, splits)]
+        
+    def _segment_clips(self, frames: List[Frame]) -> np.ndarray:
+        """Stack of (frames per segment, 224, 224, 3) clips, one per SEGMENT_SECONDS window"""
+        per_clip = int(SEGMENT_SECONDS * SEGMENT_FPS)
+        windows = defaultdict(list)
+        for frame in frames:
+            windows[int(frame.timestamp // SEGMENT_SECONDS)].append(frame)
+        clips, previous = [], frames[:1]
+        for segment in range(max(windows) + 1):
+            # A window without frames (e.g. a decode gap) repeats the previous one
+            previous = windows.get(segment) or previous
+            clips.append(np.array([frame.at_size((224, 224)) for frame in select_evenly(previous, per_clip)]))
+        return np.stack(clips)
+        
+    def extract_segment_features(self, video_path: str, frames: Optional[List[Frame]] = None,
+                                 context: Optional[FeatureContext] = None, batch_size: int = 8) -> np.ndarray:
+        """
+        Fingerprint every SEGMENT_SECONDS window of a video.
+        
+        Each window's vector joins the I3D embedding of its clip with the
+        mean of the VGGish patches centred in it, in the layout of embedding().
+        
+        Args:
+            video_path: Path to video file
+            frames: Frames decoded at SEGMENT_FPS to reuse instead of decoding again
+            context: Per-video feature context sharing frames and the VGGish embedding
+            batch_size: Clips per I3D forward pass
+            
+        Returns:
+            Array of shape (num_segments, dim); empty if no frame was decoded
+        """
+        if context is not None:
+            return context.get("segments", lambda: self._compute_segments(
+                video_path, context.frames("segments") or frames, context, batch_size
+            ))
+        return self._compute_segments(video_path, frames, None, batch_size)
+        
+    def _compute_segments(self, video_path: str, frames: Optional[List[Frame]],
+                          context: Optional[FeatureContext], batch_size: int) -> np.ndarray:
+        if frames is None:
+            frames = FrameSource.read(video_path, fps=SEGMENT_FPS, sizes=[(224, 224)], full=False)
+        if not frames:
+            return np.zeros((0, 0), dtype=np.float32)
+        clips = self._segment_clips(list(frames))
+        visual = []
+        for start in range(0, len(clips), batch_size):
+            inputs = tf.convert_to_tensor(clips[start:start + batch_size], dtype=tf.float32)
+            with span("i3d", "inference"):
+                visual.append(self.video_model(inputs)['default'].numpy())
+        visual = np.concatenate(visual).reshape(len(clips), -1)
+        
+        patches = self.extract_audio_features(video_path, context).reshape(-1, VGGISH_EMBEDDING_SIZE)
+        audio = np.zeros((len(clips), VGGISH_EMBEDDING_SIZE), dtype=np.float32)
+        centres = (np.arange(len(patches)) + 0.5) * VGGISH_PATCH_SAMPLES / VGGISH_SAMPLE_RATE
+        owners = (centres // SEGMENT_SECONDS).astype(int)
+        for segment in np.unique(owners[owners < len(clips)]):
+            audio[segment] = patches[owners == segment].mean(axis=0)
+        return np.concatenate([visual, audio], axis=1).astype(np.float32)
+        
     def save_features(self, video_path: str, features: VideoFeatures):
-        """Save extracted features for future use"""
-        video_id = os.path.basename(video_path).split('.')[0]
-        save_path = os.path.join(self.feature_storage_path, f"{video_id}.npz")
-        
-        np.savez(
-            save_path,
-            visual_features=features.visual_features,
-            audio_features=features.audio_features,
-            metadata=json.dumps(features.metadata)
-        )
+        """Save extracted features for future use, keyed by content hash"""
+        with span("feature_store.put", "io"):
+            self.feature_store.put(content_hash(video_path), self.embedding(features), features.metadata)
         
     def load_features(self, video_id: str) -> Optional[VideoFeatures]:
-        """Load previously extracted features"""
-        path = os.path.join(self.feature_storage_path, f"{video_id}.npz")
-        if os.path.exists(path):
-            data = np.load(path, allow_pickle=True)
-            return VideoFeatures(
-                visual_features=data['visual_features'],
-                audio_features=data['audio_features'],
-                metadata=json.loads(data['metadata'])
-            )
-        return None
+        """Load previously extracted features (audio is the time-pooled VGGish embedding)"""
+        vector = self.feature_store.get(video_id)
+        if vector is None:
+            return None
+        return VideoFeatures(
+            visual_features=vector[:-VGGISH_EMBEDDING_SIZE],
+            audio_features=vector[-VGGISH_EMBEDDING_SIZE:],
+            metadata=self.feature_store.metadata(video_id) or {}
+        )
         
-    def find_similar_videos(self, video_path: str, threshold: float = 0.8) -> List[Tuple[str, float]]:
+    def rebuild_index(self, **build_args):
+        """
+        Rebuild the similarity index from the catalog store.
+        
+        Only videos added with index_video are in it, under their catalog
+        IDs, so a rebuild holds the same entries as the incrementally grown
+        index; uploads that were merely checked (and maybe rejected) are
+        never match targets.
+        """
+        if not len(self.catalog_store):
+            raise RuntimeError(f"No catalog videos in {self.catalog_store.path}; add them with index_video")
+        self.index.build_from(
+            self.catalog_store.scan(),
+            self.catalog_store.sample(build_args.pop("train_size", 1_000_000)),
+            len(self.catalog_store),
+            **build_args
+        )
+        
+    def find_similar_videos(self, video_path: str, threshold: float = 0.8,
+                            frames: Optional[List[Frame]] = None,
+                            context: Optional[FeatureContext] = None) -> List[Tuple[str, float]]:
         """Find similar videos using combined features"""
         features = VideoFeatures(
-            visual_features=self.extract_video_features(video_path),
-            audio_features=self.extract_audio_features(video_path),
+            visual_features=self.extract_video_features(video_path, frames, context),
+            audio_features=self.extract_audio_features(video_path, context),
             metadata={"path": video_path, "timestamp": str(datetime.now())}
         )
         self.save_features(video_path, features)
+        return self._search([features], threshold)[0]
+        
+    def find_similar_videos_batch(self, video_paths: List[str], frame_lists: List[List[Frame]],
+                                  threshold: float = 0.8,
+                                  contexts: Optional[List[FeatureContext]] = None) -> List[List[Tuple[str, float]]]:
+        """Find similar videos for many videos with batched extraction and one FAISS query"""
+        contexts = contexts or [None] * len(video_paths)
+        visual = batch_embeddings(contexts, "i3d", lambda ids: self.extract_video_features_batch(
+            [(contexts[i] and contexts[i].frames("i3d")) or frame_lists[i] for i in ids]
+        ))
+        audio = batch_embeddings(contexts, "vggish", lambda ids: self.extract_audio_features_batch(
+            [video_paths[i] for i in ids], [contexts[i] for i in ids]
+        ))
+        batch = []
+        for path, visual_features, audio_features in zip(video_paths, visual, audio):
+            features = VideoFeatures(
+                visual_features=visual_features,
+                audio_features=audio_features,
+                metadata={"path": path, "timestamp": str(datetime.now())}
+            )
+            batch.append(features)
+        with span("feature_store.put", "io"):
+            self.feature_store.put_many(
+                [content_hash(path) for path in video_paths],
+                np.stack([self.embedding(features) for features in batch]),
+                [features.metadata for features in batch]
+            )
+        return self._search(batch, threshold)
+        
+    def find_similar_segments(self, video_path: str, threshold: float = 0.8,
+                              context: Optional[FeatureContext] = None) -> List[ClipMatch]:
+        """Find catalog videos a part of this video was taken from (see find_similar_segments_batch)"""
+        return self.find_similar_segments_batch([video_path], threshold, [context])[0]
+        
+    def find_similar_segments_batch(self, video_paths: List[str], threshold: float = 0.8,
+                                    contexts: Optional[List[Optional[FeatureContext]]] = None) -> List[List[ClipMatch]]:
+        """
+        Find partial-clip matches for many videos with one multi-query segment search.
+        
+        Every segment of every video is a query; the neighbours of each
+        video's segments are then aligned in time (segment_index.align), so
+        an excerpt embedded anywhere in an upload matches its source even
+        when the rest of the upload is unrelated.
+        
+        Returns:
+            Partial-clip matches of each video, longest first
+        """
+        if self.segment_index is None:
+            return [[] for _ in video_paths]
+        contexts = contexts or [None] * len(video_paths)
+        segments = [self.extract_segment_features(path, context=context) for path, context in zip(video_paths, contexts)]
+        counts = [len(features) for features in segments]
+        if sum(counts) == 0:
+            return [[] for _ in video_paths]
+            
+        queries = np.concatenate([features for features in segments if len(features)])
+        with span("segment_index.search", "cpu"):
+            neighbours = self.segment_index.search(queries, self.segment_neighbours)
+        results, start = [], 0
+        for count in counts:
+            results.append(align(neighbours[start:start + count], SEGMENT_SECONDS, threshold, self.min_segments))
+            start += count
+        return results
+        
+    def embedding(self, features: VideoFeatures) -> np.ndarray:
+        """
+        Fixed-size index vector of a video.
+        
+        VGGish yields one 128-d embedding per 0.96 s of audio, so the audio
+        part is mean-pooled over time before joining the visual features.
+        """
+        audio = features.audio_features.reshape(-1, VGGISH_EMBEDDING_SIZE)
+        audio = audio.mean(axis=0) if len(audio) else np.zeros(VGGISH_EMBEDDING_SIZE, dtype=np.float32)
+        return np.concatenate([features.visual_features, audio]).astype(np.float32)
+        
+    def index_video(self, video_id: str, video_path: str, frames: Optional[List[Frame]] = None,
+                    context: Optional[FeatureContext] = None):
+        """Add an approved video to the catalog: catalog store, similarity index and segment index"""
+        if self.index is not None:
+            features = VideoFeatures(
+                visual_features=self.extract_video_features(video_path, frames, context),
+                audio_features=self.extract_audio_features(video_path, context),
+                metadata={"path": video_path}
+            )
+            vector = self.embedding(features)
+            with span("feature_store.put", "io"):
+                self.catalog_store.put(video_id, vector, features.metadata)
+            with span("similarity_index.add", "io"):
+                self.index.add(vector[np.newaxis, :], [video_id])
+        if self.segment_index is not None:
+            segments = self.extract_segment_features(video_path, context=context)
+            if len(segments):
+                with span("segment_index.add", "io"):
+                    self.segment_index.add(segments, [(video_id, segment) for segment in range(len(segments))])
         
+    def _search(self, batch: List[VideoFeatures], threshold: float) -> List[List[Tuple[str, float]]]:
         if self.index is None:
-            return []
+            return [[] for _ in batch]
             
-        # Combine features and search
-        combined_features = np.concatenate([
-            features.visual_features,
-            features.audio_features
-        ])[np.newaxis, ...]
-        
-        D, I = self.index.search(combined_features, 5)
-        return [(str(i), float(d)) for i, d in zip(I[0], D[0]) if d > threshold]
+        # Search all queries at once; results carry the catalog video IDs
+        queries = np.stack([self.embedding(features) for features in batch])
+        with span("similarity_index.search", "cpu"):
+            results = self.index.search(queries, 5)
+        return [
+            [(video_id, score) for video_id, score in matches if score > threshold]
+            for matches in results
+        ]
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from moderator import Moderator
+from job_queue import Broker, Checkpoint, Lease
+from metrics import MetricsRegistry
+from rules import RuleSet
+
+logger = logging.getLogger(__name__)
+
+class JsonlSink:
+    """
+    Results sink appending one JSON line per finished job.
+
+    Delivery is at least once, so a job whose worker died between writing
+    its result and completing it is written again by the next attempt;
+    readers keep the last line of each job ID.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, job_id: str, result: Dict):
+        line = json.dumps({"job_id": job_id, "result": result}) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+class ModerationWorker:
+    """
+    Worker mode: pulls moderation jobs from a shared broker and runs them on a local Moderator.
+
+    Every host runs one worker with concurrency job slots; each slot
+    leases one job at a time, so hosts only meet at the broker for a lease
+    and a completion per video and throughput grows with the number of
+    hosts until the broker or the shared storage saturates. A heartbeat
+    thread extends the lease of every job in flight; a worker that dies
+    stops extending, and its jobs are redelivered once their leases
+    expire. Each job's check results are checkpointed as they finish, so
+    a redelivered job only runs the checks its earlier attempts did not
+    complete. Failed jobs are retried with exponential backoff.
+
+    Job payloads are {"video_path": ..., "rules": [...], "video_id": ...},
+    rules being optional decision rules in the rules.Rule configuration
+    format and video_id the optional catalog ID of an approved video.
+    """
+
+    def __init__(self, broker: Broker, moderator: Optional[Moderator] = None, concurrency: int = 4,
+                 visibility_timeout: float = 120.0, poll_interval: float = 1.0, retry_delay: float = 5.0,
+                 sink: Optional[JsonlSink] = None, worker_id: Optional[str] = None):
+        """
+        Initialize worker; call run() to start pulling jobs.
+
+        Args:
+            broker: Job queue shared with the other workers
+            moderator: Moderator to run jobs on (default: a new one)
+            concurrency: Jobs moderated at once
+            visibility_timeout: Seconds a job stays leased without a heartbeat
+            poll_interval: Seconds between polls of an empty queue
+            retry_delay: Delay before the first retry of a failed job, doubled for each further attempt
+            sink: Where results are written besides the broker (default: broker only)
+            worker_id: Name of this worker in logs and metrics (default: host name and process ID)
+        """
+        self.broker = broker
+        self.moderator = moderator or Moderator()
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.sink = sink
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._slots = threading.Semaphore(concurrency)
+        self._in_flight: Dict[str, Lease] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.processed = 0
+
+    def run(self, max_jobs: Optional[int] = None, exit_when_idle: bool = False):
+        """
+        Lease and run jobs until stop() is called.
+
+        Args:
+            max_jobs: Stop after leasing this many jobs
+            exit_when_idle: Stop once no job is visible and nothing is in flight
+        """
+        self._stopping.clear()
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(finished,), name="lease-heartbeat", daemon=True)
+        heartbeat.start()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job")
+        leased = 0
+        try:
+            while max_jobs is None or leased < max_jobs:
+                self._slots.acquire()
+                lease = None if self._stopping.is_set() else self.broker.lease(self.visibility_timeout)
+                if lease is None:
+                    self._slots.release()
+                    with self._lock:
+                        idle = not self._in_flight
+                    if self._stopping.is_set() or (exit_when_idle and idle):
+                        break
+                    self._stopping.wait(self.poll_interval)
+                    continue
+                leased += 1
+                with self._lock:
+                    self._in_flight[lease.job_id] = lease
+                executor.submit(self._run_job, lease)
+        finally:
+            executor.shutdown(wait=True)
+            finished.set()
+            heartbeat.join()
+
+    def stop(self):
+        """Stop leasing new jobs; jobs in flight finish first"""
+        self._stopping.set()
+
+    def _heartbeat(self, finished: threading.Event):
+        """Extend every lease in flight well before it expires"""
+        while not finished.wait(self.visibility_timeout / 3):
+            with self._lock:
+                leases = list(self._in_flight.values())
+            for lease in leases:
+                try:
+                    extended = self.broker.extend(lease, self.visibility_timeout)
+                except Exception as e:
+                    # A transient broker error must not end the heartbeat: the
+                    # lease is extended again on the next beat, well before it expires
+                    logger.warning("Could not extend lease of job %s: %s: %s", lease.job_id, type(e).__name__, e)
+                    MetricsRegistry.default().inc("moderation_worker_heartbeat_errors_total", error=type(e).__name__)
+                    continue
+                if not extended:
+                    # Redelivered already (e.g. after a long pause); the broker
+                    # will reject this attempt's result
+                    MetricsRegistry.default().inc("moderation_worker_leases_lost_total")
+
+    def _run_job(self, lease: Lease):
+        started = time.time()
+        try:
+            payload = lease.payload
+            rules = RuleSet.from_config(payload["rules"]) if payload.get("rules") else None
+            result = self.moderator.process_video(
+                payload["video_path"], rules=rules, checkpoint=Checkpoint(self.broker, lease.job_id),
+                video_id=payload.get("video_id")
+            ).to_dict()
+            result["metadata"].update(job_id=lease.job_id, attempt=lease.attempt, worker=self.worker_id)
+            if self.sink is not None:
+                self.sink.write(lease.job_id, result)
+            outcome = "done" if self.broker.complete(lease, result) else "lease_lost"
+        except Exception as e:
+            delay = self.retry_delay * 2 ** (lease.attempt - 1)
+            self.broker.fail(lease, f"{type(e).__name__}: {e}", retry_delay=delay)
+            outcome = "failed"
+        finally:
+            with self._lock:
+                self._in_flight.pop(lease.job_id, None)
+                self.processed += 1
+            self._slots.release()
+        MetricsRegistry.default().inc("moderation_worker_jobs_total", outcome=outcome)
+        MetricsRegistry.default().observe("moderation_worker_job_seconds", time.time() - started)
+
+def enqueue_videos(broker: Broker, video_paths: List[str], rules: Optional[RuleSet] = None,
+                   max_attempts: int = 3) -> List[str]:
+    """
+    Queue one job per video; videos already queued with the same rules are not queued again.
+
+    Returns:
+        Job IDs, in input order
+    """
+    job_ids = []
+    for video_path in video_paths:
+        payload = {"video_path": os.path.abspath(video_path)}
+        if rules is not None:
+            payload["rules"] = rules.to_config()
+        job_id, _ = broker.enqueue(payload, max_attempts=max_attempts)
+        job_ids.append(job_id)
+    return job_ids
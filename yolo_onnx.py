@@ -0,0 +1,247 @@
+import os
+import ast
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import cv2
+import numpy as np
+import onnxruntime as ort
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from ultralytics import YOLO
+
+def export_onnx(weights: str, input_size: int = 640) -> str:
+    """
+    Export YOLO weights to ONNX with a dynamic batch axis, reusing a previous export.
+
+    Returns:
+        Path to the .onnx file
+    """
+    path = f"{os.path.splitext(weights)[0]}-{input_size}.onnx"
+    if not os.path.exists(path):
+        exported = YOLO(weights).export(format="onnx", imgsz=input_size, dynamic=True, simplify=True)
+        os.replace(exported, path)
+    return path
+
+def quantize_int8(onnx_path: str) -> str:
+    """
+    Quantize an ONNX model's weights to int8 (dynamic quantization), reusing a previous run.
+
+    Returns:
+        Path to the quantized .onnx file
+    """
+    path = onnx_path.replace(".onnx", "-int8.onnx")
+    if not os.path.exists(path):
+        quantize_dynamic(onnx_path, path, weight_type=QuantType.QUInt8)
+    return path
+
+def letterbox(images: Sequence[np.ndarray], size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Resize RGB images into size x size inputs, keeping aspect ratio and padding with grey.
+
+    Returns:
+        (NCHW float32 batch in [0, 1], scale per image, (pad_x, pad_y) per image)
+    """
+    batch = np.full((len(images), size, size, 3), 114, dtype=np.uint8)
+    scales = np.empty(len(images), dtype=np.float32)
+    pads = np.empty((len(images), 2), dtype=np.float32)
+    for i, image in enumerate(images):
+        height, width = image.shape[:2]
+        scale = min(size / height, size / width)
+        new_w, new_h = int(round(width * scale)), int(round(height * scale))
+        pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+        batch[i, pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(
+            image, (new_w, new_h), interpolation=cv2.INTER_LINEAR
+        )
+        scales[i] = scale
+        pads[i] = (pad_x, pad_y)
+    return batch.transpose(0, 3, 1, 2).astype(np.float32) / 255.0, scales, pads
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of xyxy boxes a (N, 4) and b (M, 4)"""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+def nms(boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray, iou_threshold: float,
+        max_candidates: int = 30000, max_keep: Optional[int] = None) -> np.ndarray:
+    """
+    Class-aware non-maximum suppression.
+
+    Only the max_candidates best-scoring boxes are considered (ultralytics'
+    max_nms). Boxes of different classes are shifted apart so they never
+    overlap; each kept box is then compared with the remaining candidates
+    only, so memory stays linear in their number and the loop runs once
+    per kept box.
+
+    Args:
+        boxes: xyxy boxes (N, 4)
+        scores: Confidence of each box
+        classes: Class of each box
+        iou_threshold: IoU above which the lower-scoring box is suppressed
+        max_candidates: Boxes considered, best first
+        max_keep: Stop after keeping this many boxes (default: no limit)
+
+    Returns:
+        Indices of the kept boxes, best first
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(-scores, kind="stable")[:max_candidates]
+    shifted = boxes + (classes * (boxes.max() + 1))[:, None]
+    keep = []
+    while len(order) and (max_keep is None or len(keep) < max_keep):
+        best, order = order[0], order[1:]
+        keep.append(best)
+        order = order[box_iou(shifted[best:best + 1], shifted[order])[0] <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+class YoloOnnxModel:
+    """YOLO detector running on ONNX Runtime's CPU execution provider"""
+
+    def __init__(self, onnx_path: str, input_size: int = 640, conf_threshold: float = 0.25,
+                 iou_threshold: float = 0.45, max_detections: int = 300, max_candidates: int = 30000,
+                 threads: Optional[int] = None):
+        """
+        Create inference session.
+
+        Args:
+            onnx_path: Path to an exported (optionally quantized) YOLO model
+            input_size: Square letterboxed input size the model was exported at
+            conf_threshold: Minimum class confidence of a detection
+            iou_threshold: IoU above which NMS suppresses the lower-scoring box
+            max_detections: Maximum detections kept per image
+            max_candidates: Most confident boxes per image that NMS considers
+            threads: Intra-op threads (default: ONNX Runtime's choice)
+        """
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names: Dict[int, str] = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+        self.input_size = input_size
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.max_detections = max_detections
+        self.max_candidates = max_candidates
+
+    def detect(self, images: Sequence[np.ndarray]) -> List[List[Dict]]:
+        """
+        Detect objects in a batch of RGB images with one forward pass.
+
+        Returns:
+            Detected objects for each image, in input order
+        """
+        if not images:
+            return []
+        batch, scales, pads = letterbox(images, self.input_size)
+        # (batch, 4 + classes, anchors) -> (batch, anchors, 4 + classes)
+        outputs = self.session.run(None, {self.input_name: batch})[0].transpose(0, 2, 1)
+        detections = []
+        for output, scale, pad, image in zip(outputs, scales, pads, images):
+            class_scores = output[:, 4:]
+            classes = class_scores.argmax(axis=1)
+            scores = class_scores[np.arange(len(classes)), classes]
+            mask = scores >= self.conf_threshold
+            cxcywh, classes, scores = output[mask, :4], classes[mask], scores[mask]
+
+            # Undo the letterbox: back to xyxy in original image pixels
+            boxes = np.concatenate([cxcywh[:, :2] - cxcywh[:, 2:] / 2, cxcywh[:, :2] + cxcywh[:, 2:] / 2], axis=1)
+            boxes = (boxes - np.tile(pad, 2)) / scale
+            height, width = image.shape[:2]
+            boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+            boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+
+            keep = nms(boxes, scores, classes, self.iou_threshold, self.max_candidates, self.max_detections)
+            detections.append([
+                {
+                    "class_id": int(classes[i]),
+                    "class_name": self.names.get(int(classes[i]), str(int(classes[i]))),
+                    "confidence": float(scores[i]),
+                    "bbox": [float(v) for v in boxes[i]]
+                }
+                for i in keep
+            ])
+        return detections
+
+def average_precision_50(reference: List[List[Dict]], predicted: List[List[Dict]]) -> float:
+    """
+    mAP@0.5 of predicted detections, taking reference detections as ground truth.
+
+    Used to measure the accuracy drift of a faster configuration against
+    the full-precision model on the same frames.
+    """
+    classes = {d["class_id"] for frame in reference for d in frame}
+    if not classes:
+        return 1.0
+    precisions = []
+    for class_id in classes:
+        truth = [np.array([d["bbox"] for d in frame if d["class_id"] == class_id]).reshape(-1, 4) for frame in reference]
+        candidates = sorted(
+            ((d["confidence"], i, d["bbox"]) for i, frame in enumerate(predicted) for d in frame if d["class_id"] == class_id),
+            key=lambda c: -c[0]
+        )
+        matched = [np.zeros(len(t), dtype=bool) for t in truth]
+        hits = []
+        for _, i, bbox in candidates:
+            hit = False
+            if len(truth[i]):
+                ious = box_iou(np.array([bbox]), truth[i])[0]
+                best = int(ious.argmax())
+                if ious[best] >= 0.5 and not matched[i][best]:
+                    matched[i][best] = hit = True
+            hits.append(hit)
+        total = sum(len(t) for t in truth)
+        hits = np.array(hits, dtype=bool)
+        if not len(hits):
+            precisions.append(0.0)
+            continue
+        true_positives = np.cumsum(hits)
+        recall = true_positives / total
+        precision = true_positives / np.arange(1, len(hits) + 1)
+        # Area under the monotone precision envelope
+        envelope = np.maximum.accumulate(precision[::-1])[::-1]
+        precisions.append(float(np.sum(np.diff(np.concatenate([[0.0], recall])) * envelope)))
+    return float(np.mean(precisions))
+
+def benchmark(weights: str, images: Sequence[np.ndarray], batch_sizes: Sequence[int] = (1, 4, 16),
+              precisions: Sequence[str] = ("fp32", "int8"), input_size: int = 640) -> List[Dict]:
+    """
+    Compare throughput and accuracy drift across batch sizes and precisions.
+
+    Args:
+        weights: YOLO weights to export
+        images: RGB frames to run (a representative sample of production frames)
+        batch_sizes: Batch sizes to time
+        precisions: "fp32" and/or "int8"
+        input_size: Letterboxed input size
+
+    Returns:
+        One {"precision", "batch_size", "fps", "map50_drift"} row per configuration;
+        drift is 1 - mAP@0.5 against fp32 detections at batch size 1
+    """
+    onnx_path = export_onnx(weights, input_size)
+    reference = YoloOnnxModel(onnx_path, input_size)
+    truth = [reference.detect([image])[0] for image in images]
+
+    rows = []
+    for precision in precisions:
+        model = YoloOnnxModel(quantize_int8(onnx_path) if precision == "int8" else onnx_path, input_size)
+        model.detect(images[:1])  # warm-up
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            detections = []
+            for i in range(0, len(images), batch_size):
+                detections.extend(model.detect(images[i:i + batch_size]))
+            elapsed = time.perf_counter() - start
+            rows.append({
+                "precision": precision,
+                "batch_size": batch_size,
+                "fps": len(images) / elapsed,
+                "map50_drift": 1.0 - average_precision_50(truth, detections)
+            })
+    return rows